@@ -0,0 +1,206 @@
+"""
+Dynamic batching of generate calls from concurrent episodes.
+
+A BatchScheduler sits in front of one HFModel. Coroutines await agenerate_response() as they
+would on the model; the scheduler collects the pending requests, waiting at most `max_wait`
+seconds after the first one, and answers up to `max_batch_size` of them with one call to
+model.generate_batch_with_info() on a worker thread, so the event loop keeps serving the other
+episodes (and queueing the next batch) meanwhile.
+
+    scheduler = BatchScheduler(SmollLLM(checkpoint), max_batch_size=16, max_wait=0.02)
+    await asyncio.gather(*(run_two_agents(scheduler, scheduler, ...) for _ in range(16)))
+    print(scheduler.stats.summary())
+"""
+import asyncio
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from agents.models import GenerationRequest, HFModel
+from agents.stopping import GenerationInfo, StopCondition
+
+
+class BatchStats:
+    """Batch occupancy counters of a BatchScheduler."""
+
+    def __init__(self, max_batch_size: int):
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self.requests = 0
+        self.batch_sizes: Counter = Counter()
+        self.decode_steps = 0
+        self.active_rows = 0
+        self.batch_rows = 0
+        self.wait_seconds = 0.0
+
+    def record_batch(self, size: int, waits: List[float]):
+        self.batches += 1
+        self.requests += size
+        self.batch_sizes[size] += 1
+        self.wait_seconds += sum(waits)
+
+    def record_step(self, active: int, rows: int):
+        self.decode_steps += 1
+        self.active_rows += active
+        self.batch_rows += rows
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        :return: batches and requests served, mean batch size, batch occupancy (mean batch size
+        over max_batch_size), decode occupancy (rows still generating over rows the batch started
+        with, averaged over decode steps), mean seconds a request waited to be batched, and the
+        batch size histogram.
+        """
+        mean_batch = self.requests / self.batches if self.batches else 0.0
+        return {
+            'batches': self.batches,
+            'requests': self.requests,
+            'mean_batch_size': mean_batch,
+            'batch_occupancy': mean_batch / self.max_batch_size,
+            'decode_occupancy': self.active_rows / self.batch_rows if self.batch_rows else 0.0,
+            'mean_wait': self.wait_seconds / self.requests if self.requests else 0.0,
+            'batch_sizes': dict(sorted(self.batch_sizes.items())),
+        }
+
+
+class _Pending:
+    def __init__(self, request: GenerationRequest, future: asyncio.Future):
+        self.request = request
+        self.future = future
+        self.queued = time.monotonic()
+
+
+class BatchScheduler:
+    """
+    Batches generate calls to one model from the coroutines of an event loop.
+
+    Exposes generate_response() and agenerate_response() like an HFModel, so it can be passed
+    to run_two_agents() in place of the model.
+    """
+
+    def __init__(self, model: HFModel, max_batch_size: int = 8, max_wait: float = 0.01):
+        """
+        :param model: The model answering the requests.
+        :param max_batch_size: Most requests decoded together.
+        :param max_wait: Seconds to wait for more requests after the first one of a batch.
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = BatchStats(max_batch_size)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-generate")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __getattr__(self, name: str) -> Any:
+        # Anything else (tokenizer, checkpoint, ...) is the model's.
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def generate_response(self, messages: List[Dict[str, str]], **kwargs: Any) -> str:
+        """Generate outside of any batch, for synchronous callers."""
+        return self.model.generate_response(messages, **kwargs)
+
+    async def agenerate_response(self, messages: List[Dict[str, str]], **kwargs: Any) -> str:
+        """
+        Queue a conversation for the next batch and wait for its response.
+
+        Calls with extra model.generate() arguments cannot share a batch and are generated on
+        their own.
+        """
+        response, _ = await self.agenerate_with_info(messages, **kwargs)
+        return response
+
+    async def agenerate_with_info(
+            self,
+            messages: List[Dict[str, str]],
+            max_new_tokens: int = 50,
+            temperature: float = 0.7,
+            top_p: float = 0.9,
+            top_k: int = 50,
+            do_sample: bool = True,
+            allowed_actions: Optional[Sequence[str]] = None,
+            stop: Optional[Sequence[StopCondition]] = None,
+            **kwargs: Any
+    ) -> Tuple[str, Optional[GenerationInfo]]:
+        """agenerate_response(), also returning the GenerationInfo of this very call."""
+        loop = asyncio.get_running_loop()
+        if kwargs:
+            if allowed_actions is not None:
+                kwargs['allowed_actions'] = allowed_actions
+            if stop is not None:
+                kwargs['stop'] = stop
+
+            def generate():
+                return self.model.generate_with_info(
+                    messages, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p, top_k=top_k,
+                    do_sample=do_sample, **kwargs)
+
+            return await loop.run_in_executor(self._executor, generate)
+
+        self._start(loop)
+        future = loop.create_future()
+        request = GenerationRequest(messages, max_new_tokens, temperature, top_p, top_k, do_sample, allowed_actions,
+                                    stop)
+        await self._queue.put(_Pending(request, future))
+        return await future
+
+    def _start(self, loop: asyncio.AbstractEventLoop):
+        # The queue and batching task belong to one loop; a new asyncio.run() gets new ones.
+        if self._loop is loop and self._task is not None and not self._task.done():
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._task = loop.create_task(self._run())
+
+    async def _collect(self) -> List[_Pending]:
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - self._loop.time()
+            try:
+                if timeout > 0:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                break
+        return [pending for pending in batch if not pending.future.done()]
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            now = time.monotonic()
+            self.stats.record_batch(len(batch), [now - pending.queued for pending in batch])
+            try:
+                results = await self._loop.run_in_executor(
+                    self._executor, self._generate_batch, [pending.request for pending in batch])
+            except Exception as exc:
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(exc)
+            else:
+                for pending, result in zip(batch, results):
+                    if not pending.future.done():
+                        pending.future.set_result(result)
+
+    def _generate_batch(self, requests: List[GenerationRequest]) -> List[Tuple[str, Optional[GenerationInfo]]]:
+        return self.model.generate_batch_with_info(requests, self.stats.record_step)
+
+    async def close(self):
+        """Stop batching; requests still queued are cancelled."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._queue is not None and not self._queue.empty():
+            self._queue.get_nowait().future.cancel()
+        self._executor.shutdown(wait=False)
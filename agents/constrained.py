@@ -0,0 +1,98 @@
+"""
+Constrained decoding of Defuser actions.
+
+The bomb state lists the exact commands the current module accepts. An ActionTrie holds their
+token sequences, each followed by end-of-sequence, and ActionLogitsProcessor masks every token
+that would leave the trie. Generation can then only produce one of the listed commands and
+stops right after it, in as many steps as the command has tokens.
+"""
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import torch
+from transformers import LogitsProcessor, PreTrainedTokenizer
+
+AVAILABLE_COMMANDS = "Available commands:"
+
+
+def available_actions(bomb_state: str) -> List[str]:
+    """
+    The commands listed under "Available commands:" in a state returned by the game server.
+
+    :return: The commands in order, empty if the state lists none.
+    """
+    if AVAILABLE_COMMANDS not in bomb_state:
+        return []
+    actions = []
+    for line in bomb_state.split(AVAILABLE_COMMANDS, 1)[1].splitlines()[1:]:
+        if not line.startswith("  ") or not line.strip():
+            break
+        actions.append(line.strip())
+    return actions
+
+
+class ActionTrie:
+    """Token trie of a set of actions, every action ending in an end-of-sequence token."""
+
+    def __init__(self, actions: Dict[str, Sequence[int]], eos_token_id: int):
+        """
+        :param actions: Token sequence of every action.
+        :param eos_token_id: Token that ends every action.
+        """
+        self.eos_token_id = eos_token_id
+        self.root: Dict[int, dict] = {}
+        self.depth = 0
+        self._actions: Dict[Tuple[int, ...], str] = {}
+        for action, sequence in actions.items():
+            node = self.root
+            for token in (*sequence, eos_token_id):
+                node = node.setdefault(token, {})
+            self.depth = max(self.depth, len(sequence) + 1)
+            self._actions[tuple(sequence)] = action
+
+    @classmethod
+    def from_actions(cls, actions: Iterable[str], tokenizer: PreTrainedTokenizer,
+                     eos_token_id: Optional[int] = None) -> "ActionTrie":
+        """Build the trie of actions as the tokenizer encodes them at the start of a response."""
+        if eos_token_id is None:
+            eos_token_id = tokenizer.eos_token_id
+        return cls({action: tokenizer.encode(action, add_special_tokens=False) for action in actions}, eos_token_id)
+
+    def allowed(self, generated: Sequence[int]) -> List[int]:
+        """Tokens that may follow the tokens generated so far (only end-of-sequence once off the trie)."""
+        node = self.root
+        for token in generated:
+            node = node.get(token)
+            if node is None:
+                return [self.eos_token_id]
+        return list(node) or [self.eos_token_id]
+
+    def action(self, generated: Sequence[int]) -> Optional[str]:
+        """The action spelled by the generated tokens (with or without the end-of-sequence token), if any."""
+        generated = tuple(generated)
+        if generated and generated[-1] == self.eos_token_id:
+            generated = generated[:-1]
+        return self._actions.get(generated)
+
+    def mask(self, scores: torch.Tensor, generated: Sequence[int]) -> torch.Tensor:
+        """scores (V,) with every token not allowed after `generated` set to -inf."""
+        masked = torch.full_like(scores, float("-inf"))
+        allowed = torch.tensor(self.allowed(generated), device=scores.device)
+        masked[allowed] = scores[allowed]
+        return masked
+
+
+class ActionLogitsProcessor(LogitsProcessor):
+    """Restricts model.generate() to the actions of an ActionTrie, for every row of the batch."""
+
+    def __init__(self, trie: ActionTrie, prompt_length: int):
+        """
+        :param trie: The allowed actions.
+        :param prompt_length: Length of the (padded) prompt, the tokens after it are the response.
+        """
+        self.trie = trie
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        for row in range(scores.shape[0]):
+            scores[row] = self.trie.mask(scores[row], input_ids[row, self.prompt_length:].tolist())
+        return scores
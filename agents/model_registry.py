@@ -0,0 +1,282 @@
+"""
+One loaded copy of each model, shared by the roles that use it.
+
+The Defuser and Expert usually run the same checkpoint. Instead of constructing a SmollLLM for
+each, ask the registry for a handle per role:
+
+    defuser_model = registry.get(USED_MODEL, "defuser")
+    expert_model = registry.get(USED_MODEL, "expert")
+
+Handles with the same (checkpoint, device, dtype, mmap_weights) share one model and tokenizer,
+where dtype is the one the weights are loaded in (see agents.shared_weights.load_dtype). The model is
+loaded on the first generate call through any of its handles, and can be unloaded again (by
+hand, when idle, or when the loaded models exceed a memory budget) to be reloaded on next use.
+Every handle reports the load time and resident memory it caused.
+"""
+import gc
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import torch
+
+from agents.models import GenerationRequest, HFModel, SmollLLM
+from agents.shared_weights import load_dtype
+from agents.stopping import GenerationInfo, GenerationLog
+
+# (checkpoint, device, dtype the weights are loaded in, mmap_weights)
+ModelKey = Tuple[str, str, torch.dtype, bool]
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (the peak where the current one is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class SharedModel:
+    """A checkpoint loaded at most once, and the bookkeeping of the handles using it."""
+
+    def __init__(self, key: ModelKey, model_class: type, model_kwargs: Dict[str, Any]):
+        self.key = key
+        self.model_class = model_class
+        self.model_kwargs = model_kwargs
+        self.llm: Optional[HFModel] = None
+        self.roles: List[str] = []
+        self.loads = 0
+        self.in_use = 0
+        self.last_used = 0.0
+        self.lock = threading.RLock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.llm is not None
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the weights and buffers, 0 when unloaded."""
+        if self.llm is None:
+            return 0
+        tensors = list(self.llm.model.parameters()) + list(self.llm.model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def load(self) -> Tuple[HFModel, float, int]:
+        """
+        :return: The model, and the seconds and resident bytes spent loading it (0 if it was loaded already).
+        """
+        with self.lock:
+            self.last_used = time.monotonic()
+            if self.llm is not None:
+                return self.llm, 0.0, 0
+            checkpoint, device, dtype, mmap_weights = self.key
+            rss, start = current_rss(), time.perf_counter()
+            self.llm = self.model_class(checkpoint, device=device, dtype=dtype, mmap_weights=mmap_weights,
+                                        **self.model_kwargs)
+            self.loads += 1
+            return self.llm, time.perf_counter() - start, max(current_rss() - rss, 0)
+
+    def unload(self) -> bool:
+        """Drop the model unless a generate call is using it."""
+        with self.lock:
+            if self.llm is None or self.in_use:
+                return False
+            self.llm = None
+        gc.collect()
+        return True
+
+
+class ModelHandle(HFModel):
+    """
+    A role's view of a SharedModel. Behaves like the model itself, loading it when first needed.
+    """
+
+    def __init__(self, shared: SharedModel, role: str, registry: "ModelRegistry"):
+        # The weights belong to the shared model, so HFModel.__init__ is not called.
+        self.shared = shared
+        self.role = role
+        self.registry = registry
+        self.load_seconds = 0.0
+        self.rss_bytes = 0
+        self.loads = 0
+        self.generation_log: GenerationLog = GenerationLog()
+
+    @property
+    def checkpoint(self) -> str:
+        return self.shared.key[0]
+
+    @property
+    def device(self) -> str:
+        return self.shared.key[1]
+
+    @property
+    def dtype(self) -> torch.dtype:
+        return self.shared.key[2]
+
+    @property
+    def mmap_weights(self) -> bool:
+        return self.shared.key[3]
+
+    @property
+    def model_class(self) -> type:
+        return self.shared.model_class
+
+    @property
+    def llm(self) -> HFModel:
+        """The shared model, loaded if necessary."""
+        with self._use() as llm:
+            return llm
+
+    @property
+    def tokenizer(self):
+        return self.llm.tokenizer
+
+    @property
+    def model(self):
+        return self.llm.model
+
+    @property
+    def prefix_cache(self):
+        return self.llm.prefix_cache
+
+    @contextmanager
+    def _use(self):
+        shared = self.shared
+        with shared.lock:
+            llm, seconds, rss = shared.load()
+            shared.in_use += 1
+        if seconds:
+            self.load_seconds += seconds
+            self.rss_bytes += rss
+            self.loads += 1
+            self.registry.trim(keep=shared)
+        try:
+            yield llm
+        finally:
+            with shared.lock:
+                shared.in_use -= 1
+                shared.last_used = time.monotonic()
+
+    def generate_response(self, messages: List[Dict[str, str]], **kwargs: Any) -> str:
+        return self.generate_with_info(messages, **kwargs)[0]
+
+    def generate_with_info(self, messages: List[Dict[str, str]], **kwargs: Any) -> Tuple[str, Optional[GenerationInfo]]:
+        with self._use() as llm:
+            response, info = llm.generate_with_info(messages, **kwargs)
+            self.generation_log.append(info)
+            return response, info
+
+    def generate_batch_with_info(
+            self,
+            requests: List[GenerationRequest],
+            on_step: Optional[Callable[[int, int], None]] = None
+    ) -> List[Tuple[str, Optional[GenerationInfo]]]:
+        with self._use() as llm:
+            results = llm.generate_batch_with_info(requests, on_step)
+            self.generation_log.extend(info for _, info in results)
+            return results
+
+    def unload(self) -> bool:
+        """Unload the shared model (for every handle using it)."""
+        return self.shared.unload()
+
+    def report(self) -> Dict[str, Any]:
+        """
+        :return: The handle's role and model, whether the model is loaded and the size of its
+        weights, which roles share it, and the load time and resident memory this handle's calls caused.
+        """
+        return {
+            'role': self.role,
+            'checkpoint': self.checkpoint,
+            'device': self.device,
+            'dtype': str(self.dtype) if self.dtype is not None else None,
+            'loaded': self.shared.loaded,
+            'weight_bytes': self.shared.nbytes,
+            'shared_with': [role for role in self.shared.roles if role != self.role],
+            'loads': self.loads,
+            'load_seconds': self.load_seconds,
+            'rss_bytes': self.rss_bytes,
+        }
+
+
+class ModelRegistry:
+    """Deduplicates models by (checkpoint, device, dtype, mmap_weights) and hands out per-role handles."""
+
+    def __init__(self, max_loaded_bytes: Optional[int] = None):
+        """
+        :param max_loaded_bytes: Weight memory above which the least recently used idle models are
+        unloaded after a load (None for no limit).
+        """
+        self.max_loaded_bytes = max_loaded_bytes
+        self._models: Dict[ModelKey, SharedModel] = {}
+        self._handles: List[ModelHandle] = []
+        self._lock = threading.Lock()
+
+    def get(self, checkpoint: str, role: str, device: str = "cpu", dtype: Optional[torch.dtype] = None,
+            mmap_weights: bool = False, model_class: type = SmollLLM, **model_kwargs: Any) -> ModelHandle:
+        """
+        Get a handle on a model, sharing it with every other handle of the same (checkpoint, device, dtype,
+        mmap_weights).
+
+        :param checkpoint: The model checkpoint name or path.
+        :param role: Name of the user of the handle, for reports.
+        :param device: Device to load the model on.
+        :param dtype: Weight dtype, as for HFModel: float32, or the stored dtype when memory-mapping, if None.
+        :param mmap_weights: Memory-map the weights, see HFModel.
+        :param model_class: HFModel subclass to load, used by the first handle of a model.
+        :param model_kwargs: Further constructor arguments, used by the first handle of a model.
+        """
+        key = (checkpoint, device, load_dtype(checkpoint, dtype, mmap_weights), mmap_weights)
+        with self._lock:
+            shared = self._models.get(key)
+            if shared is None:
+                shared = self._models[key] = SharedModel(key, model_class, model_kwargs)
+            shared.roles.append(role)
+            handle = ModelHandle(shared, role, self)
+            self._handles.append(handle)
+        return handle
+
+    def loaded_bytes(self) -> int:
+        return sum(shared.nbytes for shared in self._models.values())
+
+    def trim(self, max_bytes: Optional[int] = None, keep: Optional[SharedModel] = None) -> int:
+        """
+        Unload least recently used idle models until the loaded weights fit in max_bytes.
+
+        :param max_bytes: Budget, the registry's max_loaded_bytes if None.
+        :param keep: A model never to unload.
+        :return: Number of models unloaded.
+        """
+        max_bytes = self.max_loaded_bytes if max_bytes is None else max_bytes
+        if max_bytes is None:
+            return 0
+        unloaded = 0
+        for shared in sorted(self._models.values(), key=lambda s: s.last_used):
+            if self.loaded_bytes() <= max_bytes:
+                break
+            if shared is not keep and shared.unload():
+                unloaded += 1
+        return unloaded
+
+    def unload_idle(self, idle_seconds: float) -> int:
+        """Unload models that no handle has used for idle_seconds. Returns the number unloaded."""
+        now = time.monotonic()
+        return sum(shared.unload() for shared in list(self._models.values())
+                   if shared.loaded and now - shared.last_used >= idle_seconds)
+
+    def unload(self, checkpoint: Optional[str] = None) -> int:
+        """Unload every idle model (of one checkpoint, if given). Returns the number unloaded."""
+        return sum(shared.unload() for shared in list(self._models.values())
+                   if checkpoint is None or shared.key[0] == checkpoint)
+
+    def report(self) -> List[Dict[str, Any]]:
+        """The report of every handle handed out, in order."""
+        return [handle.report() for handle in self._handles]
+
+
+registry = ModelRegistry()
@@ -1,7 +1,69 @@
+import time
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
+from dataclasses import dataclass
+from typing import Callable, List, Dict, Any, Optional, Sequence, Tuple
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, PreTrainedModel, PreTrainedTokenizer
+from transformers import (AutoModelForCausalLM, AutoTokenizer, DynamicCache, LogitsProcessorList, PreTrainedModel,
+                          PreTrainedTokenizer, StoppingCriteriaList)
+
+from agents.constrained import ActionLogitsProcessor, ActionTrie
+from agents.prefix_cache import PrefixCache
+from agents.shared_weights import load_mmap_model
+from agents.stopping import (FirstToken, GenerationCallback, GenerationInfo, GenerationLog, StopCondition,
+                             StopOnConditions, first_reason, stop_reason)
+
+
+@dataclass
+class GenerationRequest:
+    """One conversation to answer in a batch, with its own generation parameters."""
+    messages: List[Dict[str, str]]
+    max_new_tokens: int = 50
+    temperature: float = 0.7
+    top_p: float = 0.9
+    top_k: int = 50
+    do_sample: bool = True
+    allowed_actions: Optional[Sequence[str]] = None
+    stop: Optional[Sequence[StopCondition]] = None
+
+
+def sample_next_tokens(
+        logits: torch.Tensor,
+        temperature: torch.Tensor,
+        top_p: torch.Tensor,
+        top_k: torch.Tensor,
+        do_sample: torch.Tensor
+) -> torch.Tensor:
+    """
+    Pick the next token of every row, each with its own sampling parameters.
+
+    Temperature, top-k and top-p are applied in the same order as model.generate() does.
+
+    :param logits: (B, V) next-token logits.
+    :param temperature: (B,) sampling temperatures.
+    :param top_p: (B,) nucleus sampling cutoffs (1.0 to disable).
+    :param top_k: (B,) top-k cutoffs (0 to disable).
+    :param do_sample: (B,) whether to sample, greedy decoding otherwise.
+    :return: (B,) token ids.
+    """
+    greedy = logits.argmax(dim=-1)
+    if not do_sample.any():
+        return greedy
+
+    vocab_size = logits.shape[-1]
+    scaled = logits / temperature.clamp_min(1e-5)[:, None]
+    sorted_logits, sorted_ids = scaled.sort(dim=-1, descending=True)
+    ranks = torch.arange(vocab_size, device=logits.device)[None]
+    top_k = torch.where(top_k > 0, top_k, vocab_size).clamp_max(vocab_size)
+    sorted_logits = sorted_logits.masked_fill(ranks >= top_k[:, None], float("-inf"))
+
+    # Keep the most likely tokens until their probability reaches top_p, and always the first one.
+    probs = sorted_logits.softmax(dim=-1)
+    outside = ((probs.cumsum(dim=-1) - probs) >= top_p[:, None]) & (top_p < 1.0)[:, None]
+    outside[:, 0] = False
+    sorted_logits = sorted_logits.masked_fill(outside, float("-inf"))
+
+    choice = torch.multinomial(sorted_logits.softmax(dim=-1), 1)
+    return torch.where(do_sample, sorted_ids.gather(-1, choice)[:, 0], greedy)
 
 
 class HFModel(ABC):
@@ -10,17 +72,65 @@ class HFModel(ABC):
     Subclasses must implement 'generate_response'.
     """
 
-    def __init__(self, checkpoint: str, device: str = "cpu") -> None:
+    def __init__(self, checkpoint: str, device: str = "cpu", prefix_cache_bytes: int = 512 * 2 ** 20,
+                 dtype: Optional[torch.dtype] = None, mmap_weights: bool = False) -> None:
         """
         Initialize a Hugging Face model and tokenizer.
 
         :param checkpoint: The model checkpoint name or path (from Hugging Face Hub).
         :param device: The device on which to load the model ('cpu' or 'cuda').
+        :param prefix_cache_bytes: Memory budget for reusing the key/value states of shared prompt prefixes (0 to disable).
+        :param dtype: Weight dtype; if None, float32, or the stored dtype when memory-mapping
+        (see agents.shared_weights.load_dtype). self.dtype is the dtype the weights ended up with.
+        :param mmap_weights: Memory-map the safetensors weights read-only instead of loading a private copy,
+        so that processes loading the same checkpoint share one copy (CPU only).
         """
         self.checkpoint = checkpoint
         self.device = device
+        self.mmap_weights = mmap_weights
         self.tokenizer: PreTrainedTokenizer = AutoTokenizer.from_pretrained(checkpoint)
-        self.model: PreTrainedModel = AutoModelForCausalLM.from_pretrained(checkpoint).to(device)
+        if mmap_weights:
+            if device != "cpu":
+                raise ValueError("Memory-mapped weights can only be used on the CPU.")
+            self.model: PreTrainedModel = load_mmap_model(checkpoint, dtype)
+        else:
+            self.model: PreTrainedModel = AutoModelForCausalLM.from_pretrained(checkpoint, torch_dtype=dtype).to(device)
+        self.dtype: torch.dtype = self.model.dtype
+        self.prefix_cache: Optional[PrefixCache] = PrefixCache(prefix_cache_bytes) if prefix_cache_bytes else None
+        self._action_tries: Dict[Tuple[str, ...], ActionTrie] = {}
+        self.generation_log: GenerationLog = GenerationLog()
+
+    @property
+    def last_generation(self) -> Optional[GenerationInfo]:
+        """Token counts, prefill and decode time and stop reason of the latest generate call."""
+        return self.generation_log[-1] if self.generation_log else None
+
+    def generation_stats(self) -> Dict[str, object]:
+        """Token counts, throughput and stop reasons of the recent calls, and token totals of all calls."""
+        return self.generation_log.summary()
+
+    def add_generation_callback(self, callback: GenerationCallback) -> GenerationCallback:
+        """Call callback with the GenerationInfo of every later generate call (can be used as a decorator)."""
+        self.generation_log.callbacks.append(callback)
+        return callback
+
+    def remove_generation_callback(self, callback: GenerationCallback):
+        self.generation_log.callbacks.remove(callback)
+
+    def eos_token_ids(self) -> List[int]:
+        """Tokens that end generation, the first one being the one constrained decoding emits."""
+        eos_ids = self.model.generation_config.eos_token_id
+        if eos_ids is None:
+            eos_ids = self.tokenizer.eos_token_id
+        return list(eos_ids) if isinstance(eos_ids, (list, tuple)) else [eos_ids] if eos_ids is not None else []
+
+    def action_trie(self, actions: Sequence[str]) -> ActionTrie:
+        """The token trie of a list of actions, built once per list."""
+        key = tuple(actions)
+        trie = self._action_tries.get(key)
+        if trie is None:
+            trie = self._action_tries[key] = ActionTrie.from_actions(key, self.tokenizer, self.eos_token_ids()[0])
+        return trie
 
     @abstractmethod
     def generate_response(
@@ -45,11 +155,83 @@ class HFModel(ABC):
         :param top_p: The cumulative probability for nucleus sampling.
         :param top_k: The number of highest probability vocabulary tokens to keep for top-k-filtering.
         :param do_sample: Whether or not to use sampling; use greedy decoding otherwise.
-        :param kwargs: Additional model.generate() parameters as needed.
+        :param kwargs: Additional model.generate() parameters as needed. Subclasses accept
+               allowed_actions, a list of commands the response must be exactly one of, and stop,
+               a list of StopCondition ending generation early.
         :return: The generated text response as a string.
         """
         pass
 
+    def generate_with_info(self, messages: List[Dict[str, str]], **kwargs: Any) -> Tuple[str, Optional[GenerationInfo]]:
+        """
+        generate_response(), also returning the GenerationInfo of this very call. Callers should use this
+        rather than last_generation, which another call on the same model (a shared one, or another thread)
+        may have replaced by then. Subclasses override it; this default can only pair the response with
+        last_generation.
+        """
+        response = self.generate_response(messages, **kwargs)
+        return response, self.last_generation
+
+    def generate_batch(
+            self,
+            requests: List[GenerationRequest],
+            on_step: Optional[Callable[[int, int], None]] = None
+    ) -> List[str]:
+        """
+        Answer several conversations at once. Subclasses that can decode a padded batch override
+        this; the default answers them one after the other.
+
+        :param requests: Conversations and their generation parameters.
+        :param on_step: Called after every decode step with (active rows, rows in the batch).
+        :return: The generated text of every request, in order.
+        """
+        return [response for response, _ in self.generate_batch_with_info(requests, on_step)]
+
+    def generate_batch_with_info(
+            self,
+            requests: List[GenerationRequest],
+            on_step: Optional[Callable[[int, int], None]] = None
+    ) -> List[Tuple[str, Optional[GenerationInfo]]]:
+        """
+        generate_batch(), also returning the GenerationInfo of every request, so that callers need not
+        look them up in the generation log, which other calls may append to at the same time.
+        Subclasses override this rather than generate_batch().
+
+        :return: The generated text and GenerationInfo of every request, in order.
+        """
+        results = []
+        for request in requests:
+            kwargs = {} if request.allowed_actions is None else {'allowed_actions': request.allowed_actions}
+            if request.stop:
+                kwargs['stop'] = request.stop
+            results.append(self.generate_with_info(
+                request.messages,
+                max_new_tokens=request.max_new_tokens,
+                temperature=request.temperature,
+                top_p=request.top_p,
+                top_k=request.top_k,
+                do_sample=request.do_sample,
+                **kwargs
+            ))
+            if on_step is not None:
+                on_step(1, 1)
+        return results
+
+    async def agenerate_response(self, messages: List[Dict[str, str]], **kwargs: Any) -> str:
+        """
+        generate_response() for coroutines. The plain model simply generates in place; a
+        BatchScheduler in front of it batches concurrent calls instead.
+        """
+        return self.generate_response(messages, **kwargs)
+
+    async def agenerate_with_info(
+            self,
+            messages: List[Dict[str, str]],
+            **kwargs: Any
+    ) -> Tuple[str, Optional[GenerationInfo]]:
+        """agenerate_response(), also returning the GenerationInfo of this very call."""
+        return self.generate_with_info(messages, **kwargs)
+
 
 class SmollLLM(HFModel):
 
@@ -61,10 +243,32 @@ class SmollLLM(HFModel):
             top_p: float = 0.9,
             top_k: int = 50,
             do_sample: bool = True,
+            allowed_actions: Optional[Sequence[str]] = None,
+            stop: Optional[Sequence[StopCondition]] = None,
             **kwargs: Any
     ) -> str:
         """
-        Generates a text response given a list of chat-like messages.
+        Generates a text response given a list of chat-like messages, see generate_with_info().
+
+        :return: The generated text as a string.
+        """
+        return self.generate_with_info(messages, max_new_tokens, temperature, top_p, top_k, do_sample,
+                                       allowed_actions, stop, **kwargs)[0]
+
+    def generate_with_info(
+            self,
+            messages: List[Dict[str, str]],
+            max_new_tokens: int = 50,
+            temperature: float = 0.7,
+            top_p: float = 0.9,
+            top_k: int = 50,
+            do_sample: bool = True,
+            allowed_actions: Optional[Sequence[str]] = None,
+            stop: Optional[Sequence[StopCondition]] = None,
+            **kwargs: Any
+    ) -> Tuple[str, GenerationInfo]:
+        """
+        Generates a text response given a list of chat-like messages, and its GenerationInfo.
 
         :param messages: A list of { "role": "system"/"user"/"assistant", "content": str }.
         :param max_new_tokens: Max number of new tokens to generate in the response.
@@ -72,9 +276,14 @@ class SmollLLM(HFModel):
         :param top_p: Nucleus sampling probability cutoff.
         :param top_k: Top-k filtering cutoff.
         :param do_sample: Whether or not to sample (True) or do greedy decode (False).
+        :param allowed_actions: If given, the response is exactly one of these commands, sampled token
+               by token among the ones that keep it a prefix of a command, and nothing else.
+        :param stop: Conditions on the generated text that end generation as soon as one holds.
         :param kwargs: Additional parameters to pass to model.generate().
-        :return: The generated text as a string.
+        :return: The generated text as a string, and the call's GenerationInfo (also added to the generation log).
         """
+        started = time.perf_counter()
+
         # 1) Build the chat prompt for SmolLM. The custom method
         #    'apply_chat_template' helps format messages into a single prompt.
         input_text: str = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
@@ -82,7 +291,31 @@ class SmollLLM(HFModel):
         # 2) Tokenize the prompt
         inputs = self.tokenizer.encode(input_text, return_tensors="pt").to(self.device)
 
-        # 3) Generate output with the provided generation parameters
+        # 3) Start from the cached states of the longest prompt prefix seen before, if any,
+        #    so that only the rest of the prompt is prefilled
+        past_key_values = None
+        if self.prefix_cache is not None:
+            past_key_values, _ = self.prefix_cache.lookup(inputs)
+
+        # 4) When the response must be one of the given commands, mask all tokens that leave their trie
+        if allowed_actions:
+            trie = self.action_trie(allowed_actions)
+            processors = LogitsProcessorList(kwargs.pop('logits_processor', None) or [])
+            processors.append(ActionLogitsProcessor(trie, inputs.shape[-1]))
+            kwargs['logits_processor'] = processors
+            max_new_tokens = trie.depth
+
+        # 5) End as soon as the text satisfies a stop condition, and note when the first token is out
+        first_token = FirstToken()
+        criteria = StoppingCriteriaList(kwargs.pop('stopping_criteria', None) or [])
+        criteria.append(first_token)
+        stopper = None
+        if stop:
+            stopper = StopOnConditions(stop, self.tokenizer, inputs.shape[-1])
+            criteria.append(stopper)
+        kwargs['stopping_criteria'] = criteria
+
+        # 6) Generate output with the provided generation parameters
         with torch.no_grad():
             outputs = self.model.generate(
                 inputs,
@@ -91,16 +324,146 @@ class SmollLLM(HFModel):
                 top_p=top_p,
                 top_k=top_k,
                 do_sample=do_sample,
+                past_key_values=past_key_values,
+                return_dict_in_generate=True,
                 **kwargs
             )
 
+        if self.prefix_cache is not None and isinstance(outputs.past_key_values, DynamicCache):
+            self.prefix_cache.store(inputs, outputs.past_key_values)
+
         input_length = inputs.shape[-1]
-        generated_tokens = outputs[0][input_length:]
+        generated_tokens = outputs.sequences[0][input_length:]
+        seconds = time.perf_counter() - started
+        prefill_seconds = first_token.time - started if first_token.time is not None else seconds
+        info = GenerationInfo(
+            prompt_tokens=input_length,
+            new_tokens=len(generated_tokens),
+            seconds=seconds,
+            stop_reason=stop_reason(generated_tokens.tolist(), self.eos_token_ids(), max_new_tokens,
+                                    stopper.reasons.get(0) if stopper else None),
+            prefill_seconds=prefill_seconds,
+            decode_seconds=seconds - prefill_seconds
+        )
+        self.generation_log.append(info)
 
-        # 4) Decode the tokens to a string
+        # 7) Decode the tokens to a string
+        if allowed_actions:
+            return self._constrained_text(trie, generated_tokens.tolist()), info
         generated_text: str = self.tokenizer.decode(generated_tokens)
 
-        return generated_text
+        return generated_text, info
+
+    def generate_batch_with_info(
+            self,
+            requests: List[GenerationRequest],
+            on_step: Optional[Callable[[int, int], None]] = None
+    ) -> List[Tuple[str, Optional[GenerationInfo]]]:
+        """
+        Decode a left-padded batch of conversations, each with its own generation parameters.
+
+        Rows leave the batch as soon as they produce an end-of-sequence token or reach their
+        max_new_tokens, so finished conversations cost nothing in later decode steps. Rows with
+        allowed_actions are constrained to one of them and rows with stop conditions end when one
+        holds, as in generate_response(). Every request is added to the generation log.
+
+        :param requests: Conversations and their generation parameters.
+        :param on_step: Called after every decode step with (active rows, rows in the batch).
+        :return: The generated text and GenerationInfo of every request, in order.
+        """
+        started = time.perf_counter()
+        prompts = [
+            self.tokenizer.encode(self.tokenizer.apply_chat_template(r.messages, tokenize=False, add_generation_prompt=True))
+            for r in requests
+        ]
+        batch_size, width = len(prompts), max(len(p) for p in prompts)
+        pad_id = self.tokenizer.pad_token_id
+        if pad_id is None:
+            pad_id = self.tokenizer.eos_token_id or 0
+
+        input_ids = torch.full((batch_size, width), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((batch_size, width), dtype=torch.long)
+        for i, prompt in enumerate(prompts):
+            input_ids[i, width - len(prompt):] = torch.tensor(prompt)
+            attention_mask[i, width - len(prompt):] = 1
+        input_ids, attention_mask = input_ids.to(self.device), attention_mask.to(self.device)
+        position_ids = (attention_mask.cumsum(dim=-1) - 1).clamp_min(0)
+
+        temperature = torch.tensor([r.temperature for r in requests], dtype=torch.float, device=self.device)
+        top_p = torch.tensor([r.top_p for r in requests], dtype=torch.float, device=self.device)
+        top_k = torch.tensor([r.top_k for r in requests], dtype=torch.long, device=self.device)
+        do_sample = torch.tensor([r.do_sample for r in requests], device=self.device)
+        eos_ids = set(self.eos_token_ids())
+        tries = [self.action_trie(r.allowed_actions) if r.allowed_actions else None for r in requests]
+        max_new_tokens = [trie.depth if trie else r.max_new_tokens for r, trie in zip(requests, tries)]
+        for request in requests:
+            for condition in request.stop or ():
+                condition.start()
+        reasons: List[Optional[str]] = [None] * batch_size
+        finished = [0.0] * batch_size
+        prefill_seconds: Optional[float] = None
+
+        generated: List[List[int]] = [[] for _ in requests]
+        rows = torch.arange(batch_size, device=self.device)  # request index of every batch row
+        cache = DynamicCache()
+        with torch.no_grad():
+            while len(rows):
+                logits = self.model(
+                    input_ids=input_ids,
+                    attention_mask=attention_mask,
+                    position_ids=position_ids,
+                    past_key_values=cache,
+                    use_cache=True
+                ).logits[:, -1, :].float()
+                for j, row in enumerate(rows.tolist()):
+                    if tries[row] is not None:
+                        logits[j] = tries[row].mask(logits[j], generated[row])
+                tokens = sample_next_tokens(logits, temperature[rows], top_p[rows], top_k[rows], do_sample[rows])
+                if prefill_seconds is None:
+                    prefill_seconds = time.perf_counter() - started
+
+                keep = []
+                for j, (row, token) in enumerate(zip(rows.tolist(), tokens.tolist())):
+                    generated[row].append(token)
+                    if requests[row].stop:
+                        text = self.tokenizer.decode(generated[row], skip_special_tokens=True)
+                        reasons[row] = first_reason(requests[row].stop, text)
+                    if reasons[row] is None and token not in eos_ids and len(generated[row]) < max_new_tokens[row]:
+                        keep.append(j)
+                    else:
+                        finished[row] = time.perf_counter() - started
+                if on_step is not None:
+                    on_step(len(rows), batch_size)
+
+                if len(keep) < len(rows):
+                    keep = torch.tensor(keep, dtype=torch.long, device=self.device)
+                    cache.batch_select_indices(keep)
+                    rows, tokens = rows[keep], tokens[keep]
+                    attention_mask, position_ids = attention_mask[keep], position_ids[keep]
+                input_ids = tokens[:, None]
+                attention_mask = torch.cat([attention_mask, attention_mask.new_ones((len(rows), 1))], dim=-1)
+                position_ids = position_ids[:, -1:] + 1
+
+        results = []
+        for row, (tokens, trie) in enumerate(zip(generated, tries)):
+            info = GenerationInfo(
+                prompt_tokens=len(prompts[row]),
+                new_tokens=len(tokens),
+                seconds=finished[row],
+                stop_reason=stop_reason(tokens, eos_ids, max_new_tokens[row], reasons[row]),
+                prefill_seconds=prefill_seconds or 0.0,
+                decode_seconds=finished[row] - (prefill_seconds or 0.0)
+            )
+            self.generation_log.append(info)
+            results.append((self._constrained_text(trie, tokens) if trie else self.tokenizer.decode(tokens), info))
+        return results
+
+    def _constrained_text(self, trie: ActionTrie, tokens: List[int]) -> str:
+        # The trie knows which action the tokens spell; decoding is only needed if generation was cut short.
+        action = trie.action(tokens)
+        if action is None:
+            action = self.tokenizer.decode(tokens, skip_special_tokens=True).strip()
+        return action
 
 
 if __name__ == "__main__":
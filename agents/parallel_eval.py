@@ -0,0 +1,272 @@
+"""
+Parallel grid evaluation of the two-agent setup.
+
+Every (configuration, attempt) pair is an independent task. Tasks are fanned out over a pool of
+worker processes, each of which loads its Defuser and Expert models once (a single copy when
+they use the same checkpoint) and plays every attempt on its own server-side episode, so
+attempts never share a bomb. Each task's seed seeds both its sampling and its bomb, and results
+are merged in grid order, so the output does not depend on the number of workers or on which
+worker ran which task. Every attempt is written to a ResultsStore as soon as
+it completes, and a sweep restarted on the same store only runs the attempts it is missing.
+
+    python -m agents.parallel_eval --workers 8 --attempts 3 --results ../results
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from tqdm import tqdm
+
+from agents.model_registry import registry
+from agents.models import HFModel
+from agents.response_cache import CachedModel, ResponseCache
+from agents.results_store import ResultsStore
+from agents.shared_weights import load_dtype
+from agents.tracing import NULL_TRACER, Tracer
+from agents.two_agents import run_two_agents
+
+MODES = ['natural', 'markdown', 'json']
+TEMPERATURES = [0.2, 0.7, 1.]
+TOP_PS = [0.3, 0.6, 0.9]
+TOP_KS = [25, 50, 75]
+
+Config = Tuple[str, float, float, int]
+
+# Per-process state of a worker, set up once by _init_worker.
+_defuser_model: Optional[HFModel] = None
+_expert_model: Optional[HFModel] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_tracer = NULL_TRACER
+
+
+def grid(modes=MODES, temperatures=TEMPERATURES, top_ps=TOP_PS, top_ks=TOP_KS) -> List[Config]:
+    """All (mode, temperature, top_p, top_k) configurations, in evaluation order."""
+    return list(itertools.product(modes, temperatures, top_ps, top_ks))
+
+
+def _init_worker(defuser_checkpoint: str, expert_checkpoint: str, device: str, threads: int, mmap_weights: bool,
+                 response_cache: Optional[ResponseCache], trace_dir: Optional[str]):
+    global _defuser_model, _expert_model, _loop, _tracer
+    torch.set_num_threads(threads)
+    _defuser_model = registry.get(defuser_checkpoint, "defuser", device=device, mmap_weights=mmap_weights)
+    _expert_model = registry.get(expert_checkpoint, "expert", device=device, mmap_weights=mmap_weights)
+    if response_cache is not None:
+        _defuser_model = CachedModel(_defuser_model, response_cache)
+        _expert_model = CachedModel(_expert_model, response_cache)
+    # One loop per worker, so the pooled server connection is reused across attempts.
+    _loop = asyncio.new_event_loop()
+    if trace_dir is not None:
+        _tracer = Tracer(os.path.join(trace_dir, "trace-{pid}.jsonl"))
+
+
+def _run_attempt(config_index: int, config: Config, attempt: int, seed: int, run_id: str,
+                 server_url: str, run_kwargs: dict) -> Tuple[int, int, Dict[str, Any]]:
+    mode, temperature, top_p, top_k = config
+    episode_id = f"{run_id}-{config_index}-{attempt}"
+    torch.manual_seed(seed)
+    started = time.perf_counter()
+    result = _loop.run_until_complete(
+        run_two_agents(
+            defuser_model=_defuser_model,
+            expert_model=_expert_model,
+            server_url=server_url,
+            mode=mode,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            quiet=True,
+            episode_id=episode_id,
+            bomb_seed=seed,
+            tracer=_tracer,
+            **run_kwargs
+        )
+    )
+    # An episode cut short by an exception is no result; failing here keeps it out of the store, so it is rerun.
+    error = result.pop('error', None)
+    if error is not None:
+        raise RuntimeError(f"Episode {episode_id} failed after {result['iterations']} iterations: {error}")
+    return config_index, attempt, {
+        **result,
+        'config_index': config_index,
+        'attempt': attempt,
+        'mode': mode,
+        'temperature': temperature,
+        'top_p': top_p,
+        'top_k': top_k,
+        'seed': seed,
+        'episode_id': episode_id,
+        'seconds': time.perf_counter() - started,
+        'finished_at': time.time(),
+    }
+
+
+def parallel_eval(
+        configs: List[Config],
+        attempts: int = 1,
+        num_workers: Optional[int] = None,
+        defuser_checkpoint: str = "Qwen/Qwen3-0.6B",
+        expert_checkpoint: Optional[str] = None,
+        device: str = "cpu",
+        server_url: str = "http://127.0.0.1:8080",
+        seed: int = 0,
+        run_id: Optional[str] = None,
+        mmap_weights: bool = False,
+        response_cache: Optional[str] = None,
+        response_cache_bytes: int = 1024 * 2 ** 20,
+        trace_dir: Optional[str] = None,
+        results_store: Optional[str] = None,
+        **run_kwargs
+) -> Dict[Config, Dict[str, List[int]]]:
+    """
+    Evaluate every configuration `attempts` times on a process pool.
+
+    :param configs: Configurations to evaluate, see grid().
+    :param attempts: Attempts per configuration.
+    :param num_workers: Worker processes (defaults to the number of CPUs).
+    :param defuser_checkpoint: Checkpoint of the Defuser model.
+    :param expert_checkpoint: Checkpoint of the Expert model (the Defuser's if None).
+    :param device: Device the workers load their models on.
+    :param server_url: The URL where the bomb-defusal server is running.
+    :param seed: Base seed; attempt a of configuration c samples, and plays a bomb seeded, with
+    seed + c * attempts + a.
+    :param run_id: Prefix of the episode ids, so concurrent runs on one server stay apart.
+    :param mmap_weights: Memory-map the weights, so all workers share one copy of them.
+    :param response_cache: SQLite file caching the model responses, so that a rerun replays them (None to disable).
+    :param response_cache_bytes: Size budget of the response cache.
+    :param trace_dir: Directory every worker writes the spans of its episodes to, see agents.tracing (None to not trace).
+    :param results_store: Directory of a ResultsStore every attempt is written to as it completes; attempts already
+    in it are not run again (None to keep the results in memory only).
+    :param run_kwargs: Further run_two_agents arguments, e.g. max_new_tokens or iteration_limit.
+    Attempts that raise, or whose episode is cut short by an exception, are not stored; the others still are,
+    and a RuntimeError then reports the failed ones, which running the sweep again retries.
+    :return: {config: {'iterations': [...], 'success': [...], 'prompt_tokens': [...], 'new_tokens': [...]}} in
+    configuration order, one entry per attempt, including those of earlier runs read from the results store.
+    """
+    num_workers = num_workers or os.cpu_count() or 1
+    threads = max(1, (os.cpu_count() or 1) // num_workers)
+    run_id = run_id or f"eval-{os.getpid()}"
+    cache = ResponseCache(response_cache, response_cache_bytes) if response_cache else None
+    outcomes = {}
+    failed: Dict[Tuple[int, int], Exception] = {}
+    store = None
+    if results_store:
+        # Seeds depend on the number of attempts, so it is part of what the stored results depend on,
+        # as is the precision: memory-mapped weights keep the stored dtype, private copies are float32.
+        store = ResultsStore(results_store, meta={
+            'defuser_checkpoint': defuser_checkpoint,
+            'expert_checkpoint': expert_checkpoint or defuser_checkpoint,
+            'defuser_dtype': str(load_dtype(defuser_checkpoint, None, mmap_weights)),
+            'expert_dtype': str(load_dtype(expert_checkpoint or defuser_checkpoint, None, mmap_weights)),
+            'mmap_weights': mmap_weights,
+            'seed': seed,
+            'attempts': attempts,
+            'run_kwargs': run_kwargs,
+        })
+        done = {(row['mode'], row['temperature'], row['top_p'], row['top_k'], row['attempt']): row
+                for row in store.load().to_dict('records')}
+        for c, config in enumerate(configs):
+            for a in range(attempts):
+                if (*config, a) in done:
+                    outcomes[c, a] = done[(*config, a)]
+
+    # Spawned rather than forked workers, since torch does not survive a fork after initialising its thread pools.
+    with ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(defuser_checkpoint, expert_checkpoint or defuser_checkpoint, device, threads, mmap_weights,
+                      cache, trace_dir)
+    ) as pool:
+        futures = {
+            pool.submit(_run_attempt, c, config, a, seed + c * attempts + a, run_id, server_url, run_kwargs): (c, a)
+            for c, config in enumerate(configs)
+            for a in range(attempts)
+            if (c, a) not in outcomes
+        }
+        try:
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Evaluating"):
+                try:
+                    config_index, attempt, result = future.result()
+                except Exception as exc:
+                    # Left out of the store, so that running the sweep again retries it.
+                    failed[futures[future]] = exc
+                    c, a = futures[future]
+                    tqdm.write(f"Attempt {a} of configuration {configs[c]} failed: {exc}")
+                    continue
+                outcomes[config_index, attempt] = result
+                if store is not None:
+                    store.append(result)
+        except BaseException:
+            # Interrupted: do not wait for the attempts still queued.
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            if store is not None:
+                store.close()
+
+    if failed:
+        where = f"; the others are in {results_store}, run again to retry the failed ones" if store is not None else ""
+        raise RuntimeError(f"{len(failed)} of {len(futures)} attempts failed{where}.") from next(iter(failed.values()))
+
+    results = {}
+    for c, config in enumerate(configs):
+        attempt_results = [outcomes[c, a] for a in range(attempts)]
+        results[config] = {
+            'iterations': [r['iterations'] for r in attempt_results],
+            'success': [r['success'] for r in attempt_results],
+            'prompt_tokens': [r['prompt_tokens'] for r in attempt_results],
+            'new_tokens': [r['new_tokens'] for r in attempt_results],
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the two agents over the sampling grid in parallel")
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: number of CPUs)')
+    parser.add_argument('--attempts', type=int, default=1, help='Attempts per configuration')
+    parser.add_argument('--checkpoint', type=str, default="Qwen/Qwen3-0.6B")
+    parser.add_argument('--device', type=str, default="cpu")
+    parser.add_argument('--server', type=str, default="http://127.0.0.1:8080")
+    parser.add_argument('--max-new-tokens', type=int, default=50)
+    parser.add_argument('--iteration-limit', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mmap-weights', action='store_true', help='Share one memory-mapped copy of the weights between workers')
+    parser.add_argument('--response-cache', type=str, default=None,
+                        help='SQLite file caching model responses across runs')
+    parser.add_argument('--response-cache-mb', type=int, default=1024)
+    parser.add_argument('--trace', type=str, default=None, help='Directory to write per-phase episode traces to')
+    parser.add_argument('--results', type=str, default="../results",
+                        help='Results store directory, written as attempts complete; a rerun resumes the sweep')
+    parser.add_argument('--output', type=str, default=None, help='Also pickle the merged results to this file')
+    args = parser.parse_args()
+
+    results = parallel_eval(
+        grid(),
+        attempts=args.attempts,
+        num_workers=args.workers,
+        defuser_checkpoint=args.checkpoint,
+        device=args.device,
+        server_url=args.server,
+        seed=args.seed,
+        mmap_weights=args.mmap_weights,
+        response_cache=args.response_cache,
+        response_cache_bytes=args.response_cache_mb * 2 ** 20,
+        trace_dir=args.trace,
+        results_store=args.results,
+        max_new_tokens=args.max_new_tokens,
+        iteration_limit=args.iteration_limit
+    )
+    if args.output:
+        with open(args.output, "wb") as f:
+            pickle.dump(results, f)
+
+
+if __name__ == "__main__":
+    main()
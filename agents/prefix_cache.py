@@ -0,0 +1,111 @@
+"""
+Reuse of prefilled key/value states across generate() calls that share a prompt prefix.
+
+The Defuser and Expert prompts start with a fixed system message per (role, mode, stage), and
+the Expert prompt continues with a manual that is the same for every turn on a module. The
+cache keeps the past_key_values of recent prompts and, for a new prompt, hands back the states
+of its longest common prefix with any of them, so only the differing suffix is prefilled.
+"""
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import torch
+from transformers import DynamicCache
+
+
+def cache_nbytes(cache: DynamicCache) -> int:
+    """Memory held by the key/value tensors of a cache."""
+    return sum(t.numel() * t.element_size() for t in (*cache.key_cache, *cache.value_cache))
+
+
+class PrefixCache:
+    """
+    LRU store of prompt key/value states, bounded by their total size in bytes.
+
+    Entries are keyed by the token ids of the prompt they were computed for. Lookups match any
+    prefix of a stored prompt, so prompts sharing only their system message still reuse it.
+    """
+
+    def __init__(self, max_bytes: int = 512 * 2 ** 20, min_tokens: int = 16):
+        """
+        :param max_bytes: Memory budget for the stored key/value tensors.
+        :param min_tokens: Shortest common prefix worth reusing.
+        """
+        self.max_bytes = max_bytes
+        self.min_tokens = min_tokens
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self._entries: "OrderedDict[Tuple[int, ...], Tuple[torch.Tensor, DynamicCache, int]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def lookup(self, input_ids: torch.Tensor) -> Tuple[Optional[DynamicCache], int]:
+        """
+        Find the stored states sharing the longest prefix with a prompt.
+
+        At least the last prompt token is left out of the match, since generation needs the
+        logits it produces.
+
+        :param input_ids: (1, L) prompt token ids.
+        :return: A new cache holding the states of the first n tokens and n, or (None, 0) on a miss.
+        """
+        ids = input_ids[0]
+        best_key, best_length = None, 0
+        for key, (key_ids, _, _) in self._entries.items():
+            length = min(len(key_ids), len(ids) - 1)
+            if length <= best_length:
+                continue
+            mismatch = (key_ids[:length] != ids[:length]).nonzero()
+            common = int(mismatch[0]) if len(mismatch) else length
+            if common > best_length:
+                best_key, best_length = key, common
+
+        if best_key is None or best_length < self.min_tokens:
+            self.misses += 1
+            return None, 0
+
+        self._entries.move_to_end(best_key)
+        self.hits += 1
+        self.reused_tokens += best_length
+        stored = self._entries[best_key][1]
+        # Slices share memory with the stored states; generation concatenates into new tensors
+        # rather than writing into them, so the entry stays intact.
+        cache = DynamicCache.from_legacy_cache(tuple(
+            (k[..., :best_length, :], v[..., :best_length, :])
+            for k, v in zip(stored.key_cache, stored.value_cache)
+        ))
+        return cache, best_length
+
+    def store(self, input_ids: torch.Tensor, cache: DynamicCache):
+        """
+        Keep the states of a prompt, evicting the least recently used entries over the budget.
+
+        :param input_ids: (1, L) prompt token ids.
+        :param cache: past_key_values covering at least the L prompt tokens.
+        """
+        key = tuple(input_ids[0].tolist())
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+
+        length = len(key)
+        prompt_cache = DynamicCache.from_legacy_cache(tuple(
+            (k[..., :length, :].clone(), v[..., :length, :].clone())
+            for k, v in zip(cache.key_cache, cache.value_cache)
+        ))
+        nbytes = cache_nbytes(prompt_cache)
+        if nbytes > self.max_bytes:
+            return
+
+        self._entries[key] = (input_ids[0].clone(), prompt_cache, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, (_, _, evicted) = self._entries.popitem(last=False)
+            self.nbytes -= evicted
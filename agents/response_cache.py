@@ -0,0 +1,304 @@
+"""
+Persistent cache of generated responses, shared by every process of a machine.
+
+Reruns of an evaluation ask the models the same questions again, as long as they play the same
+bombs: parallel_eval seeds every attempt's bomb with the attempt's seed (the seed argument of the
+server's reset tool), so a rerun with the same seed sees the same prompts. On unseeded bombs the
+prompts hardly ever repeat and the cache only costs a lookup per call.
+A CachedModel sits in front of any HFModel and keys each generate call on everything that
+determines its output: the checkpoint, the dtype its weights are loaded in, the messages, the generation parameters and,
+for sampled calls, the state of the random number generator. A call seen before is answered
+from the on-disk ResponseCache without running (or even loading) the model, and its random
+state is advanced to where generating would have left it, so the calls after it sample the
+same tokens as they would have. Re-running an analysis therefore replays every model call.
+
+    cache = ResponseCache("../generation_cache.sqlite")
+    defuser_model = CachedModel(registry.get(USED_MODEL, "defuser"), cache)
+    ...
+    print(cache.stats())
+
+Calls whose output does not only depend on their inputs (a Deadline stop condition, or a
+sampled request answered inside a batch, where rows share the random state) are passed through
+uncached.
+"""
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import torch
+
+from agents.models import GenerationRequest, HFModel
+from agents.stopping import GenerationInfo, GenerationLog, StopCondition
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    info TEXT NOT NULL,
+    rng_state BLOB,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+"""
+
+
+class ResponseCache:
+    """
+    Content-addressed store of responses in an SQLite file, bounded by its total size in bytes.
+
+    Every process opens its own connection; SQLite's locking makes concurrent readers and
+    writers safe, and the least recently used entries are evicted once the budget is exceeded.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 1024 * 2 ** 20, timeout: float = 60.0):
+        """
+        :param path: The SQLite file, created if needed.
+        :param max_bytes: Budget for the stored responses and random states.
+        :param timeout: Seconds to wait for another process holding the write lock.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.evictions = 0
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Connections do not survive pickling into worker processes; each process opens its own.
+        state = self.__dict__.copy()
+        state['_connection'] = state['_pid'] = None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        :return: The entry stored under key, with its 'response', generation 'info' and 'rng_state'
+        (None for greedy calls), or None on a miss.
+        """
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT response, info, rng_state FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        response, info, rng_state = row
+        return {'response': response, 'info': json.loads(info), 'rng_state': rng_state}
+
+    def put(self, key: str, response: str, info: Dict[str, Any], rng_state: Optional[bytes] = None):
+        """Store an entry, then evict least recently used entries until the store fits its budget."""
+        info = json.dumps(info)
+        size = len(key) + len(response.encode()) + len(info) + len(rng_state or b"")
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, response, info, rng_state, size, time.time()))
+                excess = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0] - self.max_bytes
+                if excess > 0:
+                    evicted = []
+                    for old_key, old_size in connection.execute(
+                            "SELECT key, size FROM responses ORDER BY last_used"):
+                        if excess <= 0:
+                            break
+                        evicted.append((old_key,))
+                        excess -= old_size
+                    connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+                    self.evictions += len(evicted)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM responses")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        :return: This process's hits, misses, uncacheable calls, evictions and hit rate, and the
+        entries and bytes in the store (written by any process).
+        """
+        with self._lock:
+            entries, nbytes = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'uncacheable': self.uncacheable,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'bytes': nbytes,
+        }
+
+
+def _condition_key(condition: StopCondition) -> Optional[list]:
+    if not condition.deterministic:
+        return None
+    fields = {name: sorted(value) if isinstance(value, (set, frozenset)) else value
+              for name, value in sorted(vars(condition).items())}
+    return [type(condition).__name__, fields]
+
+
+def _rng_state(device: str) -> bytes:
+    """The state of the generator sampling on device."""
+    if str(device).startswith("cuda"):
+        return bytes(torch.cuda.get_rng_state(device).numpy())
+    return bytes(torch.get_rng_state().numpy())
+
+
+def _set_rng_state(device: str, state: bytes):
+    tensor = torch.frombuffer(bytearray(state), dtype=torch.uint8)
+    if str(device).startswith("cuda"):
+        torch.cuda.set_rng_state(tensor, device)
+    else:
+        torch.set_rng_state(tensor)
+
+
+class CachedModel(HFModel):
+    """
+    An HFModel answering repeated calls from a ResponseCache. Behaves like the model itself.
+    """
+
+    def __init__(self, llm: HFModel, cache: ResponseCache, namespace: str = ""):
+        """
+        :param llm: The model to cache the responses of.
+        :param cache: Where responses are stored, possibly shared with other models and processes.
+        :param namespace: Extra key component, to be changed when the weights behind the same checkpoint
+        name change.
+        """
+        # The weights belong to the wrapped model, so HFModel.__init__ is not called.
+        self.llm = llm
+        self.cache = cache
+        self.namespace = namespace
+        self.generation_log: GenerationLog = GenerationLog()
+
+    def __getattr__(self, name: str):
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def key(self, messages: List[Dict[str, str]], **kwargs: Any) -> Optional[str]:
+        """
+        The cache key of a generate_response call, None if its output is not determined by its inputs.
+        """
+        # Bound against the model class, so that defaults are filled in even behind a ModelHandle.
+        generate_response = getattr(self.llm, 'model_class', type(self.llm)).generate_response
+        call = inspect.signature(generate_response).bind(None, messages, **kwargs)
+        call.apply_defaults()
+        arguments = dict(call.arguments)
+        del arguments['self']
+        arguments.update(arguments.pop('kwargs', {}))
+        stop = [_condition_key(condition) for condition in arguments.get('stop') or []]
+        if None in stop:
+            return None
+        arguments['stop'] = stop
+        if arguments.get('allowed_actions') is not None:
+            arguments['allowed_actions'] = list(arguments['allowed_actions'])
+        if arguments.get('do_sample', True):
+            arguments['rng_state'] = hashlib.sha256(_rng_state(self.llm.device)).hexdigest()
+        # The dtype the weights are loaded in (float32 and bfloat16 loads answer differently) and how.
+        identity = [self.namespace, self.llm.checkpoint, str(self.llm.dtype), self.llm.mmap_weights, arguments]
+        return hashlib.sha256(json.dumps(identity, sort_keys=True, default=repr).encode()).hexdigest()
+
+    def _hit(self, entry: Dict[str, Any], started: float) -> Tuple[str, GenerationInfo]:
+        info = GenerationInfo(entry['info']['prompt_tokens'], entry['info']['new_tokens'],
+                              time.perf_counter() - started, "cache")
+        self.generation_log.append(info)
+        return entry['response'], info
+
+    def _store(self, key: str, response: str, info: Optional[GenerationInfo], rng_state: Optional[bytes]):
+        if info is not None:
+            self.generation_log.append(info)
+        info = {'prompt_tokens': info.prompt_tokens, 'new_tokens': info.new_tokens,
+                'stop_reason': info.stop_reason} if info is not None else {'prompt_tokens': 0, 'new_tokens': 0}
+        self.cache.put(key, response, info, rng_state)
+
+    def generate_response(self, messages: List[Dict[str, str]], **kwargs: Any) -> str:
+        return self.generate_with_info(messages, **kwargs)[0]
+
+    def generate_with_info(self, messages: List[Dict[str, str]], **kwargs: Any) -> Tuple[str, Optional[GenerationInfo]]:
+        started = time.perf_counter()
+        key = self.key(messages, **kwargs)
+        if key is None:
+            self.cache.uncacheable += 1
+            response, info = self.llm.generate_with_info(messages, **kwargs)
+            self.generation_log.append(info)
+            return response, info
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            if entry['rng_state'] is not None:
+                _set_rng_state(self.llm.device, entry['rng_state'])
+            return self._hit(entry, started)
+
+        sampled = kwargs.get('do_sample', True)
+        response, info = self.llm.generate_with_info(messages, **kwargs)
+        self._store(key, response, info, _rng_state(self.llm.device) if sampled else None)
+        return response, info
+
+    def generate_batch_with_info(
+            self,
+            requests: List[GenerationRequest],
+            on_step: Optional[Callable[[int, int], None]] = None
+    ) -> List[Tuple[str, Optional[GenerationInfo]]]:
+        started = time.perf_counter()
+        results: List[Optional[Tuple[str, Optional[GenerationInfo]]]] = [None] * len(requests)
+        keys: Dict[int, str] = {}
+        for i, request in enumerate(requests):
+            # The rows of a sampled batch share one random state, so only greedy rows are cached.
+            key = None if request.do_sample else self.key(
+                request.messages, max_new_tokens=request.max_new_tokens, temperature=request.temperature,
+                top_p=request.top_p, top_k=request.top_k, do_sample=False,
+                **({} if request.allowed_actions is None else {'allowed_actions': request.allowed_actions}),
+                **({'stop': request.stop} if request.stop else {}))
+            if key is None:
+                self.cache.uncacheable += 1
+                continue
+            entry = self.cache.get(key)
+            if entry is not None:
+                results[i] = self._hit(entry, started)
+            else:
+                keys[i] = key
+
+        pending = [i for i, result in enumerate(results) if result is None]
+        if pending:
+            generated = self.llm.generate_batch_with_info([requests[i] for i in pending], on_step)
+            for i, (response, info) in zip(pending, generated):
+                results[i] = response, info
+                if i in keys:
+                    self._store(keys[i], response, info, None)
+                else:
+                    self.generation_log.append(info)
+        return results
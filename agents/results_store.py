@@ -0,0 +1,203 @@
+"""
+Append-only, columnar store of evaluation results.
+
+parallel_eval(..., results_store="../results") writes every attempt as soon as it completes, as
+an NPZ chunk of one array per column, so a crash loses nothing that finished. Running the same
+sweep again with the same store skips the (configuration, attempt) keys already in it. The
+analysis side reads only the columns and rows it asks for:
+
+    store = ResultsStore("../results")
+    df = store.load(columns=['temperature', 'success', 'new_tokens'], where={'mode': 'json'})
+
+Chunks are written to a temporary file and renamed, so a chunk is either complete or absent.
+`python -m agents.results_store compact ../results` merges the chunks of a finished sweep into one.
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+# Column name -> dtype of every row.
+SCHEMA: Dict[str, type] = {
+    'config_index': np.int32,
+    'attempt': np.int32,
+    'mode': np.str_,
+    'temperature': np.float64,
+    'top_p': np.float64,
+    'top_k': np.int32,
+    'seed': np.int64,
+    'episode_id': np.str_,
+    'iterations': np.int32,
+    'success': np.int8,
+    'generate_calls': np.int32,
+    'prompt_tokens': np.int64,
+    'new_tokens': np.int64,
+    'generate_seconds': np.float64,
+    'seconds': np.float64,
+    'finished_at': np.float64,
+}
+# Columns identifying an attempt of a sweep.
+KEY = ('mode', 'temperature', 'top_p', 'top_k', 'attempt')
+
+Filter = Union[Any, List[Any], Callable[[np.ndarray], np.ndarray]]
+
+
+class ResultsStore:
+    """A directory of NPZ chunks with the columns of SCHEMA, plus the settings of the sweep writing them."""
+
+    def __init__(self, path: str, meta: Optional[Dict[str, Any]] = None, flush_every: int = 1):
+        """
+        :param path: Directory of the store, created if needed.
+        :param meta: Settings the results depend on (checkpoints, seeds, ...). Stored on first use; opening the
+        store again with different settings raises a ValueError, since their results must not be mixed.
+        :param flush_every: Rows buffered before a chunk is written (1 to write every attempt as it completes).
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self._rows: List[Dict[str, Any]] = []
+        os.makedirs(path, exist_ok=True)
+        if meta is not None:
+            self._check_meta(json.loads(json.dumps(meta, default=str)))
+
+    def _check_meta(self, meta: Dict[str, Any]):
+        meta_path = os.path.join(self.path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                stored = json.load(f)
+            if stored != meta:
+                changed = sorted(k for k in set(stored) | set(meta) if stored.get(k) != meta.get(k))
+                raise ValueError(f"{self.path} holds results of a sweep with other settings ({', '.join(changed)}).")
+            return
+        with open(meta_path, "w") as f:
+            json.dump(meta, f, indent=2)
+
+    @property
+    def meta(self) -> Optional[Dict[str, Any]]:
+        meta_path = os.path.join(self.path, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def chunks(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.path, "chunk-*.npz")))
+
+    def append(self, row: Dict[str, Any]):
+        """Add a row with every column of SCHEMA, written once flush_every rows are buffered."""
+        missing = set(SCHEMA) - set(row)
+        if missing:
+            raise ValueError(f"Row is missing the columns {sorted(missing)}.")
+        self._rows.append(row)
+        if len(self._rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows as one chunk."""
+        if not self._rows:
+            return
+        self._write({name: np.asarray([row[name] for row in self._rows], dtype=dtype)
+                     for name, dtype in SCHEMA.items()})
+        self._rows = []
+
+    def _write(self, columns: Dict[str, np.ndarray]):
+        name = f"chunk-{time.time_ns():020d}-{os.getpid()}.npz"
+        temporary = os.path.join(self.path, f".{name}.tmp")
+        with open(temporary, "wb") as f:
+            np.savez(f, **columns)
+        os.replace(temporary, os.path.join(self.path, name))
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self) -> "ResultsStore":
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        self.close()
+        return False
+
+    def columns(self, columns: Optional[Iterable[str]] = None,
+                where: Optional[Dict[str, Filter]] = None) -> Dict[str, np.ndarray]:
+        """
+        Read columns of the rows passing a filter. Only the columns asked for and filtered on are read.
+
+        :param columns: Columns to read, all of SCHEMA if None.
+        :param where: {column: a value, a list of values, or a function of the column array returning a mask}.
+        :return: {column: array} over all written chunks, in the order they were written.
+        """
+        columns = list(columns or SCHEMA)
+        where = where or {}
+        parts: Dict[str, List[np.ndarray]] = {name: [] for name in columns}
+        for path in self.chunks():
+            with np.load(path) as chunk:
+                mask = None
+                for name, condition in where.items():
+                    values = chunk[name]
+                    if callable(condition):
+                        selected = np.asarray(condition(values), dtype=bool)
+                    elif isinstance(condition, (list, tuple, set)):
+                        selected = np.isin(values, list(condition))
+                    else:
+                        selected = values == condition
+                    mask = selected if mask is None else mask & selected
+                for name in columns:
+                    values = chunk[name]
+                    parts[name].append(values if mask is None else values[mask])
+        return {name: np.concatenate(values) if values else np.empty(0, dtype=SCHEMA.get(name, np.float64))
+                for name, values in parts.items()}
+
+    def load(self, columns: Optional[Iterable[str]] = None,
+             where: Optional[Dict[str, Filter]] = None) -> pd.DataFrame:
+        """columns() as a DataFrame."""
+        return pd.DataFrame(self.columns(columns, where))
+
+    def completed(self, key: Tuple[str, ...] = KEY) -> Set[Tuple[Any, ...]]:
+        """The keys (by default (mode, temperature, top_p, top_k, attempt)) of the rows written so far."""
+        columns = self.columns(key)
+        return set(zip(*(columns[name].tolist() for name in key)))
+
+    def __len__(self) -> int:
+        return len(self.columns(['attempt'])['attempt']) + len(self._rows)
+
+    def compact(self):
+        """Merge all chunks into one."""
+        self.flush()
+        chunks = self.chunks()
+        if len(chunks) < 2:
+            return
+        self._write(self.columns())
+        for path in chunks:
+            os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or compact an evaluation results store")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    summary_parser = subparsers.add_parser('summary', help='Success rate, iterations and tokens per configuration')
+    summary_parser.add_argument('path')
+    compact_parser = subparsers.add_parser('compact', help='Merge the chunks into one')
+    compact_parser.add_argument('path')
+    args = parser.parse_args()
+
+    store = ResultsStore(args.path)
+    if args.command == 'compact':
+        before = len(store.chunks())
+        store.compact()
+        print(f"Merged {before} chunks of {len(store)} rows into {len(store.chunks())}")
+        return
+
+    df = store.load(['mode', 'temperature', 'top_p', 'top_k', 'success', 'iterations', 'prompt_tokens',
+                     'new_tokens'])
+    df['disarmed'] = df['success'] == 1
+    print(df.groupby(['mode', 'temperature', 'top_p', 'top_k']).agg(
+        attempts=('success', 'size'), disarmed=('disarmed', 'mean'), iterations=('iterations', 'mean'),
+        prompt_tokens=('prompt_tokens', 'mean'), new_tokens=('new_tokens', 'mean')).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Model weights memory-mapped from safetensors files, shared by every process that loads them.
+
+from_pretrained() reads the checkpoint into private memory, so N evaluation workers on one node
+hold N copies of the weights. load_mmap_model() instead builds the model around tensors that
+point straight into a private (copy-on-write) mapping of the safetensors files. Inference never
+writes to the weights, so their pages stay in the page cache, shared by all workers, and N
+workers cost about one model's memory plus their own activations.
+
+The mapping is only shared when the weights are used in the dtype they are stored in; asking
+for another dtype converts them into private memory, as from_pretrained() does. Without a dtype
+the two differ in precision: from_pretrained() loads float32, load_mmap_model() keeps the stored
+dtype (bfloat16 for most recent checkpoints). load_dtype() tells which one a load ends up with.
+"""
+import json
+import mmap
+import os
+import struct
+from glob import glob
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from transformers import AutoConfig, AutoModelForCausalLM, GenerationConfig, PreTrainedModel
+from transformers.modeling_utils import no_init_weights
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def checkpoint_files(checkpoint: str) -> List[str]:
+    """The safetensors files of a local checkpoint directory or of a Hub checkpoint (downloaded if needed)."""
+    if not os.path.isdir(checkpoint):
+        from huggingface_hub import snapshot_download
+        checkpoint = snapshot_download(checkpoint, allow_patterns=["*.json", "*.safetensors"])
+    files = sorted(glob(os.path.join(checkpoint, "*.safetensors")))
+    if not files:
+        raise FileNotFoundError(f"No safetensors weights in {checkpoint}, they cannot be memory-mapped.")
+    return files
+
+
+def _header(path: str) -> Tuple[int, Dict[str, Any]]:
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        return header_size, json.loads(f.read(header_size))
+
+
+def stored_dtype(checkpoint: str) -> Optional[torch.dtype]:
+    """The dtype of the first floating point tensor of a checkpoint's safetensors files, read from their headers."""
+    for path in checkpoint_files(checkpoint):
+        for name, info in _header(path)[1].items():
+            if name != "__metadata__" and SAFETENSORS_DTYPES[info["dtype"]].is_floating_point:
+                return SAFETENSORS_DTYPES[info["dtype"]]
+    return None
+
+
+def load_dtype(checkpoint: str, dtype: Optional[torch.dtype] = None, mmap_weights: bool = False) -> torch.dtype:
+    """
+    The dtype of the weights of HFModel(checkpoint, dtype=dtype, mmap_weights=mmap_weights), without loading them.
+
+    :return: dtype if given; otherwise the stored dtype when memory-mapping, and torch's default dtype
+    (float32) for from_pretrained().
+    """
+    if dtype is not None:
+        return dtype
+    if mmap_weights:
+        return stored_dtype(checkpoint) or torch.get_default_dtype()
+    return torch.get_default_dtype()
+
+
+def mmap_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """
+    Tensors of a safetensors file, backed by a copy-on-write mapping of the file.
+
+    The mapping stays alive as long as any of the tensors does.
+    """
+    header_size, header = _header(path)
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        count = (end - begin) // dtype.itemsize
+        if count == 0:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+        else:
+            tensors[name] = torch.frombuffer(mapping, dtype=dtype, count=count, offset=start + begin).view(info["shape"])
+    return tensors
+
+
+def load_mmap_model(checkpoint: str, dtype: Optional[torch.dtype] = None) -> PreTrainedModel:
+    """
+    Load a causal LM on the CPU with its weights memory-mapped from the checkpoint's safetensors files.
+
+    :param checkpoint: The model checkpoint name or path.
+    :param dtype: Weight dtype, the stored one if None (other dtypes are converted into private memory).
+    """
+    config = AutoConfig.from_pretrained(checkpoint)
+    state_dict = {}
+    for path in checkpoint_files(checkpoint):
+        state_dict.update(mmap_safetensors(path))
+    if dtype is not None:
+        state_dict = {name: t.to(dtype) if t.is_floating_point() else t for name, t in state_dict.items()}
+    else:
+        dtype = next((t.dtype for t in state_dict.values() if t.is_floating_point()), None)
+
+    # The parameters are replaced by the mapped tensors right away, so they are neither
+    # initialised nor ever touched (and hence never made resident).
+    with no_init_weights():
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype)
+    missing, unexpected = model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()
+
+    # Weights absent from the files are fine only if tying made them share a loaded tensor.
+    loaded = {t.data_ptr() for t in state_dict.values()}
+    params = model.state_dict()
+    missing = [name for name in missing if params[name].data_ptr() not in loaded]
+    if missing or unexpected:
+        raise ValueError(f"{checkpoint}: missing weights {missing}, unexpected weights {unexpected}")
+
+    try:
+        model.generation_config = GenerationConfig.from_pretrained(checkpoint)
+    except OSError:
+        pass
+    return model.eval()
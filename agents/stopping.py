@@ -0,0 +1,250 @@
+"""
+Conditions that end generation as soon as the response is usable.
+
+A response is often complete long before max_new_tokens: the Defuser has written its command
+line, or a JSON-mode answer has closed its object. Pass conditions to generate_response(stop=...)
+and generation ends at the first token after which any of them holds:
+
+    model.generate_response(messages, stop=[ActionLine(actions), Deadline(5.0)])
+
+The reason generation ended is recorded in the model's generation_log, see GenerationInfo,
+along with the call's token counts and its prefill and decode time.
+"""
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+import torch
+from transformers import PreTrainedTokenizer, StoppingCriteria
+
+COMMAND_PREFIXES = ("cut", "press", "hold", "release", "help", "state")
+
+
+class StopCondition(ABC):
+    """A test on the text generated so far."""
+
+    reason: str = "stop"
+    # Whether done() only depends on the text, so that responses stopped by it can be cached.
+    deterministic: bool = True
+
+    def start(self):
+        """Called when generation starts."""
+
+    @abstractmethod
+    def done(self, text: str) -> bool:
+        """Whether generation can end after `text`."""
+
+
+class ActionLine(StopCondition):
+    """A complete line holding a command (one of `actions` if given, any known command otherwise)."""
+
+    reason = "action_line"
+
+    def __init__(self, actions: Optional[Iterable[str]] = None, prefixes: Sequence[str] = COMMAND_PREFIXES):
+        self.actions = {action.lower() for action in actions} if actions else None
+        self.prefixes = tuple(prefixes)
+
+    def done(self, text: str) -> bool:
+        for line in text.split("\n")[:-1]:
+            line = line.strip().lower()
+            if line in self.actions if self.actions is not None else line.startswith(self.prefixes):
+                return True
+        return False
+
+
+class JsonObject(StopCondition):
+    """A closed top-level JSON object."""
+
+    reason = "json_object"
+
+    def done(self, text: str) -> bool:
+        depth, in_string, escaped = 0, False, False
+        for char in text:
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == "{":
+                depth += 1
+            elif char == "}" and depth:
+                depth -= 1
+                if depth == 0:
+                    return True
+        return False
+
+
+class StopStrings(StopCondition):
+    """Any of a set of strings."""
+
+    reason = "stop_string"
+
+    def __init__(self, strings: Iterable[str]):
+        self.strings = tuple(strings)
+
+    def done(self, text: str) -> bool:
+        return any(s in text for s in self.strings)
+
+
+class Deadline(StopCondition):
+    """A wall-clock budget in seconds, counted from the start of generation."""
+
+    reason = "deadline"
+    deterministic = False
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.started = time.monotonic()
+
+    def start(self):
+        self.started = time.monotonic()
+
+    def done(self, text: str) -> bool:
+        return time.monotonic() - self.started >= self.seconds
+
+
+def first_reason(conditions: Sequence[StopCondition], text: str) -> Optional[str]:
+    """The reason of the first condition that holds for `text`, if any."""
+    for condition in conditions:
+        if condition.done(text):
+            return condition.reason
+    return None
+
+
+class StopOnConditions(StoppingCriteria):
+    """Adapts stop conditions to model.generate(), remembering which one ended each row."""
+
+    def __init__(self, conditions: Sequence[StopCondition], tokenizer: PreTrainedTokenizer, prompt_length: int):
+        self.conditions = conditions
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.reasons: Dict[int, str] = {}
+        for condition in conditions:
+            condition.start()
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        for row in range(input_ids.shape[0]):
+            if row in self.reasons:
+                done[row] = True
+                continue
+            text = self.tokenizer.decode(input_ids[row, self.prompt_length:], skip_special_tokens=True)
+            reason = first_reason(self.conditions, text)
+            if reason is not None:
+                self.reasons[row] = reason
+                done[row] = True
+        return done
+
+
+@dataclass
+class GenerationInfo:
+    """
+    How one generate call went. Prefill is the time until the first new token (formatting and
+    tokenizing the prompt included), decode the time of the tokens after it.
+    """
+    prompt_tokens: int
+    new_tokens: int
+    seconds: float
+    stop_reason: str
+    prefill_seconds: float = 0.0
+    decode_seconds: float = 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.new_tokens / self.seconds if self.seconds else 0.0
+
+    @property
+    def decode_tokens_per_second(self) -> float:
+        """Tokens per second after the first one, the rate of a decode step."""
+        return (self.new_tokens - 1) / self.decode_seconds if self.decode_seconds and self.new_tokens > 1 else 0.0
+
+
+class FirstToken(StoppingCriteria):
+    """Never stops; records when model.generate() produced its first new token."""
+
+    def __init__(self):
+        self.time: Optional[float] = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if self.time is None:
+            self.time = time.perf_counter()
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+
+def stop_reason(tokens: List[int], eos_ids: Iterable[int], max_new_tokens: int, condition: Optional[str]) -> str:
+    """Why generation of `tokens` ended: a stop condition, end-of-sequence or the token limit."""
+    if condition is not None:
+        return condition
+    if tokens and tokens[-1] in set(eos_ids):
+        return "eos"
+    return "max_new_tokens" if len(tokens) >= max_new_tokens else "unknown"
+
+
+def summarize(log: Iterable[GenerationInfo]) -> Dict[str, object]:
+    """Calls, prompt and generated tokens, prefill and decode seconds and stop reasons over a generation log."""
+    log = list(log)
+    prompt_tokens = sum(info.prompt_tokens for info in log)
+    tokens = sum(info.new_tokens for info in log)
+    seconds = sum(info.seconds for info in log)
+    prefill = sum(info.prefill_seconds for info in log)
+    decode = sum(info.decode_seconds for info in log)
+    decoded = sum(info.new_tokens - 1 for info in log if info.decode_seconds and info.new_tokens > 1)
+    return {
+        'calls': len(log),
+        'prompt_tokens': prompt_tokens,
+        'new_tokens': tokens,
+        'mean_new_tokens': tokens / len(log) if log else 0.0,
+        'seconds': seconds,
+        'prefill_seconds': prefill,
+        'decode_seconds': decode,
+        'tokens_per_second': tokens / seconds if seconds else 0.0,
+        'prefill_tokens_per_second': prompt_tokens / prefill if prefill else 0.0,
+        'decode_tokens_per_second': decoded / decode if decode else 0.0,
+        'stop_reasons': dict(Counter(info.stop_reason for info in log)),
+    }
+
+
+GenerationCallback = Callable[[GenerationInfo], None]
+
+
+class GenerationLog(deque):
+    """
+    The GenerationInfo of a model's most recent calls, with running totals over all of them.
+
+    Callbacks are called with every GenerationInfo appended, on the thread that generated it.
+    """
+
+    def __init__(self, iterable: Iterable[GenerationInfo] = (), maxlen: Optional[int] = 1000):
+        super().__init__((), maxlen)
+        self.callbacks: List[GenerationCallback] = []
+        self.totals: Dict[str, float] = dict.fromkeys(
+            ('calls', 'prompt_tokens', 'new_tokens', 'seconds', 'prefill_seconds', 'decode_seconds'), 0)
+        self.extend(iterable)
+
+    def append(self, info: Optional[GenerationInfo]):
+        if info is None:
+            return
+        super().append(info)
+        totals = self.totals
+        totals['calls'] += 1
+        totals['prompt_tokens'] += info.prompt_tokens
+        totals['new_tokens'] += info.new_tokens
+        totals['seconds'] += info.seconds
+        totals['prefill_seconds'] += info.prefill_seconds
+        totals['decode_seconds'] += info.decode_seconds
+        for callback in self.callbacks:
+            callback(info)
+
+    def extend(self, infos: Iterable[GenerationInfo]):
+        for info in infos:
+            self.append(info)
+
+    def summary(self) -> Dict[str, object]:
+        """summarize() of the calls still in the log, with the lifetime 'totals' of all calls."""
+        return {**summarize(self), 'totals': dict(self.totals)}
@@ -0,0 +1,238 @@
+"""
+Per-phase tracing of two-agent episodes.
+
+run_two_agents(tracer=Tracer("traces/run.jsonl")) records a span for every phase of every
+iteration: the server round trips (state, manual, action), the three generate calls and the
+parsing of the Defuser's action, tagged with the episode id, iteration and role, and the
+generate calls with their prompt and generated tokens. Spans are appended to a JSONL file
+(rotated once it grows past max_bytes) and kept in memory. The default NULL_TRACER records
+nothing and costs one attribute lookup and a no-op context manager per phase.
+
+    python -m agents.tracing summary traces/*.jsonl         # p50/p95 per phase
+    python -m agents.tracing chrome traces/*.jsonl -o trace.json
+
+The Chrome trace opens in chrome://tracing or https://ui.perfetto.dev, one row per episode.
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+import numpy as np
+
+# Span categories: waiting for the game server, generating with a model, and local work.
+SERVER, GENERATE, LOCAL = "server", "generate", "local"
+
+
+class Span:
+    """A phase being traced. Tags set on it are recorded when it ends."""
+
+    __slots__ = ("name", "category", "tags")
+
+    def __init__(self, name: str, category: str, tags: Dict[str, Any]):
+        self.name = name
+        self.category = category
+        self.tags = tags
+
+    def set(self, **tags: Any):
+        self.tags.update(tags)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, **tags: Any):
+        pass
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class NullTracer:
+    """Records nothing."""
+
+    enabled = False
+
+    def span(self, name: str, category: str = LOCAL, **tags: Any) -> _NullSpan:
+        return _NULL_SPAN
+
+    def close(self):
+        pass
+
+
+NULL_TRACER = NullTracer()
+
+
+class Tracer:
+    """Records spans in memory and, if given a path, in a rotating JSONL file."""
+
+    enabled = True
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = 64 * 2 ** 20, backups: int = 3,
+                 keep: int = 100_000):
+        """
+        :param path: JSONL file to append spans to, "{pid}" is replaced by the process id (None to keep them in memory only).
+        :param max_bytes: Size after which the file is rotated to path.1, path.2, ...
+        :param backups: Rotated files kept.
+        :param keep: Most recent spans kept in memory.
+        """
+        self.path = path.format(pid=os.getpid()) if path else None
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.events: Deque[Dict[str, Any]] = deque(maxlen=keep)
+        self._file = None
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = open(self.path, "a", buffering=1)
+
+    @contextmanager
+    def span(self, name: str, category: str = LOCAL, **tags: Any):
+        """Trace the enclosed code as one span."""
+        span = Span(name, category, tags)
+        wall = time.time()
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            self._record({
+                'name': name,
+                'category': category,
+                'start': wall,
+                'duration': time.perf_counter() - start,
+                'pid': os.getpid(),
+                'tags': span.tags,
+            })
+
+    def _record(self, event: Dict[str, Any]):
+        self.events.append(event)
+        if self._file is not None:
+            self._file.write(json.dumps(event, default=str) + "\n")
+            if self._file.tell() > self.max_bytes:
+                self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "a", buffering=1)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_events(paths: Iterable[str]) -> List[Dict[str, Any]]:
+    """The spans of JSONL trace files (glob patterns allowed), in start order."""
+    events = []
+    for pattern in paths:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            with open(path) as f:
+                events.extend(json.loads(line) for line in f if line.strip())
+    return sorted(events, key=lambda event: event['start'])
+
+
+def to_chrome(events: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Chrome trace-event JSON of spans: complete ("X") events, one thread per episode."""
+    trace_events = []
+    threads: Dict[Any, int] = {}
+    for event in events:
+        episode = event['tags'].get('episode')
+        key = (event['pid'], episode)
+        if key not in threads:
+            threads[key] = len(threads) + 1
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': event['pid'], 'tid': threads[key],
+                                 'args': {'name': str(episode) if episode is not None else 'other'}})
+        trace_events.append({
+            'name': event['name'],
+            'cat': event['category'],
+            'ph': 'X',
+            'ts': event['start'] * 1e6,
+            'dur': event['duration'] * 1e6,
+            'pid': event['pid'],
+            'tid': threads[key],
+            'args': event['tags'],
+        })
+    return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+
+def export_chrome(events: Iterable[Dict[str, Any]], path: str):
+    with open(path, "w") as f:
+        json.dump(to_chrome(events), f, default=str)
+
+
+def summarize(events: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """
+    Duration statistics per phase.
+
+    :return: {phase: {'category', 'count', 'total', 'mean', 'p50', 'p95'}} in seconds, phases by total time,
+    with generated tokens per second for phases that generate.
+    """
+    durations = defaultdict(list)
+    categories = {}
+    new_tokens = defaultdict(int)
+    for event in events:
+        durations[event['name']].append(event['duration'])
+        categories[event['name']] = event['category']
+        new_tokens[event['name']] += event['tags'].get('new_tokens') or 0
+
+    summary = {}
+    for name, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+        values = np.asarray(values)
+        summary[name] = {
+            'category': categories[name],
+            'count': len(values),
+            'total': float(values.sum()),
+            'mean': float(values.mean()),
+            'p50': float(np.percentile(values, 50)),
+            'p95': float(np.percentile(values, 95)),
+        }
+        if new_tokens[name]:
+            summary[name]['tokens_per_second'] = new_tokens[name] / float(values.sum())
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize or convert episode traces")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    summary_parser = subparsers.add_parser('summary', help='p50/p95 duration per phase')
+    summary_parser.add_argument('paths', nargs='+', help='JSONL trace files or glob patterns')
+    chrome_parser = subparsers.add_parser('chrome', help='Convert to Chrome trace-event JSON')
+    chrome_parser.add_argument('paths', nargs='+', help='JSONL trace files or glob patterns')
+    chrome_parser.add_argument('-o', '--output', default='trace.json')
+    args = parser.parse_args()
+
+    events = read_events(args.paths)
+    if args.command == 'chrome':
+        export_chrome(events, args.output)
+        print(f"Wrote {len(events)} spans to {args.output}")
+        return
+
+    summary = summarize(events)
+    # Phases run inside their episode's span, so shares are of the episodes' time.
+    total = summary['episode']['total'] if 'episode' in summary else sum(s['total'] for s in summary.values())
+    total = total or 1.0
+    print(f"{'phase':<18} {'category':<9} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9} {'total s':>9} {'share':>6}")
+    for name, stats in summary.items():
+        print(f"{name:<18} {stats['category']:<9} {stats['count']:>6} {stats['p50'] * 1e3:>9.1f} "
+              f"{stats['p95'] * 1e3:>9.1f} {stats['mean'] * 1e3:>9.1f} {stats['total']:>9.2f} "
+              f"{stats['total'] / total:>6.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,23 @@
 import asyncio
-import pickle
-from typing import Dict
-from tqdm import tqdm
+import uuid
+from typing import Dict, List, Optional, Union
 import torch
 
 from agents.prompts import expert_prompt, defuser_prompt
 from game_mcp.game_client import Defuser, Expert, Resetter
-from agents.models import HFModel, SmollLLM
+from agents.batching import BatchScheduler
+from game.modules.module import ActionResult
+from agents.stopping import ActionLine, Deadline, JsonObject, StopCondition, StopStrings
+from agents.tracing import GENERATE, LOCAL, NULL_TRACER, SERVER, NullTracer, Span, Tracer
+from agents.model_registry import registry
+from agents.models import HFModel
 
 USED_MODEL = "Qwen/Qwen3-0.6B"
 
 
 async def run_two_agents(
-        defuser_model: HFModel,
-        expert_model: HFModel,
+        defuser_model: Union[HFModel, BatchScheduler],
+        expert_model: Union[HFModel, BatchScheduler],
         server_url: str = "http://0.0.0.0:8080",
         max_new_tokens: int = 50,
         iteration_limit: int = 100,
@@ -21,15 +25,23 @@ async def run_two_agents(
         top_p: float = 0.9,
         top_k: int = 50,
         mode: str = 'default',
-        quiet: bool = False
-) -> Dict[str, int]:
+        quiet: bool = False,
+        episode_id: Optional[str] = None,
+        bomb_seed: Optional[int] = None,
+        constrained: bool = True,
+        stop_strings: Optional[List[str]] = None,
+        generation_deadline: Optional[float] = None,
+        tracer: Union[Tracer, NullTracer] = NULL_TRACER
+) -> Dict[str, Union[int, float, str, None]]:
     """
     Main coroutine that orchestrates two LLM agents (Defuser and Expert)
     interacting with the bomb-defusal server.
 
-    :param defuser_model: The HFModel for the Defuser's role.
-    :param expert_model: The HFModel for the Expert's role.
-    :param server_url: The URL where the bomb-defusal server is running.
+    :param defuser_model: The HFModel for the Defuser's role, or a BatchScheduler in front of it
+    to batch its calls with those of other concurrent episodes.
+    :param expert_model: The HFModel for the Expert's role (or a BatchScheduler).
+    :param server_url: The URL where the bomb-defusal server is running, or "inproc://" to play
+    against the game server module in this process.
     :param max_new_tokens: Max tokens to generate for each LLM response.
     :param iteration_limit: A limit on how many iterations the models will talk for
     (for preventing endless loops)
@@ -38,127 +50,181 @@ async def run_two_agents(
     :param top_k: both models' top_k.
     :param mode: How model prompt will be structured.
     :param quiet: How much debug info function writes.
+    :param episode_id: Server-side bomb to play with, a new random one if None.
+    :param bomb_seed: Seed of the episode's bomb, so that replays of the episode get the same bomb
+    (a random bomb if None).
+    :param constrained: Make the Defuser's action exactly one of the commands the bomb state lists,
+    instead of searching its free-text answer for one.
+    :param stop_strings: Strings that end any response as soon as they are generated.
+    :param generation_deadline: Seconds after which any response is cut off.
+    :param tracer: Records a span per phase of every iteration, see agents.tracing (nothing by default).
+    :return: The iterations played, success (1 disarmed, 0 exploded, -1 neither), the episode's generate
+    calls, their prompt and generated tokens and their seconds, and error: None, or the exception that ended
+    the episode early (as "Type: message"), in which case success is -1.
     """
-    defuser_client = Defuser()
-    expert_client = Expert()
-    resetter_client = Resetter()
-    await resetter_client.connect_to_server(server_url)
-    await resetter_client.run('wire')
-
-    iteration_count = 0
-    success = -1
-
-    try:
-        # 1) Connect both clients to the same server
-        await defuser_client.connect_to_server(server_url)
-        await expert_client.connect_to_server(server_url)
-
-        while iteration_count < iteration_limit:
-            # 2) Defuser checks the bomb's current state
-            bomb_state = await defuser_client.run("state")
-            if not quiet:
-                print("[DEFUSER sees BOMB STATE]:")
-                print(bomb_state)
-
-            if "Bomb disarmed!" in bomb_state or "Bomb exploded!" in bomb_state:
-                break
-
-            # 3) Defuser formulates question
-            def_messages = defuser_prompt(bomb_state, '', mode, 0)
-            def_question = defuser_model.generate_response(
-                def_messages,
-                max_new_tokens=max_new_tokens,
-                temperature=temperature,
-                top_p=top_p,
-                top_k=top_k,
-                do_sample=True
-            )
-
-            if not quiet:
-                print("[DEFUSER SAYS TO EXPERT]:")
-                print(def_question)
-
-            # 4) Expert retrieves the relevant manual text
-            manual_text = await expert_client.run()
-            if not quiet:
-                print("[EXPERT sees MANUAL]:")
-                print(manual_text)
-
-            # 5) Expert LLM uses the manual text + defuser’s question
-            #    to generate instructions
-            exp_messages = expert_prompt(manual_text, def_question, mode)
-            expert_advice = expert_model.generate_response(
-                exp_messages,
-                max_new_tokens=max_new_tokens,
-                temperature=temperature,
-                top_p=top_p,
-                top_k=top_k,
-                do_sample=True
-            )
-            if not quiet:
-                print("\n[EXPERT ADVICE to DEFUSER]:")
-                print(expert_advice)
-
-            # 6) Defuser LLM uses the bomb state + expert advice to pick a single action
-            def_messages = defuser_prompt(bomb_state, expert_advice, mode, 1)
-            def_action_raw = defuser_model.generate_response(
-                def_messages,
-                max_new_tokens=max_new_tokens,
-                temperature=temperature,
-                top_p=top_p,
-                top_k=top_k,
-                do_sample=True
-            )
-
-            # 7) Attempt to extract a known command from def_action_raw
-            #    If no recognized command is found, default to "help"
-            action = "help"
-            for line in def_action_raw.splitlines():
-                line = line.strip().lower()
-                if line.startswith(("cut", "press", "hold", "release", "help", "state")):
-                    action = line.strip()
+    episode_id = episode_id or uuid.uuid4().hex
+
+    def stop_conditions(*conditions: StopCondition) -> List[StopCondition]:
+        # Fresh conditions for every call, since a deadline starts counting when generation does.
+        conditions = list(conditions)
+        if mode == 'json':
+            conditions.append(JsonObject())
+        if stop_strings:
+            conditions.append(StopStrings(stop_strings))
+        if generation_deadline is not None:
+            conditions.append(Deadline(generation_deadline))
+        return conditions
+
+    usage = {'generate_calls': 0, 'prompt_tokens': 0, 'new_tokens': 0, 'generate_seconds': 0.0}
+
+    async def generate(model: Union[HFModel, BatchScheduler], messages: List[Dict[str, str]], span: Span,
+                       **kwargs) -> str:
+        response, info = await model.agenerate_with_info(
+            messages,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            do_sample=True,
+            **kwargs
+        )
+        if info is not None:
+            usage['generate_calls'] += 1
+            usage['prompt_tokens'] += info.prompt_tokens
+            usage['new_tokens'] += info.new_tokens
+            usage['generate_seconds'] += info.seconds
+            span.set(prompt_tokens=info.prompt_tokens, new_tokens=info.new_tokens, stop_reason=info.stop_reason)
+        return response
+
+    with tracer.span("episode", LOCAL, episode=episode_id, mode=mode) as episode:
+        defuser_client = Defuser(episode_id)
+        expert_client = Expert(episode_id)
+        resetter_client = Resetter(episode_id)
+        with tracer.span("reset", SERVER, episode=episode_id, role="resetter"):
+            await resetter_client.connect_to_server(server_url)
+            await resetter_client.run('wire', bomb_seed)
+
+        iteration_count = 0
+        success = -1
+        error: Optional[str] = None
+
+        try:
+            # 1) Connect both clients to the same server
+            await defuser_client.connect_to_server(server_url)
+            await expert_client.connect_to_server(server_url)
+
+            while iteration_count < iteration_limit:
+                tags = {'episode': episode_id, 'iteration': iteration_count}
+
+                # 2) Defuser checks the bomb's current state (typed, with the text for the prompts)
+                with tracer.span("state", SERVER, role="defuser", **tags):
+                    state = await defuser_client.state(text=True)
+                bomb_state = state.text
+                if not quiet:
+                    print("[DEFUSER sees BOMB STATE]:")
+                    print(bomb_state)
+
+                if state.over:
                     break
 
-            if not quiet:
-                print("\n[DEFUSER ACTION DECIDED]:", action)
-
-            # 7) Send that action to the server
-            result = await defuser_client.run(action)
+                # 3) Defuser formulates question
+                with tracer.span("defuser_question", GENERATE, role="defuser", **tags) as span:
+                    def_messages = defuser_prompt(bomb_state, '', mode, 0)
+                    def_question = await generate(defuser_model, def_messages, span, stop=stop_conditions())
+
+                if not quiet:
+                    print("[DEFUSER SAYS TO EXPERT]:")
+                    print(def_question)
+
+                # 4) Expert retrieves the relevant manual text
+                with tracer.span("manual", SERVER, role="expert", **tags):
+                    manual_text = await expert_client.run()
+                if not quiet:
+                    print("[EXPERT sees MANUAL]:")
+                    print(manual_text)
+
+                # 5) Expert LLM uses the manual text + defuser’s question
+                #    to generate instructions
+                with tracer.span("expert_advice", GENERATE, role="expert", **tags) as span:
+                    exp_messages = expert_prompt(manual_text, def_question, mode)
+                    expert_advice = await generate(expert_model, exp_messages, span, stop=stop_conditions())
+                if not quiet:
+                    print("\n[EXPERT ADVICE to DEFUSER]:")
+                    print(expert_advice)
+
+                # 6) Defuser LLM uses the bomb state + expert advice to pick a single action,
+                #    decoding only the legal commands when constrained, and otherwise stopping
+                #    once it has written a command line
+                actions = state.actions if constrained else []
+                with tracer.span("defuser_action", GENERATE, role="defuser", **tags) as span:
+                    def_messages = defuser_prompt(bomb_state, expert_advice, mode, 1)
+                    def_action_raw = await generate(
+                        defuser_model, def_messages, span,
+                        **({'allowed_actions': actions} if actions else {'stop': stop_conditions(ActionLine())})
+                    )
+
+                # 7) Attempt to extract a known command from def_action_raw
+                #    If no recognized command is found, default to "help"
+                with tracer.span("action_parse", LOCAL, role="defuser", **tags):
+                    action = "help"
+                    if actions:
+                        action = def_action_raw
+                    else:
+                        for line in def_action_raw.splitlines():
+                            line = line.strip().lower()
+                            if line.startswith(("cut", "press", "hold", "release", "help", "state")):
+                                action = line.strip()
+                                break
+
+                if not quiet:
+                    print("\n[DEFUSER ACTION DECIDED]:", action)
+
+                # 7) Send that action to the server
+                with tracer.span("action", SERVER, role="defuser", **tags) as span:
+                    outcome = await defuser_client.act(action, text=not quiet)
+                    span.set(action=action, result=outcome.result.value if outcome.result else outcome.error)
+
+                if not quiet:
+                    print("[SERVER RESPONSE]:")
+                    print(outcome.text)
+                    print("-" * 60)
+
+                iteration_count += 1
+
+                if outcome.disarmed:
+                    success = 1
+                    break
+                elif outcome.exploded:
+                    success = 0
+                    break
+                elif outcome.error or outcome.result == ActionResult.INCORRECT:
+                    break
 
+        except Exception as exc:
+            # The episode still returns what it played, flagged, so that callers can tell it from a lost game.
+            error = f"{type(exc).__name__}: {exc}"
+        finally:
             if not quiet:
-                print("[SERVER RESPONSE]:")
-                print(result)
-                print("-" * 60)
-
-            iteration_count += 1
-
-            if "BOMB SUCCESSFULLY DISARMED" in result:
-                success = 1
-                break
-            elif "BOMB HAS EXPLODED" in result:
-                success = 0
-                break
-            elif "Unknown command" in result:
-                break
-
-    finally:
-        if not quiet:
-            print(iteration_count)
-        await defuser_client.cleanup()
-        await expert_client.cleanup()
-        await resetter_client.cleanup()
-        return {
-            'iterations': iteration_count,
-            'success': success,
-        }
+                print(iteration_count)
+            await defuser_client.cleanup()
+            await expert_client.cleanup()
+            await resetter_client.cleanup()
+            episode.set(iterations=iteration_count, success=success, prompt_tokens=usage['prompt_tokens'],
+                        new_tokens=usage['new_tokens'], error=error)
+            return {
+                'iterations': iteration_count,
+                'success': success,
+                **usage,
+                'error': error,
+            }
 
 
 def default_main():
     defuser_checkpoint = USED_MODEL
     expert_checkpoint = USED_MODEL
 
-    defuser_model = SmollLLM(defuser_checkpoint, device="cpu")
-    expert_model = SmollLLM(expert_checkpoint, device="cpu")
+    defuser_model = registry.get(defuser_checkpoint, "defuser", device="cpu")
+    expert_model = registry.get(expert_checkpoint, "expert", device="cpu")
 
     asyncio.run(
         run_two_agents(
@@ -170,58 +236,38 @@ def default_main():
         )
     )
 
+    for report in registry.report():
+        print(report)
+
 
 # Function for performing task 2
-def full_eval_main():
-    defuser_checkpoint = USED_MODEL
-    expert_checkpoint = USED_MODEL
+def full_eval_main(num_workers: Optional[int] = None, attempts: int = 1,
+                   response_cache: Optional[str] = None,
+                   results_store: str = "../results"):
+    """
+    Evaluate every mode and sampling configuration, fanning the attempts out over `num_workers`
+    processes (one per CPU by default), and write every attempt to the `results_store` directory
+    as it completes (see agents.results_store); calling this again after a crash runs only the
+    missing attempts. Model responses are cached in `response_cache` if given, so rerunning the
+    evaluation replays them; this relies on every attempt's bomb being seeded with its seed.
+    """
+    from agents.parallel_eval import grid, parallel_eval
 
     torch.cuda.empty_cache()
-    defuser_model = SmollLLM(defuser_checkpoint, device="cpu")
-    expert_model = SmollLLM(expert_checkpoint, device="cpu")
-
-    results = {}
-
-    modes = ['natural', 'markdown', 'json']
-    temperatures = [0.2, 0.7, 1.]
-    top_ps = [0.3, 0.6, 0.9]
-    top_ks = [25, 50, 75]
-
-    ATTEMPTS_NUM = 1
-
-    for mode in modes:
-        for temperature in temperatures:
-            for top_p in top_ps:
-                for top_k in top_ks:
-                    key = (mode, temperature, top_p, top_k)
-                    iterations_list = []
-                    success_list = []
-
-                    for _ in tqdm(range(ATTEMPTS_NUM), desc=f"Mode={mode}, T={temperature}, p={top_p}, k={top_k}"):
-                        result = asyncio.run(
-                            run_two_agents(
-                                defuser_model=defuser_model,
-                                expert_model=expert_model,
-                                server_url="http://127.0.0.1:8080",
-                                max_new_tokens=50,
-                                mode=mode,
-                                temperature=temperature,
-                                top_p=top_p,
-                                top_k=top_k,
-                                quiet=True,
-                                iteration_limit=3
-                            )
-                        )
-                        iterations_list.append(result['iterations'])
-                        success_list.append(result['success'])
-
-                    results[key] = {
-                        'iterations': iterations_list,
-                        'success': success_list
-                    }
-
-    with open("../results.pkl", "wb") as f:
-        pickle.dump(results, f)
+    results = parallel_eval(
+        grid(),
+        attempts=attempts,
+        num_workers=num_workers,
+        defuser_checkpoint=USED_MODEL,
+        expert_checkpoint=USED_MODEL,
+        device="cpu",
+        server_url="http://127.0.0.1:8080",
+        response_cache=response_cache,
+        results_store=results_store,
+        max_new_tokens=50,
+        iteration_limit=3
+    )
+    return results
 
 
 if __name__ == "__main__":
@@ -0,0 +1,64 @@
+import argparse
+import asyncio
+import time
+
+from agents.batching import BatchScheduler
+from agents.models import SmollLLM
+from agents.two_agents import run_two_agents
+
+
+async def play(model, episodes: int, mode: str, max_new_tokens: int, iteration_limit: int) -> float:
+    """Play `episodes` concurrent games in process and return the wall time."""
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        run_two_agents(
+            defuser_model=model,
+            expert_model=model,
+            server_url="inproc://",
+            max_new_tokens=max_new_tokens,
+            iteration_limit=iteration_limit,
+            mode=mode,
+            quiet=True,
+            episode_id=f"batching-{i}"
+        )
+        for i in range(episodes)
+    ))
+    return time.perf_counter() - start
+
+
+async def bench(checkpoint: str, episodes: int, max_batch_size: int, max_wait: float, mode: str,
+                max_new_tokens: int, iteration_limit: int):
+    """Time concurrent episodes generating one call at a time versus through a BatchScheduler."""
+    model = SmollLLM(checkpoint, device="cpu", prefix_cache_bytes=0)
+    generations = episodes * iteration_limit * 3
+
+    elapsed = await play(model, episodes, mode, max_new_tokens, iteration_limit)
+    print(f"unbatched: {elapsed:7.2f} s  ({generations / elapsed:.2f} generations/s)")
+
+    scheduler = BatchScheduler(model, max_batch_size=max_batch_size, max_wait=max_wait)
+    try:
+        elapsed = await play(scheduler, episodes, mode, max_new_tokens, iteration_limit)
+    finally:
+        await scheduler.close()
+    print(f"  batched: {elapsed:7.2f} s  ({generations / elapsed:.2f} generations/s)")
+    for name, value in scheduler.stats.summary().items():
+        print(f"  {name}: {value:.3f}" if isinstance(value, float) else f"  {name}: {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched generation across concurrent episodes")
+    parser.add_argument('--checkpoint', default="Qwen/Qwen3-0.6B")
+    parser.add_argument('--episodes', type=int, default=8, help='Concurrent episodes')
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    parser.add_argument('--max-wait', type=float, default=0.01, help='Seconds to wait for a batch to fill')
+    parser.add_argument('--mode', default='natural')
+    parser.add_argument('--max-new-tokens', type=int, default=20)
+    parser.add_argument('--iteration-limit', type=int, default=2)
+    args = parser.parse_args()
+
+    asyncio.run(bench(args.checkpoint, args.episodes, args.max_batch_size, args.max_wait, args.mode,
+                      args.max_new_tokens, args.iteration_limit))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import asyncio
+import statistics
+import time
+
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+
+from benchmarks.local_server import running_server
+from game_mcp.game_client import Defuser, Expert, Resetter
+
+
+async def one_shot_call(server_url: str, tool_name: str, tool_args: dict[str, str]) -> str:
+    """The old BombClient.process_query: a fresh SSE stream and MCP handshake per call."""
+    async with sse_client(server_url) as streams:
+        async with ClientSession(streams[0], streams[1]) as session:
+            await session.initialize()
+            result = await session.call_tool(tool_name, tool_args)
+    return ''.join([c.text for c in result.content])
+
+
+def summarize(name: str, latencies: list[float]):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+    print(f"{name:>10}: mean={statistics.mean(latencies) * 1e3:7.2f} ms  "
+          f"p50={statistics.median(latencies) * 1e3:7.2f} ms  p95={p95 * 1e3:7.2f} ms  "
+          f"({len(latencies)} calls)")
+
+
+async def bench(server_url: str, calls: int):
+    """Time `state` calls with a handshake per call versus over the shared session."""
+    await one_shot_call(server_url, "reset", {"module": "memory"})
+
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        await one_shot_call(server_url, "game_interaction", {"command": "state"})
+        latencies.append(time.perf_counter() - start)
+    summarize("per-call", latencies)
+
+    defuser, expert, resetter = Defuser(), Expert(), Resetter()
+    for client in (defuser, expert, resetter):
+        await client.connect_to_server(server_url)
+    try:
+        latencies = []
+        for _ in range(calls):
+            start = time.perf_counter()
+            await defuser.run("state")
+            latencies.append(time.perf_counter() - start)
+        summarize("pooled", latencies)
+    finally:
+        for client in (defuser, expert, resetter):
+            await client.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MCP client round trips")
+    parser.add_argument('--url', default=None, help='Server URL, a local server is started when omitted')
+    parser.add_argument('--calls', type=int, default=200, help='Number of calls per mode')
+    args = parser.parse_args()
+
+    if args.url:
+        asyncio.run(bench(args.url, args.calls))
+    else:
+        with running_server() as url:
+            asyncio.run(bench(url, args.calls))
+
+
+if __name__ == "__main__":
+    main()
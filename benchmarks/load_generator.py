@@ -0,0 +1,237 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.local_server import server_process
+from game import oracle
+from game.modules.module import ActionResult
+from game_mcp.bomb_state import BombState
+from game_mcp.game_client import Defuser, Expert, Resetter, open_session
+
+
+def correct_action(state: BombState, memory: Dict[int, tuple]) -> str:
+    """
+    The command that solves the current module of a bomb, worked out from its typed state.
+
+    :param state: A BombState of an active bomb.
+    :param memory: (display, button labels) of every Memory stage seen so far in this episode, by stage;
+    updated with the current stage.
+    """
+    fields = state.fields
+    if state.module == "wire":
+        colors = [oracle.WIRE_COLORS.index(color) for color in fields['wire_colors']]
+        colors += [-1] * (oracle.MAX_WIRES - len(colors))
+        digit = next((c for c in reversed(fields['serial_number']) if c.isdigit()), "0")
+        return f"cut wire {oracle.solve_wires(np.array([colors]), np.array([int(digit) % 2 == 1]))[0]}"
+
+    if state.module == "button":
+        if fields['holding']:
+            strip = oracle.STRIP_COLORS.index(fields['strip_color'])
+            return f"release on {oracle.solve_button_release(np.array([strip]))[0]}"
+        press = oracle.solve_button_press(
+            np.array([oracle.BUTTON_COLORS.index(fields['button_color'])]),
+            np.array([oracle.BUTTON_LABELS.index(fields['button_label'])]),
+            np.array([fields['batteries']]),
+            np.array(["CAR" in fields['lit_indicators']]),
+            np.array(["FRK" in fields['lit_indicators']]))[0]
+        return "press" if press else "hold"
+
+    if state.module == "simon":
+        flashed = [oracle.SIMON_COLORS.index(color) for color in fields['flashing']]
+        flashed += [0] * (oracle.SIMON_LENGTH - len(flashed))
+        has_vowel = any(c in "aeiou" for c in fields['serial_number'].lower())
+        presses = oracle.solve_simon(np.array([flashed]), np.array([has_vowel]))[0]
+        return f"press {oracle.SIMON_COLORS[presses[len(fields['inputs'])]]}"
+
+    # Memory: stages after the current one do not affect it, so they are left blank.
+    memory[fields['stage']] = (fields['display'], fields['button_labels'])
+    displays = np.ones((1, oracle.MEMORY_STAGES), dtype=np.int64)
+    labels = np.zeros((1, oracle.MEMORY_STAGES, 4), dtype=np.int64)
+    for stage, (display, stage_labels) in memory.items():
+        displays[0, stage - 1], labels[0, stage - 1] = display, stage_labels
+    return f"press position {oracle.solve_memory(displays, labels)[0, fields['stage'] - 1]}"
+
+
+class Pacer:
+    """Spaces the requests of all players to a target total rate; behind schedule, it does not burst to catch up."""
+
+    def __init__(self, rate: Optional[float]):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.perf_counter()
+        slot = max(self._next, now)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class LoadStats:
+    """Latencies and errors of the requests of one load level, by tool."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.episodes = 0
+        self.disarmed = 0
+
+    def record(self, tool: str, seconds: float, ok: bool):
+        self.latencies[tool].append(seconds)
+        if not ok:
+            self.errors[tool] += 1
+
+    def summary(self, concurrency: int, seconds: float) -> Dict[str, Any]:
+        """
+        :return: Requests and episodes per second, error rate, and latency percentiles in seconds over all
+        requests and per tool.
+        """
+        def percentiles(values: List[float]) -> Dict[str, float]:
+            if not values:
+                return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0}
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99)}
+
+        requests = sum(len(values) for values in self.latencies.values())
+        errors = sum(self.errors.values())
+        return {
+            'concurrency': concurrency,
+            'seconds': seconds,
+            'requests': requests,
+            'requests_per_second': requests / seconds if seconds else 0.0,
+            'episodes': self.episodes,
+            'episodes_per_second': self.episodes / seconds if seconds else 0.0,
+            'disarmed': self.disarmed,
+            'errors': errors,
+            'error_rate': errors / requests if requests else 0.0,
+            **percentiles([value for values in self.latencies.values() for value in values]),
+            'tools': {tool: {'requests': len(values), 'errors': self.errors[tool], **percentiles(values)}
+                      for tool, values in sorted(self.latencies.items())},
+        }
+
+
+async def play(player: str, server_url: str, module: str, stats: LoadStats, pacer: Pacer, stop_at: float):
+    """
+    Play scripted episodes with one Defuser, Expert and Resetter until stop_at, one request at a time.
+    The player's clients share an SSE session of their own, so every player is a separate connection to the server.
+    """
+
+    async def request(tool: str, call: Awaitable[Any]) -> Any:
+        # None when the request failed; the episode is then abandoned.
+        await pacer.wait()
+        start = time.perf_counter()
+        try:
+            result = await call
+        except Exception:
+            stats.record(tool, time.perf_counter() - start, False)
+            return None
+        ok = not (isinstance(result, BombState) and (result.error or result.result == ActionResult.INCORRECT))
+        stats.record(tool, time.perf_counter() - start, ok)
+        return result if ok else None
+
+    defuser, expert, resetter = Defuser(player), Expert(player), Resetter(player)
+    session = await open_session(server_url)
+    for client in (defuser, expert, resetter):
+        await client.connect_to_server(server_url, session)
+    try:
+        while time.perf_counter() < stop_at:
+            if await request("reset", resetter.run(module)) is None:
+                continue
+            # The same calls per step as run_two_agents: the bomb's state, the manual, then the action.
+            memory: Dict[int, tuple] = {}
+            outcome = None
+            while True:
+                state = await request("state", defuser.state())
+                if state is None or state.over:
+                    break
+                if await request("manual", expert.run()) is None:
+                    break
+                outcome = await request("action", defuser.act(correct_action(state, memory)))
+                if outcome is None or outcome.over:
+                    break
+            stats.episodes += 1
+            stats.disarmed += bool(outcome is not None and outcome.disarmed)
+    finally:
+        for client in (defuser, expert, resetter):
+            await client.cleanup()
+
+
+async def run_level(server_url: str, concurrency: int, duration: float, rate: Optional[float], module: str,
+                    run_id: str) -> Dict[str, Any]:
+    """Run `concurrency` players for `duration` seconds (they finish the episode they are in) and summarize."""
+    stats, pacer = LoadStats(), Pacer(rate)
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        play(f"{run_id}-{concurrency}-{i}", server_url, module, stats, pacer, start + duration)
+        for i in range(concurrency)
+    ))
+    return stats.summary(concurrency, time.perf_counter() - start)
+
+
+def degradation_point(levels: List[Dict[str, Any]], factor: float) -> Optional[int]:
+    """The lowest concurrency whose p95 latency is more than `factor` times that of the lowest one, None if none is."""
+    if not levels:
+        return None
+    reference = levels[0]['p95']
+    return next((level['concurrency'] for level in levels[1:] if level['p95'] > factor * reference), None)
+
+
+async def sweep(server_url: str, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    print(f"{'players':>7} {'req/s':>8} {'episodes/s':>10} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    levels = []
+    for concurrency in args.concurrency:
+        level = await run_level(server_url, concurrency, args.duration, args.rate, args.module, args.run_id)
+        levels.append(level)
+        print(f"{concurrency:>7} {level['requests_per_second']:>8.1f} {level['episodes_per_second']:>10.2f} "
+              f"{level['error_rate']:>7.2%} {level['p50'] * 1e3:>8.2f} {level['p95'] * 1e3:>8.2f} "
+              f"{level['p99'] * 1e3:>8.2f}")
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the saturation point of the game server with scripted players")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64],
+                        help='Concurrent players of each load level')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per load level')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='Target requests per second over all players (as fast as possible if omitted)')
+    parser.add_argument('--module', default='all', help='Module of every bomb: wire, button, simon, memory or all')
+    parser.add_argument('--degradation', type=float, default=2.0,
+                        help='p95 latency, relative to the lowest concurrency, at which latency counts as degraded')
+    parser.add_argument('--url', default=None, help='Server URL, a local server process is started when omitted')
+    parser.add_argument('--run-id', default='load', help='Prefix of the episode ids')
+    parser.add_argument('--output', default=None, help='JSON file to write every level\'s results to')
+    args = parser.parse_args()
+    # FastMCP logs every request at INFO level, which would drown the report.
+    logging.disable(logging.INFO)
+
+    if args.url:
+        levels = asyncio.run(sweep(args.url, args))
+    else:
+        with server_process(max_bombs=max(10000, 2 * max(args.concurrency))) as url:
+            levels = asyncio.run(sweep(url, args))
+
+    peak = max(levels, key=lambda level: level['requests_per_second'])
+    degraded = degradation_point(levels, args.degradation)
+    print(f"Peak throughput: {peak['requests_per_second']:.1f} requests/s with {peak['concurrency']} players")
+    if degraded is None:
+        print(f"p95 latency stayed within {args.degradation:g}x of {levels[0]['concurrency']} player(s)' at every level")
+    else:
+        print(f"p95 latency degrades beyond {args.degradation:g}x from {degraded} players on")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({'levels': levels, 'peak_concurrency': peak['concurrency'], 'degraded_at': degraded}, f,
+                      indent=2)
+
+
+if __name__ == "__main__":
+    main()
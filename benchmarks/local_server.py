@@ -0,0 +1,83 @@
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import uvicorn
+
+from game_mcp.game_server import create_starlette_app, mcp
+
+
+def free_port() -> int:
+    """Ask the OS for an unused TCP port on localhost."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def running_server(port: int = None, timeout: float = 10.0):
+    """
+    Run game_mcp.game_server on localhost in a background thread.
+
+    :param port: Port to bind to, a free one is picked when None.
+    :param timeout: Seconds to wait for uvicorn to start.
+    :return: The SSE url of the server.
+    """
+    port = port or free_port()
+    app = create_starlette_app(mcp._mcp_server)  # noqa: WPS437
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    deadline = time.monotonic() + timeout
+    while not server.started:
+        if time.monotonic() > deadline or not thread.is_alive():
+            raise RuntimeError("Game server did not start.")
+        time.sleep(0.01)
+
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join(timeout)
+
+
+@contextmanager
+def server_process(port: int = None, timeout: float = 30.0, max_bombs: int = 10000):
+    """
+    Run game_mcp/game_server.py in its own uvicorn process, so that clients measuring it
+    do not share a CPU core and interpreter lock with it.
+
+    :param port: Port to bind to, a free one is picked when None.
+    :param timeout: Seconds to wait for the server to accept connections.
+    :param max_bombs: The server's --max-bombs.
+    :return: The SSE url of the server.
+    """
+    port = port or free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "game_mcp.game_server", "--host", "127.0.0.1", "--port", str(port),
+         "--max-bombs", str(max_bombs), "--log-level", "WARNING"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1.0).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline or process.poll() is not None:
+                process.kill()
+                raise RuntimeError("Game server did not start.")
+            time.sleep(0.05)
+
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
@@ -0,0 +1,68 @@
+import argparse
+import multiprocessing
+import statistics
+import time
+
+from agents.model_registry import current_rss
+
+
+def memory_usage() -> dict[str, int]:
+    """Resident (RSS) and proportional (PSS, shared pages split between their users) memory in bytes."""
+    usage = {'rss': current_rss(), 'pss': 0}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    usage['pss'] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return usage
+
+
+def worker(checkpoint: str, mmap_weights: bool, started: float, results, barrier):
+    """Load the model, generate a few tokens so every weight is used, and report the memory in use."""
+    from agents.models import SmollLLM
+
+    model = SmollLLM(checkpoint, device="cpu", prefix_cache_bytes=0, mmap_weights=mmap_weights)
+    model.generate_response([{"role": "user", "content": "Hello"}], max_new_tokens=4)
+    ready = time.perf_counter() - started
+    # Measure once every worker is loaded, so that shared pages are counted for all of them.
+    barrier.wait()
+    results.put({'start_seconds': ready, **memory_usage()})
+    barrier.wait()
+
+
+def run(checkpoint: str, workers: int, mmap_weights: bool) -> list[dict]:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    barrier = context.Barrier(workers)
+    started = time.perf_counter()
+    processes = [context.Process(target=worker, args=(checkpoint, mmap_weights, started, results, barrier))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    reports = [results.get() for _ in range(workers)]
+    for process in processes:
+        process.join()
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark worker start time and memory with private vs shared weights")
+    parser.add_argument('--checkpoint', default="Qwen/Qwen3-0.6B")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+
+    print(f"{'weights':>8} {'workers':>7} {'start s':>8} {'RSS/worker MB':>14} {'PSS/worker MB':>14} {'total PSS MB':>13}")
+    for mmap_weights in (False, True):
+        for workers in args.workers:
+            reports = run(args.checkpoint, workers, mmap_weights)
+            pss = [r['pss'] for r in reports]
+            print(f"{'mmap' if mmap_weights else 'private':>8} {workers:>7} "
+                  f"{statistics.mean(r['start_seconds'] for r in reports):>8.2f} "
+                  f"{statistics.mean(r['rss'] for r in reports) / 2 ** 20:>14.0f} "
+                  f"{statistics.mean(pss) / 2 ** 20:>14.0f} {sum(pss) / 2 ** 20:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
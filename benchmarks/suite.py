@@ -0,0 +1,339 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List
+
+import torch
+
+from agents.models import GenerationRequest, SmollLLM
+from agents.prompts import expert_prompt
+from benchmarks.local_server import running_server
+from benchmarks.tiny_model import tiny_checkpoint
+from game.bomb import Bomb
+from game.bomb_batch import MODULE_CLASSES, MODULE_NAMES
+from game_mcp.game_client import Defuser, Resetter
+from game_mcp.game_server import bombs, format_state, game_interaction, game_state, get_manual, manual_text
+
+GROUPS = ("engine", "server", "sse", "model")
+
+
+@dataclass
+class Result:
+    """The samples of one benchmark: seconds per call, or tokens per second."""
+    name: str
+    unit: str
+    samples: List[float]
+    higher_is_better: bool = False
+
+    @property
+    def value(self) -> float:
+        return statistics.median(self.samples)
+
+    def to_json(self) -> Dict[str, Any]:
+        samples = sorted(self.samples)
+        return {
+            'unit': self.unit,
+            'higher_is_better': self.higher_is_better,
+            'value': self.value,
+            'best': samples[-1] if self.higher_is_better else samples[0],
+            'mean': statistics.mean(samples),
+            'min': samples[0],
+            'max': samples[-1],
+            'p25': samples[int(0.25 * len(samples))],
+            'p75': samples[min(len(samples) - 1, int(0.75 * len(samples)))],
+            'p95': samples[min(len(samples) - 1, int(0.95 * len(samples)))],
+            'samples': len(samples),
+        }
+
+
+def best(result: Dict[str, Any]) -> float:
+    """The best sample of a result: the least disturbed by other load on the machine, so the least noisy."""
+    return result['max'] if result['higher_is_better'] else result['min']
+
+
+def worst_typical(result: Dict[str, Any]) -> float:
+    """
+    The bad end of the middle half of a result's samples: p75 of latencies, p25 of throughputs.
+    Unlike p95, which with a few dozen samples is about their worst, one outlier does not move it.
+    """
+    return result.get('p25', result['value']) if result['higher_is_better'] else result.get('p75', result['value'])
+
+
+def per_call(fn: Callable[[Any], Any], make: Callable[[], Any], number: int, repeat: int) -> List[float]:
+    """
+    Seconds per call of fn, over `repeat` rounds of `number` calls.
+
+    :param fn: The code to time, called with an input made by `make`.
+    :param make: Makes a fresh input for every call, outside of the timing.
+    """
+    samples = []
+    for _ in range(repeat):
+        inputs = [make() for _ in range(number)]
+        start = time.perf_counter()
+        for item in inputs:
+            fn(item)
+        samples.append((time.perf_counter() - start) / number)
+    return samples
+
+
+async def aper_call(fn: Callable[[Any], Awaitable[Any]], make: Callable[[], Awaitable[Any]], number: int,
+                    repeat: int) -> List[float]:
+    """per_call() for coroutine functions."""
+    samples = []
+    for _ in range(repeat):
+        inputs = [await make() for _ in range(number)]
+        start = time.perf_counter()
+        for item in inputs:
+            await fn(item)
+        samples.append((time.perf_counter() - start) / number)
+    return samples
+
+
+async def nothing():
+    return None
+
+
+def bench_engine(args: argparse.Namespace) -> List[Result]:
+    """Module.state() and Module.do_action() of every module type, and Bomb construction."""
+    rng = random.Random(args.seed)
+    results = []
+    for name, module_class in zip(MODULE_NAMES, MODULE_CLASSES):
+        def with_action(module_class=module_class):
+            module = module_class()
+            return module, rng.choice(module.state()[1])
+
+        results.append(Result(f"engine.{name}.state", "s",
+                              per_call(lambda module: module.state(), module_class, args.number, args.repeat)))
+        results.append(Result(f"engine.{name}.do_action", "s",
+                              per_call(lambda item: item[0].do_action(item[1]), with_action, args.number, args.repeat)))
+    results.append(Result("engine.bomb.construct", "s",
+                          per_call(lambda _: Bomb(), lambda: None, args.number, args.repeat)))
+    return results
+
+
+async def bench_server(args: argparse.Namespace) -> List[Result]:
+    """Latency of the server's tool handlers called in process, without MCP or SSE."""
+    rng = random.Random(args.seed)
+    await bombs.reset("bench-server", "all")
+    episodes = itertools.cycle(range(args.number))
+
+    async def with_action():
+        episode_id = f"bench-server-{next(episodes)}"
+        bomb = await bombs.reset(episode_id, "all")
+        return episode_id, rng.choice(bomb.state()[1])
+
+    return [
+        Result("server.game_interaction.state", "s", await aper_call(
+            lambda _: game_interaction("state", "bench-server"), nothing, args.number, args.repeat)),
+        Result("server.game_interaction.action", "s", await aper_call(
+            lambda item: game_interaction(item[1], item[0]), with_action, args.number, args.repeat)),
+        Result("server.game_state.state", "s", await aper_call(
+            lambda _: game_state("state", "bench-server"), nothing, args.number, args.repeat)),
+        Result("server.get_manual", "s", await aper_call(
+            lambda _: get_manual("bench-server"), nothing, args.number, args.repeat)),
+    ]
+
+
+async def bench_sse(server_url: str, args: argparse.Namespace) -> List[Result]:
+    """Round trips of the game clients over SSE, on one pooled session."""
+    defuser, resetter = Defuser("bench-sse"), Resetter("bench-sse")
+    for client in (defuser, resetter):
+        await client.connect_to_server(server_url)
+    try:
+        await resetter.run("all")
+        return [
+            Result("sse.game_interaction.state", "s", await aper_call(
+                lambda _: defuser.run("state"), nothing, args.number, args.repeat)),
+            Result("sse.game_state.state", "s", await aper_call(
+                lambda _: defuser.state(), nothing, args.number, args.repeat)),
+        ]
+    finally:
+        for client in (defuser, resetter):
+            await client.cleanup()
+
+
+def bench_model(args: argparse.Namespace) -> List[Result]:
+    """Prefill and decode throughput of SmollLLM on a tiny random checkpoint, for an Expert prompt."""
+    model = SmollLLM(tiny_checkpoint(hidden_size=args.hidden_size, layers=args.layers), prefix_cache_bytes=0)
+    bomb = Bomb()
+    messages = expert_prompt(manual_text(bomb), format_state(bomb), "default")
+    torch.manual_seed(args.seed)
+    model.generate_response(messages, max_new_tokens=2)
+
+    prefill, decode, batched = [], [], []
+    for _ in range(args.model_repeat):
+        _, info = model.generate_with_info(messages, max_new_tokens=args.new_tokens, min_new_tokens=args.new_tokens)
+        prefill.append(info.prompt_tokens / info.prefill_seconds)
+        decode.append(info.decode_tokens_per_second)
+
+        infos = [info for _, info in model.generate_batch_with_info(
+            [GenerationRequest(messages, max_new_tokens=args.new_tokens) for _ in range(args.batch_size)])]
+        batched.append(sum(info.new_tokens for info in infos) / max(info.seconds for info in infos))
+    return [
+        Result("model.prefill", "tokens/s", prefill, higher_is_better=True),
+        Result("model.decode", "tokens/s", decode, higher_is_better=True),
+        Result(f"model.batch{args.batch_size}", "tokens/s", batched, higher_is_better=True),
+    ]
+
+
+def environment() -> Dict[str, Any]:
+    """What the numbers depend on besides the code: commit, machine and library versions."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'torch_threads': torch.get_num_threads(),
+    }
+
+
+def collect(args: argparse.Namespace) -> List[Result]:
+    """Run the selected benchmark groups."""
+    random.seed(args.seed)
+    results: List[Result] = []
+    if "engine" in args.only:
+        results += bench_engine(args)
+    if "server" in args.only:
+        results += asyncio.run(bench_server(args))
+    if "sse" in args.only:
+        if args.url:
+            results += asyncio.run(bench_sse(args.url, args))
+        else:
+            with running_server() as url:
+                results += asyncio.run(bench_sse(url, args))
+    if "model" in args.only:
+        results += bench_model(args)
+    return results
+
+
+def to_json(results: List[Result]) -> Dict[str, Any]:
+    """The results with the environment they were measured in."""
+    return {'environment': environment(), 'results': {result.name: result.to_json() for result in results}}
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """Run the selected benchmark groups and return their results with the environment."""
+    return to_json(collect(args))
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, float]:
+    """
+    :return: The relative change of the best sample of every benchmark also in the baseline, positive when it
+    got worse (slower, or fewer tokens per second).
+    """
+    changes = {}
+    for name, result in results['results'].items():
+        base = baseline['results'].get(name)
+        if base is None or not best(base):
+            continue
+        change = best(result) / best(base) - 1.0
+        changes[name] = -change if result['higher_is_better'] else change
+    return changes
+
+
+def regressions(results: Dict[str, Any], baseline: Dict[str, Any], changes: Dict[str, float],
+                threshold: float) -> List[str]:
+    """
+    The benchmarks whose best sample got worse by more than `threshold`, and whose median is also worse
+    than the middle half of the baseline's samples, so that a noisy benchmark is not flagged for its noise.
+    """
+    flagged = []
+    for name, change in changes.items():
+        result, base = results['results'][name], baseline['results'][name]
+        outside = (result['value'] < worst_typical(base) if result['higher_is_better']
+                   else result['value'] > worst_typical(base))
+        if change > threshold and outside:
+            flagged.append(name)
+    return sorted(flagged)
+
+
+def report(results: Dict[str, Any], changes: Dict[str, float], flagged: List[str]):
+    print(f"{'benchmark':<32} {'median':>12} {'best':>12} {'p95':>12} {'unit':<9} {'worse by':>10}")
+    for name, result in results['results'].items():
+        scale, unit = (1e6, "us") if result['unit'] == "s" else (1.0, result['unit'])
+        line = (f"{name:<32} {result['value'] * scale:>12.2f} {best(result) * scale:>12.2f} "
+                f"{result['p95'] * scale:>12.2f} {unit:<9}")
+        if name in changes:
+            line += f" {changes[name]:>+10.1%}"
+            if name in flagged:
+                line += "  REGRESSION"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the game engine, server, client and model hot paths")
+    parser.add_argument('--only', nargs='+', choices=GROUPS, default=list(GROUPS), help='Benchmark groups to run')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to')
+    parser.add_argument('--baseline', default=None, help='JSON results of an earlier run to compare with')
+    parser.add_argument('--save-baseline', default=None, help='Also write the results to this file as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative slowdown of the best sample against the baseline\'s counted as a regression '
+                             '(if the median is also outside the baseline\'s spread)')
+    parser.add_argument('--confirm', type=int, default=2,
+                        help='Times a suspected regression is timed again before it is reported')
+    parser.add_argument('--url', default=None, help='Server URL for the SSE benchmarks, a local server is started when omitted')
+    parser.add_argument('--repeat', type=int, default=15, help='Timed rounds per benchmark')
+    parser.add_argument('--number', type=int, default=100, help='Calls per round')
+    parser.add_argument('--model-repeat', type=int, default=5, help='Generate calls per model benchmark')
+    parser.add_argument('--new-tokens', type=int, default=32, help='Tokens generated per model call')
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--hidden-size', type=int, default=64, help='Width of the random model')
+    parser.add_argument('--layers', type=int, default=2, help='Decoder layers of the random model')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    # FastMCP logs every request at INFO level, which would drown the report.
+    logging.disable(logging.INFO)
+
+    samples = collect(args)
+    results = to_json(samples)
+    changes: Dict[str, float] = {}
+    flagged: List[str] = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        changes = compare(results, baseline)
+        flagged = regressions(results, baseline, changes, args.threshold)
+        # The machine's speed drifts between runs by more than a run's own spread shows, so a suspected
+        # regression is timed again and only kept if it persists with the new samples pooled in.
+        for _ in range(args.confirm):
+            if not flagged:
+                break
+            print(f"Timing {len(flagged)} suspected regression(s) again: {', '.join(flagged)}")
+            groups = sorted({name.split(".")[0] for name in flagged})
+            again = {result.name: result for result in collect(argparse.Namespace(**{**vars(args), 'only': groups}))}
+            for result in samples:
+                if result.name in flagged and result.name in again:
+                    result.samples += again[result.name].samples
+            results = to_json(samples)
+            changes = compare(results, baseline)
+            flagged = regressions(results, baseline, changes, args.threshold)
+    report(results, changes, flagged)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+    if flagged:
+        print(f"{len(flagged)} regression(s) beyond {args.threshold:.0%}: {', '.join(flagged)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
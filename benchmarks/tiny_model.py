@@ -0,0 +1,74 @@
+import os
+import tempfile
+
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import AutoConfig, AutoModelForCausalLM, PreTrainedTokenizerFast
+
+from agents.prompts import defuser_prompt, expert_prompt
+from game.bomb import Bomb
+from game_mcp.game_server import HELP_TEXT, format_state
+
+CHAT_TEMPLATE = (
+    "{% for message in messages %}<|im_start|>{{ message['role'] }}\n{{ message['content'] }}<|im_end|>\n{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+)
+SPECIAL_TOKENS = ["<|endoftext|>", "<|im_start|>", "<|im_end|>"]
+
+
+def _corpus():
+    """Text like the prompts the agents send, to train the tokenizer on."""
+    for module in ("wire", "button", "simon", "memory"):
+        bomb = Bomb(module)
+        state = format_state(bomb)
+        for mode in ("default", "natural", "json"):
+            for message in defuser_prompt(state, "", mode, 1) + expert_prompt(HELP_TEXT, state, mode):
+                yield message['content']
+
+
+def tiny_checkpoint(path: str = None, hidden_size: int = 64, layers: int = 2, vocab_size: int = 1024,
+                    seed: int = 0) -> str:
+    """
+    Save a randomly initialized Qwen3 model and a byte-level BPE tokenizer with a chat template,
+    so that HFModel can be benchmarked without downloading a checkpoint. Its outputs are noise;
+    only its speed is of interest.
+
+    :param path: Directory to save to, one in the temporary directory per configuration if None.
+    :param hidden_size: Width of the model.
+    :param layers: Number of decoder layers.
+    :param vocab_size: Size of the tokenizer's vocabulary.
+    :param seed: Seed of the initial weights.
+    :return: The checkpoint directory, usable as an HFModel checkpoint.
+    """
+    path = path or os.path.join(tempfile.gettempdir(), f"tiny-qwen3-{hidden_size}x{layers}-{vocab_size}-{seed}")
+    if os.path.exists(os.path.join(path, "model.safetensors")):
+        return path
+
+    bpe = Tokenizer(models.BPE())
+    bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = decoders.ByteLevel()
+    bpe.train_from_iterator(_corpus(), trainers.BpeTrainer(
+        vocab_size=vocab_size, special_tokens=SPECIAL_TOKENS, initial_alphabet=pre_tokenizers.ByteLevel.alphabet()))
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=bpe, eos_token="<|im_end|>", pad_token="<|endoftext|>",
+                                        chat_template=CHAT_TEMPLATE)
+
+    config = AutoConfig.for_model(
+        "qwen3",
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 3,
+        num_hidden_layers=layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        head_dim=hidden_size // 4,
+        max_position_embeddings=8192,
+        tie_word_embeddings=True,
+        sliding_window=None,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    torch.manual_seed(seed)
+    model = AutoModelForCausalLM.from_config(config)
+    model.save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    return path
@@ -10,6 +10,15 @@ from pydantic import ConfigDict
 # Feel free to import any libraries you need - if needed change requirements.txt
 # In this file it also applies to classes and functions :)
 
+# One loop for all tools, so the Defuser and Expert tools share a single pooled MCP session
+# instead of re-connecting on every asyncio.run().
+_loop = asyncio.new_event_loop()
+
+
+def run_sync(coro):
+    """Run a client coroutine on the loop shared by all tools"""
+    return _loop.run_until_complete(coro)
+
 
 class DefuserTool(BaseTool):
     name: str = "defuser_tool"
@@ -19,11 +28,11 @@ class DefuserTool(BaseTool):
     def __init__(self, server_url: str):
         super().__init__()
         self.defuser = Defuser()
-        asyncio.run(self.defuser.connect_to_server(server_url))
+        run_sync(self.defuser.connect_to_server(server_url))
 
     def _run(self, command: str) -> str:
         """Sync wrapper to run defuser action"""
-        return asyncio.run(self.defuser.run(command))
+        return run_sync(self.defuser.run(command))
 
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
@@ -37,11 +46,11 @@ class ExpertTool(BaseTool):
     def __init__(self, server_url: str):
         super().__init__()
         self.expert = Expert()
-        asyncio.run(self.expert.connect_to_server(server_url))
+        run_sync(self.expert.connect_to_server(server_url))
 
     def _run(self, _: str = "") -> str:
         """Sync wrapper to run expert action"""
-        return asyncio.run(self.expert.run())
+        return run_sync(self.expert.run())
 
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
@@ -0,0 +1,368 @@
+"""
+Headless simulator that plays many bombs at once.
+
+BombBatch holds N bombs as NumPy arrays and applies one integer action per bomb with step().
+Actions are indices into ACTIONS and results are indices into RESULTS. Bomb i of
+BombBatch.generate(n, module, seed) behaves exactly like
+
+    random.seed(seed + i)
+    bomb = Bomb(module)
+
+played with the same actions, provided nothing else draws from `random` in between: the
+randomness the modules consume while being played (the button strip colour and the later
+memory stages) is drawn up front, in the same order the modules would draw it.
+
+Run `python -m game.bomb_batch` to check this against Bomb and to measure throughput.
+"""
+import argparse
+import random
+import time
+from typing import Optional
+
+import numpy as np
+
+from game import oracle
+from game.bomb import Bomb
+from game.modules.button_module import ButtonModule
+from game.modules.memory_module import MemoryModule
+from game.modules.module import ActionResult, Module
+from game.modules.regular_wires_module import RegularWiresModule
+from game.modules.simon_says_module import SimonSaysModule
+
+MODULE_NAMES = ("wire", "button", "simon", "memory")
+WIRE, BUTTON, SIMON, MEMORY = range(len(MODULE_NAMES))
+MODULE_CLASSES = (RegularWiresModule, ButtonModule, SimonSaysModule, MemoryModule)
+MAX_MODULES = len(MODULE_NAMES)
+
+RESULTS = tuple(ActionResult)
+CHANGED, DISARMED, EXPLODED, INCORRECT = (RESULTS.index(r) for r in
+                                          (ActionResult.CHANGED, ActionResult.DISARMED,
+                                           ActionResult.EXPLODED, ActionResult.INCORRECT))
+
+RELEASE_DIGITS = (1, 4, 5)
+ACTIONS = (
+    [f"cut wire {i}" for i in range(1, oracle.MAX_WIRES + 1)]
+    + ["press", "hold"]
+    + [f"release on {d}" for d in RELEASE_DIGITS]
+    + [f"press {color}" for color in oracle.SIMON_COLORS]
+    + [f"press position {i}" for i in range(1, 5)]
+)
+ACTION_IDS = {action: i for i, action in enumerate(ACTIONS)}
+CUT_WIRE = ACTION_IDS["cut wire 1"]
+PRESS = ACTION_IDS["press"]
+HOLD = ACTION_IDS["hold"]
+RELEASE = ACTION_IDS["release on 1"]
+PRESS_COLOR = ACTION_IDS[f"press {oracle.SIMON_COLORS[0]}"]
+PRESS_POSITION = ACTION_IDS["press position 1"]
+NO_ACTION = -1
+
+
+def encode_actions(actions: list[str]) -> np.ndarray:
+    """Action strings to action ids, NO_ACTION for anything outside ACTIONS."""
+    return np.array([ACTION_IDS.get(action.lower().strip(), NO_ACTION) for action in actions], dtype=np.int8)
+
+
+class BombBatch:
+    def __init__(self, n: int):
+        """
+        Allocate n empty bombs, use BombBatch.generate() to get playable ones.
+
+        :param n: Number of bombs.
+        """
+        self.n = n
+        self.rows = np.arange(n)
+        self.modules = np.full((n, MAX_MODULES), -1, dtype=np.int8)
+        self.num_modules = np.zeros(n, dtype=np.int8)
+        self.current = np.zeros(n, dtype=np.int8)
+        self.exploded = np.zeros(n, dtype=bool)
+        self.disarmed = np.zeros(n, dtype=bool)
+
+        self.wire_serial = np.zeros(n, dtype="<U6")
+        self.wire_colors = np.full((n, oracle.MAX_WIRES), -1, dtype=np.int8)
+
+        self.button_color = np.zeros(n, dtype=np.int8)
+        self.button_label = np.zeros(n, dtype=np.int8)
+        self.batteries = np.zeros(n, dtype=np.int8)
+        self.car = np.zeros(n, dtype=bool)
+        self.frk = np.zeros(n, dtype=bool)
+        self.holding = np.zeros(n, dtype=bool)
+        self.strip = np.zeros(n, dtype=np.int8)  # Drawn up front, shown once the button is held
+
+        self.simon_serial = np.zeros(n, dtype="<U6")
+        self.has_vowel = np.zeros(n, dtype=bool)
+        self.simon_sequence = np.zeros((n, oracle.SIMON_LENGTH), dtype=np.int8)
+        self.simon_round = np.zeros(n, dtype=np.int8)
+        self.simon_inputs = np.zeros((n, oracle.SIMON_LENGTH), dtype=np.int8)
+        self.simon_count = np.zeros(n, dtype=np.int8)
+
+        # Memory stages are drawn when the previous stage is solved, after the button strip if the
+        # button was held. Both variants are kept, indexed by `holding`.
+        self.memory_display = np.ones((n, 2, oracle.MEMORY_STAGES), dtype=np.int8)
+        self.memory_labels = np.broadcast_to(
+            np.arange(1, 5, dtype=np.int8), (n, 2, oracle.MEMORY_STAGES, 4)).copy()
+        self.memory_stage = np.zeros(n, dtype=np.int8)
+
+    @classmethod
+    def generate(cls, n: int, module: Optional[str] = None, seed: int = 0) -> "BombBatch":
+        """
+        Generate n bombs, bomb i as Bomb(module) would be after random.seed(seed + i).
+        The state of the global `random` generator is left untouched.
+        """
+        batch = cls(n)
+        saved = random.getstate()
+        try:
+            for i in range(n):
+                random.seed(seed + i)
+                batch._encode(i, Bomb(module))
+        finally:
+            random.setstate(saved)
+        batch._solve()
+        return batch
+
+    def _encode(self, i: int, bomb: Bomb):
+        self.num_modules[i] = len(bomb.modules)
+        button = memory = None
+        for j, module in enumerate(bomb.modules):
+            kind = MODULE_CLASSES.index(type(module))
+            self.modules[i, j] = kind
+            if kind == WIRE:
+                self.wire_serial[i] = module.serial_number
+                self.wire_colors[i, :len(module.wire_colors)] = [oracle.WIRE_COLORS.index(c)
+                                                                 for c in module.wire_colors]
+            elif kind == BUTTON:
+                button = module
+                self.button_color[i] = oracle.BUTTON_COLORS.index(module.button_color)
+                self.button_label[i] = oracle.BUTTON_LABELS.index(module.button_label)
+                self.batteries[i] = module.batteries
+                self.car[i] = "CAR" in module.lit_indicators
+                self.frk[i] = "FRK" in module.lit_indicators
+            elif kind == SIMON:
+                self.simon_serial[i] = module.serial_number
+                self.has_vowel[i] = module.has_vowel
+                self.simon_sequence[i] = module.sequence
+            else:
+                memory = module
+
+        if memory is None:
+            if button is not None:
+                self.strip[i] = oracle.STRIP_COLORS.index(button._draw_strip_color())
+            return
+
+        state = random.getstate()
+        first_stage = memory.display_number, memory.button_labels
+        for held in (False, True):
+            random.setstate(state)
+            if held:
+                if button is None:
+                    break
+                self.strip[i] = oracle.STRIP_COLORS.index(button._draw_strip_color())
+            self.memory_display[i, int(held), 0], self.memory_labels[i, int(held), 0] = first_stage
+            for stage in range(1, oracle.MEMORY_STAGES):
+                memory.generate_stage()
+                self.memory_display[i, int(held), stage] = memory.display_number
+                self.memory_labels[i, int(held), stage] = memory.button_labels
+
+    def _solve(self):
+        """Precompute the correct answers of every module."""
+        self.wire_count = (self.wire_colors >= 0).sum(axis=1)
+        self.wire_answer = oracle.solve_wires(self.wire_colors, self._wire_serial_odd())
+        self.button_press = oracle.solve_button_press(
+            self.button_color, self.button_label, self.batteries, self.car, self.frk)
+        self.release_digit = oracle.solve_button_release(self.strip)
+        self.simon_expected = oracle.solve_simon(self.simon_sequence, self.has_vowel)
+        self.memory_positions = np.stack([
+            oracle.solve_memory(self.memory_display[:, held], self.memory_labels[:, held]) for held in (0, 1)
+        ], axis=1)
+
+    def _wire_serial_odd(self) -> np.ndarray:
+        digits = np.array([next((c for c in reversed(s) if c.isdigit()), "0") for s in self.wire_serial])
+        return digits.astype(np.int8) % 2 == 1
+
+    def current_types(self) -> np.ndarray:
+        """(N,) module type of the module each bomb is at, -1 for finished bombs."""
+        kinds = self.modules[self.rows, np.minimum(self.current, MAX_MODULES - 1)]
+        return np.where(self.exploded | self.disarmed, -1, kinds)
+
+    def step(self, actions: np.ndarray) -> np.ndarray:
+        """
+        Apply one action to every bomb, like Bomb.do_action.
+
+        :param actions: (N,) action ids, NO_ACTION (or any id the current module does not accept) is incorrect.
+        :return: (N,) result ids, indices into RESULTS.
+        """
+        actions = np.asarray(actions, dtype=np.int64)
+        rows = self.rows
+        kinds = self.current_types()
+        result = np.full(self.n, INCORRECT, dtype=np.int8)
+
+        # Regular wires
+        wire = actions - CUT_WIRE
+        m = (kinds == WIRE) & (wire >= 0) & (wire < self.wire_count)
+        result[m] = np.where(wire[m] + 1 == self.wire_answer[m], DISARMED, EXPLODED)
+
+        # Button
+        m = (kinds == BUTTON) & ~self.holding
+        press = m & (actions == PRESS)
+        result[press] = np.where(self.button_press[press], DISARMED, EXPLODED)
+        hold = m & (actions == HOLD)
+        release = actions - RELEASE
+        m = (kinds == BUTTON) & self.holding & (release >= 0) & (release < len(RELEASE_DIGITS))
+        digits = np.take(RELEASE_DIGITS, release[m])
+        result[m] = np.where(digits == self.release_digit[m], DISARMED, EXPLODED)
+        self.holding |= hold
+        result[hold] = CHANGED
+
+        # Simon says
+        color = actions - PRESS_COLOR
+        m = (kinds == SIMON) & (color >= 0) & (color < len(oracle.SIMON_COLORS))
+        count = self.simon_count
+        expected = self.simon_expected[rows, np.minimum(count, oracle.SIMON_LENGTH - 1)]
+        correct = m & (color == expected)
+        result[m & ~correct] = EXPLODED
+        self.simon_inputs[rows[correct], count[correct]] = color[correct]
+        count[correct] += 1
+        done = correct & (count == self.simon_round + 1)
+        self.simon_round[done] += 1
+        count[done] = 0
+        result[correct] = np.where(self.simon_round[correct] + 1 >= oracle.SIMON_LENGTH, DISARMED, CHANGED)
+
+        # Memory
+        position = actions - PRESS_POSITION + 1
+        m = (kinds == MEMORY) & (position >= 1) & (position <= 4)
+        stage = self.memory_stage
+        answer = self.memory_positions[rows, self.holding.astype(np.intp),
+                                       np.minimum(stage, oracle.MEMORY_STAGES - 1)]
+        correct = m & (position == answer)
+        result[m & ~correct] = EXPLODED
+        stage[correct] += 1
+        result[correct] = np.where(stage[correct] >= oracle.MEMORY_STAGES, DISARMED, CHANGED)
+
+        # Bomb
+        solved = result == DISARMED
+        self.current[solved] += 1
+        finished = solved & (self.current >= self.num_modules)
+        result[solved & ~finished] = CHANGED
+        self.disarmed |= finished
+        self.exploded |= result == EXPLODED
+        result[kinds == -1] = np.where(self.exploded[kinds == -1], EXPLODED, DISARMED)
+        return result
+
+    def correct_actions(self) -> np.ndarray:
+        """(N,) the action that makes progress on each bomb, NO_ACTION for finished bombs."""
+        rows, kinds = self.rows, self.current_types()
+        actions = np.full(self.n, NO_ACTION, dtype=np.int8)
+        actions = np.where(kinds == WIRE, CUT_WIRE + self.wire_answer - 1, actions)
+        release = RELEASE + np.searchsorted(RELEASE_DIGITS, self.release_digit)
+        button = np.where(self.holding, release, np.where(self.button_press, PRESS, HOLD))
+        actions = np.where(kinds == BUTTON, button, actions)
+        simon = PRESS_COLOR + self.simon_expected[rows, np.minimum(self.simon_count, oracle.SIMON_LENGTH - 1)]
+        actions = np.where(kinds == SIMON, simon, actions)
+        memory = PRESS_POSITION - 1 + self.memory_positions[
+            rows, self.holding.astype(np.intp), np.minimum(self.memory_stage, oracle.MEMORY_STAGES - 1)]
+        actions = np.where(kinds == MEMORY, memory, actions)
+        return actions.astype(np.int8)
+
+    def action_mask(self) -> np.ndarray:
+        """(N, len(ACTIONS)) the actions listed by each bomb's state()."""
+        kinds = self.current_types()
+        mask = np.zeros((self.n, len(ACTIONS)), dtype=bool)
+        mask[:, CUT_WIRE:CUT_WIRE + oracle.MAX_WIRES] = (
+            (kinds == WIRE)[:, None] & (np.arange(oracle.MAX_WIRES) < self.wire_count[:, None]))
+        mask[:, [PRESS, HOLD]] = ((kinds == BUTTON) & ~self.holding)[:, None]
+        mask[:, RELEASE:RELEASE + len(RELEASE_DIGITS)] = ((kinds == BUTTON) & self.holding)[:, None]
+        mask[:, PRESS_COLOR:PRESS_COLOR + len(oracle.SIMON_COLORS)] = (kinds == SIMON)[:, None]
+        mask[:, PRESS_POSITION:PRESS_POSITION + 4] = (kinds == MEMORY)[:, None]
+        return mask
+
+    def module(self, i: int) -> Module:
+        """Build the module object bomb i is currently at, in its current state."""
+        kind = self.modules[i, self.current[i]]
+        module = MODULE_CLASSES[kind].__new__(MODULE_CLASSES[kind])
+        Module.__init__(module)
+        if kind == WIRE:
+            module.serial_number = str(self.wire_serial[i])
+            module.wire_colors = [oracle.WIRE_COLORS[c] for c in self.wire_colors[i] if c >= 0]
+        elif kind == BUTTON:
+            module.button_color = oracle.BUTTON_COLORS[self.button_color[i]]
+            module.button_label = oracle.BUTTON_LABELS[self.button_label[i]]
+            module.batteries = int(self.batteries[i])
+            module.lit_indicators = [name for name, lit in (("CAR", self.car[i]), ("FRK", self.frk[i])) if lit]
+            module.is_holding = bool(self.holding[i])
+            module.strip_color = oracle.STRIP_COLORS[self.strip[i]] if self.holding[i] else None
+        elif kind == SIMON:
+            module.colors = list(SimonSaysModule.COLORS)
+            module.serial_number = str(self.simon_serial[i])
+            module.has_vowel = bool(self.has_vowel[i])
+            module.sequence = [int(c) for c in self.simon_sequence[i]]
+            module.current_round = int(self.simon_round[i])
+            module.max_rounds = oracle.SIMON_LENGTH
+            module.user_sequence = [int(c) for c in self.simon_inputs[i, :self.simon_count[i]]]
+            module.mistake = False
+        else:
+            held, stage = int(self.holding[i]), int(self.memory_stage[i])
+            module.current_stage = stage + 1
+            module.max_stages = oracle.MEMORY_STAGES
+            module.display_number = int(self.memory_display[i, held, stage])
+            module.button_labels = [int(label) for label in self.memory_labels[i, held, stage]]
+        return module
+
+    def state(self, i: int) -> tuple[str, list[str]]:
+        """Render bomb i exactly like Bomb.state()."""
+        if self.exploded[i]:
+            return "Bomb exploded!", []
+        if self.disarmed[i]:
+            return "Bomb disarmed!", []
+        return self.module(i).state()
+
+
+def verify(n: int = 2000, steps: int = 60, module: Optional[str] = None, seed: int = 0):
+    """Play n bombs with a mix of correct and random actions in a batch and one by one, and compare."""
+    rng = np.random.default_rng(seed)
+    batch = BombBatch.generate(n, module, seed)
+    actions = np.zeros((steps, n), dtype=np.int8)
+    results = np.zeros((steps, n), dtype=np.int8)
+    states = [[batch.state(i) for i in range(n)]]
+    for t in range(steps):
+        random_actions = rng.integers(NO_ACTION, len(ACTIONS), size=n)
+        actions[t] = np.where(rng.random(n) < 0.95, batch.correct_actions(), random_actions)
+        results[t] = batch.step(actions[t])
+        states.append([batch.state(i) for i in range(n)])
+
+    for i in range(n):
+        random.seed(seed + i)
+        bomb = Bomb(module)
+        assert bomb.state() == states[0][i], (i, 0)
+        for t in range(steps):
+            action = ACTIONS[actions[t, i]] if actions[t, i] != NO_ACTION else "noop"
+            result = bomb.do_action(action)
+            assert RESULTS[results[t, i]] == result, (i, t, action, result, RESULTS[results[t, i]])
+            assert bomb.state() == states[t + 1][i], (i, t, action)
+
+
+def bench(n: int = 100000, steps: int = 100, seed: int = 0):
+    batch = BombBatch.generate(n, seed=seed)
+    rng = np.random.default_rng(seed)
+    start = time.perf_counter()
+    for _ in range(steps):
+        actions = np.where(rng.random(n) < 0.98, batch.correct_actions(), rng.integers(0, len(ACTIONS), size=n))
+        batch.step(actions)
+    elapsed = time.perf_counter() - start
+    print(f"{n * steps / elapsed:,.0f} bomb steps/s ({n} bombs, {steps} steps, "
+          f"{batch.disarmed.mean():.1%} disarmed, {batch.exploded.mean():.1%} exploded)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify and benchmark the batched bomb simulator")
+    parser.add_argument('--verify', type=int, default=2000, help='Bombs to compare against Bomb per module setting')
+    parser.add_argument('--bench', type=int, default=100000, help='Bombs to time')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for module in (None, *MODULE_NAMES):
+        verify(args.verify, module=module, seed=args.seed)
+    print(f"BombBatch matches Bomb on {args.verify} bombs for every module setting.")
+    bench(args.bench, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
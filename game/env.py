@@ -0,0 +1,414 @@
+"""
+Gym-style environments for playing bombs programmatically, without the MCP server.
+
+BombEnv wraps one Bomb with reset(seed) / step(action). VectorBombEnv runs K of them in the
+calling process and SubprocVectorBombEnv shards K of them over worker processes that write
+observations, rewards and flags into shared memory. Actions are ids into
+game.bomb_batch.ACTIONS (the union of all modules' available-actions lists); the ones the
+current module lists are given by the action mask.
+
+Observations are either the text of Bomb.state() ("text") or a fixed-size int16 vector
+("structured", layout in OBS_FIELDS).
+
+Run `python -m game.env` to measure steps per second of every backend.
+"""
+import argparse
+import multiprocessing as mp
+import random
+import time
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from typing import Any, Optional, Union
+
+import numpy as np
+
+from game import oracle
+from game.bomb import Bomb
+from game.bomb_batch import ACTIONS, ACTION_IDS, MODULE_CLASSES, NO_ACTION, RESULTS
+from game.modules.button_module import ButtonModule
+from game.modules.memory_module import MemoryModule
+from game.modules.module import ActionResult
+
+OBSERVATION_TYPES = ("text", "structured")
+REWARDS = {ActionResult.DISARMED: 1.0, ActionResult.EXPLODED: -1.0}
+
+# name -> (offset, size) of each field of a structured observation
+OBS_FIELDS = {}
+OBS_SIZE = 0
+for _name, _size in (
+        ("module", 1), ("module_index", 1), ("exploded", 1), ("disarmed", 1),
+        ("wire_colors", oracle.MAX_WIRES), ("serial_odd", 1),
+        ("button_color", 1), ("button_label", 1), ("batteries", 1), ("car", 1), ("frk", 1),
+        ("holding", 1), ("strip", 1),
+        ("has_vowel", 1), ("simon_round", 1), ("simon_sequence", oracle.SIMON_LENGTH),
+        ("simon_inputs", oracle.SIMON_LENGTH),
+        ("memory_stage", 1), ("memory_display", 1), ("memory_labels", 4)):
+    OBS_FIELDS[_name] = (OBS_SIZE, _size)
+    OBS_SIZE += _size
+
+
+def encode_observation(bomb: Bomb, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Structured observation of a bomb: what its state() shows, as integers.
+    Colours and labels are indices into the game.oracle tuples, fields of other modules are -1.
+    """
+    obs = np.full(OBS_SIZE, -1, dtype=np.int16) if out is None else out
+    obs[:] = -1
+
+    def put(name, value):
+        offset, size = OBS_FIELDS[name]
+        if size == 1:
+            obs[offset] = value
+        else:
+            obs[offset:offset + len(value)] = value
+
+    put("module_index", bomb.current_module)
+    put("exploded", bomb.exploded)
+    put("disarmed", bomb.disarmed)
+    if bomb.exploded or bomb.disarmed:
+        return obs
+
+    module = bomb.modules[bomb.current_module]
+    kind = MODULE_CLASSES.index(type(module))
+    put("module", kind)
+    if kind == 0:
+        put("wire_colors", [oracle.WIRE_COLORS.index(c) for c in module.wire_colors])
+        put("serial_odd", module.serial_odd)
+    elif kind == 1:
+        put("button_color", oracle.BUTTON_COLORS.index(module.button_color))
+        put("button_label", oracle.BUTTON_LABELS.index(module.button_label))
+        put("batteries", module.batteries)
+        put("car", "CAR" in module.lit_indicators)
+        put("frk", "FRK" in module.lit_indicators)
+        put("holding", module.is_holding)
+        if module.is_holding:
+            put("strip", oracle.STRIP_COLORS.index(module.strip_color))
+    elif kind == 2:
+        put("has_vowel", module.has_vowel)
+        put("simon_round", module.current_round)
+        put("simon_sequence", module.sequence[:module.current_round + 1])
+        put("simon_inputs", module.user_sequence)
+    else:
+        put("memory_stage", module.current_stage)
+        put("memory_display", module.display_number)
+        put("memory_labels", module.button_labels)
+    return obs
+
+
+class BombEnv:
+    def __init__(self, module: Optional[str] = None, observation: str = "text", max_steps: int = 100,
+                 invalid_penalty: float = 0.0):
+        """
+        :param module: Module of the bombs, as for Bomb(module).
+        :param observation: "text" or "structured".
+        :param max_steps: Steps after which an episode is truncated.
+        :param invalid_penalty: Reward for actions the module does not accept.
+        """
+        if observation not in OBSERVATION_TYPES:
+            raise ValueError(f"Unknown observation type: {observation}")
+        self.module = module
+        self.observation = observation
+        self.max_steps = max_steps
+        self.invalid_penalty = invalid_penalty
+        self.bomb: Optional[Bomb] = None
+        self.steps = 0
+        self._actions: list[str] = []
+        self._random_state = random.getstate()
+
+    @contextmanager
+    def _own_random(self):
+        """Give the bomb this environment's own stream of the global `random` generator."""
+        outer = random.getstate()
+        random.setstate(self._random_state)
+        try:
+            yield
+        finally:
+            self._random_state = random.getstate()
+            random.setstate(outer)
+
+    @property
+    def num_actions(self) -> int:
+        return len(ACTIONS)
+
+    def action_mask(self) -> np.ndarray:
+        """The actions listed by the bomb's current state."""
+        mask = np.zeros(len(ACTIONS), dtype=bool)
+        mask[[ACTION_IDS[action] for action in self._actions]] = True
+        return mask
+
+    def _observe(self) -> tuple[Any, dict]:
+        state, self._actions = self.bomb.state()
+        obs = state if self.observation == "text" else encode_observation(self.bomb)
+        return obs, {"actions": self._actions}
+
+    def _draws_random(self) -> bool:
+        """Only holding the button and solving memory stages draw random numbers during play."""
+        bomb = self.bomb
+        if bomb.exploded or bomb.disarmed:
+            return False
+        return isinstance(bomb.modules[bomb.current_module], (ButtonModule, MemoryModule))
+
+    def reset(self, seed: Optional[int] = None) -> tuple[Any, dict]:
+        """
+        Start a new bomb, the same one as Bomb(module) right after random.seed(seed).
+        Every environment draws from its own random stream, so other environments or other users of
+        `random` do not change how the bomb plays.
+
+        :return: (observation, info)
+        """
+        if seed is None:
+            seed = random.randrange(2 ** 62)
+        with self._own_random():
+            random.seed(seed)
+            self.bomb = Bomb(self.module)
+        self.steps = 0
+        return self._observe()
+
+    def step(self, action: Union[int, str]) -> tuple[Any, float, bool, bool, dict]:
+        """
+        Perform an action, given as an id into ACTIONS or as a command string.
+
+        :return: (observation, reward, terminated, truncated, info), info["result"] is the ActionResult.
+        """
+        if not isinstance(action, str):
+            action = ACTIONS[action] if 0 <= action < len(ACTIONS) else ""
+        if self._draws_random():
+            with self._own_random():
+                result = self.bomb.do_action(action)
+        else:
+            result = self.bomb.do_action(action)
+        self.steps += 1
+
+        reward = REWARDS.get(result, self.invalid_penalty if result == ActionResult.INCORRECT else 0.0)
+        terminated = self.bomb.exploded or self.bomb.disarmed
+        truncated = not terminated and self.steps >= self.max_steps
+        obs, info = self._observe()
+        info["result"] = result
+        return obs, reward, terminated, truncated, info
+
+
+class VectorBombEnv:
+    """K BombEnvs stepped together in this process. Finished episodes are reset automatically."""
+
+    def __init__(self, num_envs: int, module: Optional[str] = None, observation: str = "structured",
+                 seed_offset: int = 0, seed_stride: Optional[int] = None, **kwargs):
+        """
+        :param num_envs: Number of environments (K).
+        :param module: Module of the bombs, as for Bomb(module).
+        :param observation: "text" or "structured".
+        :param seed_offset: Added to the seed of every environment.
+        :param seed_stride: Seed increment between episodes of one environment, K by default.
+        :param kwargs: Further BombEnv arguments.
+        """
+        self.num_envs = num_envs
+        self.observation = observation
+        self.seed_offset = seed_offset
+        self.seed_stride = seed_stride or num_envs
+        self.envs = [BombEnv(module, observation, **kwargs) for _ in range(num_envs)]
+        self._next_seeds = np.zeros(num_envs, dtype=np.int64)
+
+    def _stack(self, observations: list) -> Any:
+        return observations if self.observation == "text" else np.stack(observations)
+
+    def action_masks(self) -> np.ndarray:
+        return np.stack([env.action_mask() for env in self.envs])
+
+    def reset(self, seed: Optional[int] = None) -> tuple[Any, dict]:
+        """
+        Reset every environment, env i with seed + i. Automatic resets continue with seed + i + K, seed + i + 2K, ...
+        """
+        if seed is None:
+            seed = random.SystemRandom().randrange(2 ** 62)
+        self._next_seeds = seed + self.seed_offset + np.arange(self.num_envs, dtype=np.int64)
+        observations = [self._reset_env(i)[0] for i in range(self.num_envs)]
+        return self._stack(observations), {"action_mask": self.action_masks()}
+
+    def _reset_env(self, i: int) -> tuple[Any, dict]:
+        seed = int(self._next_seeds[i])
+        self._next_seeds[i] += self.seed_stride
+        return self.envs[i].reset(seed)
+
+    def step(self, actions: np.ndarray) -> tuple[Any, np.ndarray, np.ndarray, np.ndarray, dict]:
+        """
+        Step every environment with its action id.
+
+        :return: (observations, rewards, terminated, truncated, info) with info["result"] holding
+                 result ids (indices into game.bomb_batch.RESULTS) and info["action_mask"] the masks.
+        """
+        observations = []
+        rewards = np.zeros(self.num_envs, dtype=np.float32)
+        terminated = np.zeros(self.num_envs, dtype=bool)
+        truncated = np.zeros(self.num_envs, dtype=bool)
+        results = np.zeros(self.num_envs, dtype=np.int8)
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            obs, rewards[i], terminated[i], truncated[i], info = env.step(int(action))
+            results[i] = RESULTS.index(info["result"])
+            if terminated[i] or truncated[i]:
+                obs, _ = self._reset_env(i)
+            observations.append(obs)
+        info = {"result": results, "action_mask": self.action_masks()}
+        return self._stack(observations), rewards, terminated, truncated, info
+
+    def close(self):
+        pass
+
+
+class _SharedBuffers:
+    """Arrays of all environments, in one shared memory block, that workers fill in for their shard."""
+
+    FIELDS = (
+        ("observations", np.int16, (OBS_SIZE,)),
+        ("actions", np.int8, ()),
+        ("rewards", np.float32, ()),
+        ("terminated", bool, ()),
+        ("truncated", bool, ()),
+        ("results", np.int8, ()),
+        ("action_mask", bool, (len(ACTIONS),)),
+    )
+
+    def __init__(self, num_envs: int, name: Optional[str] = None):
+        layout, size = [], 0
+        for field, dtype, shape in self.FIELDS:
+            nbytes = int(np.prod((num_envs, *shape))) * np.dtype(dtype).itemsize
+            layout.append((field, dtype, (num_envs, *shape), size))
+            size += -(-nbytes // 8) * 8
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        for field, dtype, shape, offset in layout:
+            setattr(self, field, np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset))
+
+    def close(self):
+        for field, _, _ in self.FIELDS:
+            delattr(self, field)
+        self.shm.close()
+
+
+def _worker(conn, shm_name: str, num_envs: int, start: int, stop: int, module: Optional[str],
+            observation: str, kwargs: dict):
+    buffers = _SharedBuffers(num_envs, shm_name)
+    # Seed env i of the shard like env start + i of a VectorBombEnv with all num_envs environments.
+    envs = VectorBombEnv(stop - start, module, observation, seed_offset=start, seed_stride=num_envs, **kwargs)
+    shard = slice(start, stop)
+
+    def publish(observations, info):
+        if observation == "structured":
+            buffers.observations[shard] = observations
+        buffers.action_mask[shard] = info["action_mask"]
+        return observations if observation == "text" else None
+
+    try:
+        while True:
+            command, arg = conn.recv()
+            if command == "reset":
+                conn.send(publish(*envs.reset(arg)))
+            elif command == "step":
+                observations, rewards, terminated, truncated, info = envs.step(buffers.actions[shard])
+                buffers.rewards[shard] = rewards
+                buffers.terminated[shard] = terminated
+                buffers.truncated[shard] = truncated
+                buffers.results[shard] = info["result"]
+                conn.send(publish(observations, info))
+            elif command == "close":
+                break
+    finally:
+        buffers.close()
+        conn.close()
+
+
+class SubprocVectorBombEnv:
+    """
+    K BombEnvs sharded over worker processes. Actions, structured observations, rewards, flags and
+    masks are exchanged through shared memory, only text observations go through the pipes.
+    """
+
+    def __init__(self, num_envs: int, num_workers: Optional[int] = None, module: Optional[str] = None,
+                 observation: str = "structured", **kwargs):
+        self.num_envs = num_envs
+        self.observation = observation
+        num_workers = min(num_workers or mp.cpu_count(), num_envs)
+        self.buffers = _SharedBuffers(num_envs)
+        bounds = np.linspace(0, num_envs, num_workers + 1).astype(int)
+
+        self.pipes, self.workers = [], []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            parent, child = mp.Pipe()
+            worker = mp.Process(target=_worker, daemon=True, args=(
+                child, self.buffers.shm.name, num_envs, int(start), int(stop), module, observation, kwargs))
+            worker.start()
+            child.close()
+            self.pipes.append(parent)
+            self.workers.append(worker)
+
+    def _gather(self) -> Any:
+        replies = [pipe.recv() for pipe in self.pipes]
+        if self.observation == "text":
+            return [obs for reply in replies for obs in reply]
+        return self.buffers.observations.copy()
+
+    def action_masks(self) -> np.ndarray:
+        return self.buffers.action_mask.copy()
+
+    def reset(self, seed: Optional[int] = None) -> tuple[Any, dict]:
+        """Reset every environment, seeded as in VectorBombEnv.reset()."""
+        if seed is None:
+            seed = random.SystemRandom().randrange(2 ** 62)
+        for pipe in self.pipes:
+            pipe.send(("reset", seed))
+        return self._gather(), {"action_mask": self.action_masks()}
+
+    def step(self, actions: np.ndarray) -> tuple[Any, np.ndarray, np.ndarray, np.ndarray, dict]:
+        """Step every environment, see VectorBombEnv.step()."""
+        self.buffers.actions[:] = actions
+        for pipe in self.pipes:
+            pipe.send(("step", None))
+        observations = self._gather()
+        info = {"result": self.buffers.results.copy(), "action_mask": self.action_masks()}
+        return (observations, self.buffers.rewards.copy(), self.buffers.terminated.copy(),
+                self.buffers.truncated.copy(), info)
+
+    def close(self):
+        for pipe in self.pipes:
+            pipe.send(("close", None))
+        for worker in self.workers:
+            worker.join()
+        self.buffers.close()
+        self.buffers.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _random_policy(masks: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """A random available action for every environment."""
+    scores = np.where(masks, rng.random(masks.shape), -1)
+    actions = scores.argmax(axis=1)
+    return np.where(masks.any(axis=1), actions, NO_ACTION)
+
+
+def bench(envs, steps: int, seed: int = 0) -> float:
+    rng = np.random.default_rng(seed)
+    _, info = envs.reset(seed)
+    start = time.perf_counter()
+    for _ in range(steps):
+        _, _, _, _, info = envs.step(_random_policy(info["action_mask"], rng))
+    return envs.num_envs * steps / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure steps per second of the bomb environments")
+    parser.add_argument('--envs', type=int, default=64, help='Number of environments')
+    parser.add_argument('--workers', type=int, default=4, help='Worker processes of the subprocess backend')
+    parser.add_argument('--steps', type=int, default=200, help='Vector steps to time')
+    parser.add_argument('--observation', default="structured", choices=OBSERVATION_TYPES)
+    args = parser.parse_args()
+
+    envs = VectorBombEnv(args.envs, observation=args.observation)
+    print(f"   sync: {bench(envs, args.steps):,.0f} steps/s")
+    with SubprocVectorBombEnv(args.envs, args.workers, observation=args.observation) as envs:
+        print(f"subproc: {bench(envs, args.steps):,.0f} steps/s ({args.workers} workers)")
+
+
+if __name__ == "__main__":
+    main()
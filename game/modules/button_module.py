@@ -3,6 +3,8 @@ from game.modules.module import Module, ActionResult
 
 
 class ButtonModule(Module):
+    STRIP_COLORS = ("blue", "white", "yellow", "red", "green")
+
     def __init__(self):
         super().__init__()
         self.colors = ["red", "blue", "white", "yellow"]
@@ -66,6 +68,17 @@ the defuser should press and immediately release the button, or hold it and rele
         
         return state_desc, actions
     
+    def _get_fields(self) -> dict:
+        """Return the state fields."""
+        return {
+            "button_color": self.button_color,
+            "button_label": self.button_label,
+            "batteries": self.batteries,
+            "lit_indicators": list(self.lit_indicators),
+            "holding": self.is_holding,
+            "strip_color": self.strip_color if self.is_holding else None,
+        }
+
     def _do_action(self, action: str) -> ActionResult:
         """Perform the specified action."""
         action = action.lower().strip()
@@ -78,7 +91,7 @@ the defuser should press and immediately release the button, or hold it and rele
                     return ActionResult.EXPLODED
             elif action == "hold":
                 self.is_holding = True
-                self.strip_color = random.choice(["blue", "white", "yellow", "red", "green"])
+                self.strip_color = self._draw_strip_color()
                 return ActionResult.CHANGED
             else:
                 return ActionResult.INCORRECT
@@ -97,6 +110,10 @@ the defuser should press and immediately release the button, or hold it and rele
             else:
                 return ActionResult.INCORRECT
     
+    def _draw_strip_color(self) -> str:
+        """Randomly pick the color of the strip that shows up when the button is held."""
+        return random.choice(self.STRIP_COLORS)
+
     def _should_press(self) -> bool:
         """Determine if the button should be pressed (not held) based on the rules."""
         # If there is more than one battery and the button says "Detonate"
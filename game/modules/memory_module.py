@@ -74,6 +74,15 @@ Note: "Position" refers to the physical location (1-4 from left to right), while
         actions = [f"press position {i}" for i in range(1, 5)]
         return state_desc, actions
     
+    def _get_fields(self) -> dict:
+        """Return the state fields."""
+        return {
+            "stage": self.current_stage,
+            "max_stages": self.max_stages,
+            "display": self.display_number,
+            "button_labels": list(self.button_labels),
+        }
+
     def _do_action(self, action: str) -> ActionResult:
         """Perform the specified action."""
         try:
@@ -41,6 +41,25 @@ class Module:
         To be implemented by subclasses.
         """
         raise NotImplementedError("Subclasses must implement _get_state()")
+
+    def fields(self) -> dict:
+        """
+        Returns what state() describes as typed values, e.g. {"wire_colors": ["red", "blue", "red"]}.
+        Only accessible to the defuser.
+
+        Returns:
+            dict: Field name to JSON-serializable value, empty once the module is disarmed
+        """
+        if self.is_disarmed:
+            return {}
+        return self._get_fields()
+
+    def _get_fields(self) -> dict:
+        """
+        Returns the state fields when the module is not disarmed.
+        To be implemented by subclasses.
+        """
+        raise NotImplementedError("Subclasses must implement _get_fields()")
     
     def do_action(self, action: str) -> ActionResult:
         """
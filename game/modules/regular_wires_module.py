@@ -1,5 +1,6 @@
 import random
 import string
+from game.modules import wires_table
 from game.modules.module import Module, ActionResult
 
 
@@ -71,6 +72,13 @@ of wire colors and the serial number.
         actions = [f"cut wire {i+1}" for i in range(len(self.wire_colors))]
         return state_desc, actions
     
+    def _get_fields(self) -> dict:
+        """Return the state fields."""
+        return {
+            "serial_number": self.serial_number,
+            "wire_colors": list(self.wire_colors),
+        }
+
     def _do_action(self, action: str) -> ActionResult:
         """Perform the specified action."""
         try:
@@ -89,88 +97,99 @@ of wire colors and the serial number.
         except (ValueError, IndexError):
             return ActionResult.INCORRECT
     
+    @property
+    def serial_odd(self) -> bool:
+        """Whether the last digit of the serial number is odd."""
+        for char in reversed(self.serial_number):
+            if char.isdigit():
+                return int(char) % 2 == 1
+        raise ValueError(f"Serial number without a digit: {self.serial_number}")
+
+    def correct_wire(self) -> int:
+        """Return the 1-based number of the wire to cut, looked up in the precomputed table."""
+        return wires_table.lookup(self.wire_colors, self.serial_odd)
+
     def _is_correct_wire(self, wire_num: int) -> bool:
         """Check if the wire is the correct one to cut based on the rules."""
-        num_wires = len(self.wire_colors)
-        
-        # Convert to 0-based indexing
-        wire_idx = wire_num - 1
+        return wire_num == self.correct_wire()
+
+    @staticmethod
+    def _rule_correct_wire(wire_colors: list[str], serial_odd: bool) -> int:
+        """
+        Apply the manual's rules directly and return the 1-based number of the wire to cut.
+        This is the reference the precomputed table is built from and verified against.
+        """
+        num_wires = len(wire_colors)
         
         # Count occurrences of each color
-        red_wires = self.wire_colors.count("red")
-        blue_wires = self.wire_colors.count("blue")
-        yellow_wires = self.wire_colors.count("yellow")
-        white_wires = self.wire_colors.count("white")
-        black_wires = self.wire_colors.count("black")
+        red_wires = wire_colors.count("red")
+        blue_wires = wire_colors.count("blue")
+        yellow_wires = wire_colors.count("yellow")
+        white_wires = wire_colors.count("white")
+        black_wires = wire_colors.count("black")
         
         # Find the last red wire (0-based index)
         last_red_idx = -1
-        for i in range(len(self.wire_colors) - 1, -1, -1):
-            if self.wire_colors[i] == "red":
+        for i in range(len(wire_colors) - 1, -1, -1):
+            if wire_colors[i] == "red":
                 last_red_idx = i
                 break
         
-        # Get the last digit of the serial number
-        last_digit = int([char for char in self.serial_number if char.isdigit()][-1])
-        
-        # Check if serial number is odd
-        serial_odd = last_digit % 2 == 1
-        
         # Apply rules based on number of wires
         if num_wires == 3:
             # If no red wires, cut the second wire
             if red_wires == 0:
-                return wire_idx == 1
+                return 2
             # If the last wire is white, cut the last wire
-            elif self.wire_colors[-1] == "white":
-                return wire_idx == num_wires - 1
+            elif wire_colors[-1] == "white":
+                return num_wires
             # Otherwise, cut the last wire
             else:
-                return wire_idx == num_wires - 1
+                return num_wires
                 
         elif num_wires == 4:
             # If more than one red wire and serial number is odd, cut the last red wire
             if red_wires > 1 and serial_odd:
-                return wire_idx == last_red_idx
+                return last_red_idx + 1
             # If last wire is yellow and no red wires, cut the first wire
-            elif self.wire_colors[-1] == "yellow" and red_wires == 0:
-                return wire_idx == 0
+            elif wire_colors[-1] == "yellow" and red_wires == 0:
+                return 1
             # If exactly one blue wire, cut the first wire
             elif blue_wires == 1:
-                return wire_idx == 0
+                return 1
             # If more than one yellow wire, cut the last wire
             elif yellow_wires > 1:
-                return wire_idx == num_wires - 1
+                return num_wires
             # Otherwise, cut the second wire
             else:
-                return wire_idx == 1
+                return 2
                 
         elif num_wires == 5:
             # If last wire is black and serial number is odd, cut the fourth wire
-            if self.wire_colors[-1] == "black" and serial_odd:
-                return wire_idx == 3
+            if wire_colors[-1] == "black" and serial_odd:
+                return 4
             # If exactly one red wire and more than one yellow wire, cut the first wire
             elif red_wires == 1 and yellow_wires > 1:
-                return wire_idx == 0
+                return 1
             # If no black wires, cut the second wire
             elif black_wires == 0:
-                return wire_idx == 1
+                return 2
             # Otherwise, cut the first wire
             else:
-                return wire_idx == 0
+                return 1
                 
         elif num_wires == 6:
             # If no yellow wires and serial number is odd, cut the third wire
             if yellow_wires == 0 and serial_odd:
-                return wire_idx == 2
+                return 3
             # If exactly one yellow wire and more than one white wire, cut the fourth wire
             elif yellow_wires == 1 and white_wires > 1:
-                return wire_idx == 3
+                return 4
             # If no red wires, cut the last wire
             elif red_wires == 0:
-                return wire_idx == num_wires - 1
+                return num_wires
             # Otherwise, cut the fourth wire
             else:
-                return wire_idx == 3
+                return 4
                 
-        return False
+        raise ValueError(f"Unsupported number of wires: {num_wires}")
@@ -3,16 +3,108 @@ import string
 from game.modules.module import Module, ActionResult
 
 
+def _compile_mappings(colors: tuple[str, ...], mapping_sets) -> tuple[int, ...]:
+    """Flatten lists of per-round color mappings into one tuple of color indices."""
+    codes = {color: code for code, color in enumerate(colors)}
+    return tuple(codes[mapping[color]] for mappings in mapping_sets for mapping in mappings for color in colors)
+
+
 class SimonSaysModule(Module):
+    COLORS = ("red", "blue", "green", "yellow")
+    COLOR_CODES = {color: code for code, color in enumerate(COLORS)}
+
+    # Mappings for serial numbers with vowels
+    VOWEL_MAPPINGS = [
+        # Round 1
+        {
+            "red": "blue",
+            "blue": "red",
+            "green": "yellow",
+            "yellow": "green"
+        },
+        # Round 2
+        {
+            "red": "yellow",
+            "blue": "green",
+            "green": "blue",
+            "yellow": "red"
+        },
+        # Round 3
+        {
+            "red": "green",
+            "blue": "red",
+            "green": "yellow",
+            "yellow": "blue"
+        },
+        # Round 4
+        {
+            "red": "red",
+            "blue": "blue",
+            "green": "green",
+            "yellow": "yellow"
+        },
+        # Round 5
+        {
+            "red": "yellow",
+            "blue": "green",
+            "green": "red",
+            "yellow": "blue"
+        }
+    ]
+
+    # Mappings for serial numbers without vowels
+    NO_VOWEL_MAPPINGS = [
+        # Round 1
+        {
+            "red": "blue",
+            "blue": "yellow",
+            "green": "green",
+            "yellow": "red"
+        },
+        # Round 2
+        {
+            "red": "red",
+            "blue": "blue",
+            "green": "yellow",
+            "yellow": "green"
+        },
+        # Round 3
+        {
+            "red": "yellow",
+            "blue": "green",
+            "green": "blue",
+            "yellow": "red"
+        },
+        # Round 4
+        {
+            "red": "green",
+            "blue": "red",
+            "green": "red",
+            "yellow": "blue"
+        },
+        # Round 5
+        {
+            "red": "blue",
+            "blue": "green",
+            "green": "yellow",
+            "yellow": "green"
+        }
+    ]
+
+    # MAPPING_TABLE[(has_vowel * len(mappings) + index) * len(COLORS) + color] -> color to press,
+    # with colors as indices into COLORS.
+    MAPPING_TABLE = _compile_mappings(COLORS, (NO_VOWEL_MAPPINGS, VOWEL_MAPPINGS))
+
     def __init__(self):
         super().__init__()
-        self.colors = ["red", "blue", "green", "yellow"]
-        self.sequence = []
+        self.colors = list(self.COLORS)
+        self.sequence = []  # Flashed colors, as indices into COLORS
         self.current_round = 0
         self.max_rounds = 5
         self.serial_number = self._generate_serial_number()
         self.has_vowel = any(c in "aeiou" for c in self.serial_number.lower())
-        self.user_sequence = []
+        self.user_sequence = []  # Pressed colors of the current round, as indices into COLORS
+        self.mistake = False
         self.generate_sequence()
 
     def _generate_serial_number(self) -> str:
@@ -27,94 +119,15 @@ class SimonSaysModule(Module):
 
     def generate_sequence(self):
         """Generate a random sequence of colors."""
-        self.sequence = [random.choice(self.colors) for _ in range(self.max_rounds)]
+        self.sequence = [self.COLOR_CODES[random.choice(self.colors)] for _ in range(self.max_rounds)]
+
+    def _mapped_code(self, code: int, index: int) -> int:
+        """Color index to press for the color index flashed at position `index`."""
+        return self.MAPPING_TABLE[(self.has_vowel * len(self.VOWEL_MAPPINGS) + index) * len(self.COLORS) + code]
 
     def get_color_mapping(self, color: str, index: int) -> str:
         """Get the mapped color based on the serial number and current round."""
-        # Mappings for serial numbers with vowels
-        vowel_mappings = [
-            # Round 1
-            {
-                "red": "blue",
-                "blue": "red",
-                "green": "yellow",
-                "yellow": "green"
-            },
-            # Round 2
-            {
-                "red": "yellow",
-                "blue": "green",
-                "green": "blue",
-                "yellow": "red"
-            },
-            # Round 3
-            {
-                "red": "green",
-                "blue": "red",
-                "green": "yellow",
-                "yellow": "blue"
-            },
-            # Round 4
-            {
-                "red": "red",
-                "blue": "blue",
-                "green": "green",
-                "yellow": "yellow"
-            },
-            # Round 5
-            {
-                "red": "yellow",
-                "blue": "green",
-                "green": "red",
-                "yellow": "blue"
-            }
-        ]
-
-        # Mappings for serial numbers without vowels
-        no_vowel_mappings = [
-            # Round 1
-            {
-                "red": "blue",
-                "blue": "yellow",
-                "green": "green",
-                "yellow": "red"
-            },
-            # Round 2
-            {
-                "red": "red",
-                "blue": "blue",
-                "green": "yellow",
-                "yellow": "green"
-            },
-            # Round 3
-            {
-                "red": "yellow",
-                "blue": "green",
-                "green": "blue",
-                "yellow": "red"
-            },
-            # Round 4
-            {
-                "red": "green",
-                "blue": "red",
-                "green": "red",
-                "yellow": "blue"
-            },
-            # Round 5
-            {
-                "red": "blue",
-                "blue": "green",
-                "green": "yellow",
-                "yellow": "green"
-            }
-        ]
-
-        if self.has_vowel:
-            mapping = vowel_mappings[index]
-        else:
-            mapping = no_vowel_mappings[index]
-
-        return mapping[color]
+        return self.COLORS[self._mapped_code(self.COLOR_CODES[color], index)]
 
     def instruction(self) -> str:
         """Return the instruction manual for this module."""
@@ -153,42 +166,56 @@ explode immediately."""
         if self.current_round >= self.max_rounds:
             return "Module disarmed!", []
 
+        flashing = ", ".join(self.COLORS[code] for code in self.sequence[:self.current_round + 1])
+
         # If we're waiting for the user to start the sequence
         if len(self.user_sequence) == 0:
             state_desc = "Simon show you a sequence of colors. Repeat the sequence by pressing the buttons.\n"
             state_desc += f"Serial number: {self.serial_number}\n"
             state_desc += f"Round: {self.current_round + 1}/{self.max_rounds}\n"
-            state_desc += "Flashing sequence: " + ", ".join(self.sequence[:self.current_round + 1]) + "\n"
+            state_desc += "Flashing sequence: " + flashing + "\n"
             state_desc += "Press a colored button to start sequence."
 
             actions = [f"press {color}" for color in self.colors]
             return state_desc, actions
         else:
             # If we're waiting for user input next in the sequence
-            current_sequence = self.sequence[:self.current_round + 1]
             state_desc = "Continue the sequence by pressing the next colored button.\n"
             state_desc += f"Serial number: {self.serial_number}\n"
             state_desc += f"Round: {self.current_round + 1}/{self.max_rounds}\n"
-            state_desc += "Flashing sequence: " + ", ".join(current_sequence) + "\n"
-            state_desc += f"Your inputs so far: {', '.join(self.user_sequence)}\n"
+            state_desc += "Flashing sequence: " + flashing + "\n"
+            state_desc += f"Your inputs so far: {', '.join(self.COLORS[code] for code in self.user_sequence)}\n"
             state_desc += "Press a colored button to continue."
 
             actions = [f"press {color}" for color in self.colors]
             return state_desc, actions
 
+    def _get_fields(self) -> dict:
+        """Return the state fields."""
+        if self.current_round >= self.max_rounds:
+            return {}
+        return {
+            "serial_number": self.serial_number,
+            "round": self.current_round + 1,
+            "max_rounds": self.max_rounds,
+            "flashing": [self.COLORS[code] for code in self.sequence[:self.current_round + 1]],
+            "inputs": [self.COLORS[code] for code in self.user_sequence],
+        }
+
     def _do_action(self, action: str) -> ActionResult:
         """Perform the specified action."""
         try:
-            color = action.lower().replace("press ", "").strip()
-            if color not in self.colors:
+            code = self.COLOR_CODES.get(action.lower().replace("press ", "").strip())
+            if code is None:
                 return ActionResult.INCORRECT
 
-            self.user_sequence.append(color)
-
-            # Check if the user has completed the current round's sequence
-            for i, color in enumerate(self.sequence[:len(self.user_sequence)]):
-                if self.get_color_mapping(color, i) != self.user_sequence[i]:
-                    return ActionResult.EXPLODED
+            # Earlier presses of the round were already checked, so only the new one needs validating.
+            # A wrong press stays in the round's inputs, so every later press of the round fails too.
+            index = len(self.user_sequence)
+            self.user_sequence.append(code)
+            if self.mistake or self._mapped_code(self.sequence[index], index) != code:
+                self.mistake = True
+                return ActionResult.EXPLODED
 
             if len(self.user_sequence) == self.current_round + 1:
                 # Correct sequence
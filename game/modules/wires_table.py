@@ -0,0 +1,111 @@
+"""
+Precomputed answers for every Regular Wires configuration.
+
+There are only 5^3 + 5^4 + 5^5 + 5^6 colour sequences and two serial number parities, so the
+wire to cut is stored for all of them in one byte table. A configuration's index is
+
+    OFFSETS[num_wires] + 2 * (sum of colour_i * 5^i) + serial_odd
+
+with colours numbered as in WIRE_COLORS. The table ships as wires_table.bin and is rebuilt from
+RegularWiresModule._rule_correct_wire when the file is missing.
+
+    python -m game.modules.wires_table --build    # write wires_table.bin
+    python -m game.modules.wires_table --verify   # check it against the rules for every configuration
+"""
+import argparse
+import itertools
+import os
+from functools import lru_cache
+
+WIRE_COLORS = ("red", "blue", "yellow", "white", "black")
+COLOR_CODES = {color: code for code, color in enumerate(WIRE_COLORS)}
+MIN_WIRES = 3
+MAX_WIRES = 6
+
+OFFSETS = {}
+TABLE_SIZE = 0
+for _num_wires in range(MIN_WIRES, MAX_WIRES + 1):
+    OFFSETS[_num_wires] = TABLE_SIZE
+    TABLE_SIZE += 2 * len(WIRE_COLORS) ** _num_wires
+
+TABLE_PATH = os.path.join(os.path.dirname(__file__), "wires_table.bin")
+
+
+def index(wire_colors, serial_odd: bool) -> int:
+    """Table index of a configuration."""
+    code = 0
+    for color in reversed(wire_colors):
+        code = code * len(WIRE_COLORS) + COLOR_CODES[color]
+    return OFFSETS[len(wire_colors)] + 2 * code + serial_odd
+
+
+def configurations():
+    """Yield (wire_colors, serial_odd) for every configuration, in table order."""
+    for num_wires in range(MIN_WIRES, MAX_WIRES + 1):
+        # itertools.product varies the last position fastest, the index the first one.
+        for reversed_colors in itertools.product(WIRE_COLORS, repeat=num_wires):
+            for serial_odd in (False, True):
+                yield list(reversed(reversed_colors)), serial_odd
+
+
+def build_table() -> bytes:
+    """Compute the table from the rules."""
+    from game.modules.regular_wires_module import RegularWiresModule
+
+    return bytes(RegularWiresModule._rule_correct_wire(colors, odd) for colors, odd in configurations())
+
+
+@lru_cache(maxsize=None)
+def load_table() -> bytes:
+    """The shipped table, or a freshly built one if the file is missing or has the wrong size."""
+    try:
+        with open(TABLE_PATH, "rb") as f:
+            table = f.read()
+        if len(table) == TABLE_SIZE:
+            return table
+    except OSError:
+        pass
+    return build_table()
+
+
+def lookup(wire_colors, serial_odd: bool) -> int:
+    """Return the 1-based number of the wire to cut."""
+    return load_table()[index(wire_colors, serial_odd)]
+
+
+def verify(table: bytes = None) -> int:
+    """
+    Check the table against the rules for every configuration.
+
+    :return: Number of configurations checked.
+    """
+    from game.modules.regular_wires_module import RegularWiresModule
+
+    table = load_table() if table is None else table
+    assert len(table) == TABLE_SIZE, f"Table has {len(table)} entries instead of {TABLE_SIZE}"
+    checked = 0
+    for i, (colors, odd) in enumerate(configurations()):
+        assert index(colors, odd) == i
+        expected = RegularWiresModule._rule_correct_wire(colors, odd)
+        assert table[i] == expected, f"{colors} (serial odd: {odd}): table says {table[i]}, rules say {expected}"
+        checked += 1
+    return checked
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or verify the Regular Wires decision table")
+    parser.add_argument('--build', action='store_true', help=f'Write the table to {TABLE_PATH}')
+    parser.add_argument('--verify', action='store_true', help='Check the table against the rules')
+    args = parser.parse_args()
+
+    if args.build:
+        with open(TABLE_PATH, "wb") as f:
+            f.write(build_table())
+        load_table.cache_clear()
+        print(f"Wrote {TABLE_SIZE} entries to {TABLE_PATH}")
+    if args.verify or not args.build:
+        print(f"Table agrees with the rules on all {verify()} configurations.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Vectorized solver for every module.
+
+Module configurations are passed as struct-of-arrays: one NumPy array per attribute with the
+configurations along the first axis, and colours / labels encoded as indices into the tuples
+below. Each solver returns the correct action(s) for all configurations at once, so large
+corpora can be labelled without building module objects.
+
+Run `python -m game.oracle` to cross-check the solvers against the module classes and to
+measure their throughput.
+"""
+import argparse
+import random
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from game.modules import wires_table
+from game.modules.button_module import ButtonModule
+from game.modules.memory_module import MemoryModule
+from game.modules.module import ActionResult
+from game.modules.regular_wires_module import RegularWiresModule
+from game.modules.simon_says_module import SimonSaysModule
+
+WIRE_COLORS = wires_table.WIRE_COLORS
+BUTTON_COLORS = ("red", "blue", "white", "yellow")
+BUTTON_LABELS = ("Abort", "Detonate", "Hold", "Press")
+STRIP_COLORS = ButtonModule.STRIP_COLORS
+SIMON_COLORS = SimonSaysModule.COLORS
+
+MAX_WIRES = 6
+SIMON_LENGTH = 5
+MEMORY_STAGES = 5
+
+_WIRE_POWERS = len(WIRE_COLORS) ** np.arange(MAX_WIRES, dtype=np.int64)
+_WIRE_OFFSETS = np.array([wires_table.OFFSETS.get(n, 0) for n in range(MAX_WIRES + 1)], dtype=np.int64)
+
+# SIMON_TABLE[has_vowel, position, flashed colour] -> colour to press
+SIMON_TABLE = np.array(SimonSaysModule.MAPPING_TABLE, dtype=np.int8).reshape(2, SIMON_LENGTH, len(SIMON_COLORS))
+
+
+def solve_wires(colors: np.ndarray, serial_odd: np.ndarray) -> np.ndarray:
+    """
+    Find the wire to cut, by lookup in the precomputed Regular Wires table.
+
+    :param colors: (N, 6) wire colour indices, padded with -1 after the last wire.
+    :param serial_odd: (N,) whether the last digit of the serial number is odd.
+    :return: (N,) 1-based number of the wire to cut.
+    """
+    colors = np.asarray(colors)
+    present = colors >= 0
+    num_wires = present.sum(axis=1)
+    code = (np.where(present, colors, 0) * _WIRE_POWERS[:colors.shape[1]]).sum(axis=1)
+    return _wires_table()[_WIRE_OFFSETS[num_wires] + 2 * code + np.asarray(serial_odd, dtype=np.int64)]
+
+
+@lru_cache(maxsize=None)
+def _wires_table() -> np.ndarray:
+    return np.frombuffer(wires_table.load_table(), dtype=np.uint8)
+
+
+def solve_button_press(color: np.ndarray, label: np.ndarray, batteries: np.ndarray,
+                       car: np.ndarray, frk: np.ndarray) -> np.ndarray:
+    """
+    Decide between pressing and holding the button.
+
+    :param color: (N,) button colour indices.
+    :param label: (N,) button label indices.
+    :param batteries: (N,) number of batteries.
+    :param car: (N,) whether a lit CAR indicator is present.
+    :param frk: (N,) whether a lit FRK indicator is present.
+    :return: (N,) True where the button should be pressed, False where it should be held.
+    """
+    color, label, batteries = np.asarray(color), np.asarray(label), np.asarray(batteries)
+    frk = np.asarray(frk, dtype=bool)
+    # The CAR indicator only leads to holding, which is also the fallback, so it never changes the answer.
+    return (
+        ((batteries > 1) & (label == BUTTON_LABELS.index("Detonate")))
+        | ((batteries > 2) & frk)
+        | ((color == BUTTON_COLORS.index("red")) & (label == BUTTON_LABELS.index("Hold")))
+    )
+
+
+def solve_button_release(strip: np.ndarray) -> np.ndarray:
+    """
+    Find the digit to release a held button on.
+
+    :param strip: (N,) strip colour indices.
+    :return: (N,) digit to release on.
+    """
+    digits = np.array([4, 1, 5, 1, 1], dtype=np.int8)
+    return digits[np.asarray(strip)]
+
+
+def solve_simon(sequence: np.ndarray, has_vowel: np.ndarray) -> np.ndarray:
+    """
+    Translate flashed colours into the colours to press.
+
+    Round r (0-based) of the module expects the first r + 1 entries of the result.
+
+    :param sequence: (N, 5) flashed colour indices.
+    :param has_vowel: (N,) whether the serial number contains a vowel.
+    :return: (N, 5) colour indices to press.
+    """
+    sequence = np.asarray(sequence)
+    has_vowel = np.asarray(has_vowel, dtype=np.intp)
+    return SIMON_TABLE[has_vowel[:, None], np.arange(sequence.shape[1]), sequence]
+
+
+def solve_memory(displays: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    """
+    Find the position to press in every stage.
+
+    :param displays: (N, 5) displayed digit (1-4) of each stage.
+    :param labels: (N, 5, 4) button labels (1-4) of each stage, by position.
+    :return: (N, 5) 1-based position to press in each stage.
+    """
+    displays, labels = np.asarray(displays), np.asarray(labels)
+    n = len(displays)
+    positions = np.zeros((n, MEMORY_STAGES), dtype=np.int8)
+    pressed = np.zeros((n, MEMORY_STAGES), dtype=np.int8)
+
+    def labelled(stage, label):
+        return np.argmax(labels[:, stage] == np.asarray(label)[..., None], axis=1) + 1
+
+    for stage in range(MEMORY_STAGES):
+        display = displays[:, stage]
+        if stage == 0:
+            choices = [2, 2, 3, 4]
+        elif stage == 1:
+            choices = [labelled(stage, 4), positions[:, 0], 1, positions[:, 0]]
+        elif stage == 2:
+            choices = [labelled(stage, pressed[:, 1]), labelled(stage, pressed[:, 0]), 3, labelled(stage, 4)]
+        elif stage == 3:
+            choices = [positions[:, 0], 1, positions[:, 1], positions[:, 1]]
+        else:
+            choices = [labelled(stage, pressed[:, i]) for i in (0, 1, 3, 2)]
+
+        positions[:, stage] = np.select([display == d for d in range(1, 5)], choices)
+        pressed[:, stage] = labels[np.arange(n), stage, positions[:, stage] - 1]
+    return positions
+
+
+def random_wires(n: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    """Random (colors, serial_odd) for n wire modules."""
+    num_wires = rng.integers(3, MAX_WIRES + 1, size=n)
+    colors = rng.integers(0, len(WIRE_COLORS), size=(n, MAX_WIRES), dtype=np.int8)
+    colors[np.arange(MAX_WIRES) >= num_wires[:, None]] = -1
+    return colors, rng.random(n) < 0.5
+
+
+def random_button(n: int, rng: np.random.Generator) -> tuple[np.ndarray, ...]:
+    """Random (color, label, batteries, car, frk, strip) for n button modules."""
+    return (
+        rng.integers(0, len(BUTTON_COLORS), size=n),
+        rng.integers(0, len(BUTTON_LABELS), size=n),
+        rng.integers(0, 5, size=n),
+        rng.random(n) < 0.5,
+        rng.random(n) < 0.5,
+        rng.integers(0, len(STRIP_COLORS), size=n),
+    )
+
+
+def random_simon(n: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    """Random (sequence, has_vowel) for n Simon Says modules."""
+    return rng.integers(0, len(SIMON_COLORS), size=(n, SIMON_LENGTH)), rng.random(n) < 0.5
+
+
+def random_memory(n: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    """Random (displays, labels) for n memory modules."""
+    displays = rng.integers(1, 5, size=(n, MEMORY_STAGES))
+    labels = rng.permuted(np.broadcast_to(np.arange(1, 5), (n, MEMORY_STAGES, 4)), axis=2)
+    return displays, labels
+
+
+def verify(n: int = 20000, seed: int = 0):
+    """Check the vectorized solvers against the module classes on n random configurations each."""
+    rng = np.random.default_rng(seed)
+
+    colors, serial_odd = random_wires(n, rng)
+    answers = solve_wires(colors, serial_odd)
+    for row, odd, answer in zip(colors, serial_odd, answers):
+        module = RegularWiresModule()
+        module.wire_colors = [WIRE_COLORS[c] for c in row if c >= 0]
+        module.serial_number = "ABCDE" + ("1" if odd else "2")
+        correct = [w for w in range(1, len(module.wire_colors) + 1) if module._is_correct_wire(w)]
+        assert correct == [answer], (module.wire_colors, odd, correct, answer)
+        assert RegularWiresModule._rule_correct_wire(module.wire_colors, bool(odd)) == answer
+
+    color, label, batteries, car, frk, strip = random_button(n, rng)
+    press = solve_button_press(color, label, batteries, car, frk)
+    release = solve_button_release(strip)
+    for i in range(n):
+        module = ButtonModule()
+        module.button_color = BUTTON_COLORS[color[i]]
+        module.button_label = BUTTON_LABELS[label[i]]
+        module.batteries = int(batteries[i])
+        module.lit_indicators = [name for name, lit in (("CAR", car[i]), ("FRK", frk[i])) if lit]
+        module.strip_color = STRIP_COLORS[strip[i]]
+        assert module._should_press() == press[i]
+        assert module._get_correct_release_digit() == release[i]
+
+    sequence, has_vowel = random_simon(n, rng)
+    presses = solve_simon(sequence, has_vowel)
+    for row, vowel, answer in zip(sequence, has_vowel, presses):
+        module = SimonSaysModule()
+        module.sequence = [int(c) for c in row]
+        module.has_vowel = bool(vowel)
+        result = None
+        for round_num in range(module.max_rounds - 1):
+            for c in answer[:round_num + 1]:
+                result = module.do_action(f"press {SIMON_COLORS[c]}")
+                assert result in (ActionResult.CHANGED, ActionResult.DISARMED)
+        assert result == ActionResult.DISARMED
+
+    displays, labels = random_memory(n, rng)
+    positions = solve_memory(displays, labels)
+    for i in range(n):
+        module = MemoryModule()
+        for stage in range(MEMORY_STAGES):
+            module.display_number = int(displays[i, stage])
+            module.button_labels = [int(x) for x in labels[i, stage]]
+            correct = [p for p in range(1, 5) if module._is_correct_position(p)]
+            assert correct == [positions[i, stage]], (i, stage, correct)
+            module.do_action(f"press position {positions[i, stage]}")
+        assert module.is_disarmed
+
+
+def bench(n: int = 1_000_000, seed: int = 0):
+    """Print how many configurations per second each solver handles."""
+    rng = np.random.default_rng(seed)
+    cases = {
+        "wires": (solve_wires, random_wires(n, rng)),
+        "button": (solve_button_press, random_button(n, rng)[:5]),
+        "simon": (solve_simon, random_simon(n, rng)),
+        "memory": (solve_memory, random_memory(n, rng)),
+    }
+    for name, (solver, args) in cases.items():
+        start = time.perf_counter()
+        solver(*args)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>7}: {n / elapsed:,.0f} modules/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify and benchmark the vectorized module solvers")
+    parser.add_argument('--verify', type=int, default=20000, help='Random configurations to cross-check per module')
+    parser.add_argument('--bench', type=int, default=1_000_000, help='Configurations per module to time')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    verify(args.verify, args.seed)
+    print(f"Solvers agree with the module rules on {args.verify} configurations per module.")
+    bench(args.bench, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import asyncio
+import itertools
+import random
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional, Tuple
+
+from game.bomb import Bomb
+
+DEFAULT_EPISODE = "default"
+
+# Conditional manual fetches: the reply starts with MANUAL_VERSION and the version, followed by
+# the manual, or by MANUAL_NOT_MODIFIED when the caller already holds that version.
+MANUAL_VERSION = "Manual version: "
+MANUAL_NOT_MODIFIED = "=== MANUAL NOT MODIFIED ===\n"
+
+# Bomb generations are unique across episodes and resets of one server process, and BOOT_ID tells
+# processes apart, so a version is never reused, not even by a restarted server.
+BOOT_ID = uuid.uuid4().hex[:12]
+_generations = itertools.count(1)
+
+
+class UnknownEpisode(LookupError):
+    """An episode without a bomb: never reset, discarded, or evicted."""
+
+    def __init__(self, episode_id: str):
+        super().__init__(f"Unknown episode '{episode_id}', call reset to start one.")
+        self.episode_id = episode_id
+
+
+def seeded_bomb(module: Optional[str], seed: int) -> Tuple[Bomb, object]:
+    """
+    The bomb Bomb(module) would be after random.seed(seed), like bomb 0 of BombBatch.generate(1, module, seed),
+    and the state of `random` after creating it, from which its modules draw while being played.
+    The state of the global `random` generator is left untouched.
+    """
+    saved = random.getstate()
+    try:
+        random.seed(seed)
+        return Bomb(module), random.getstate()
+    finally:
+        random.setstate(saved)
+
+
+class BombEntry:
+    def __init__(self, bomb: Bomb, random_state: object = None):
+        self.bomb = bomb
+        # State of `random` for the draws of a seeded bomb, None for bombs drawing from the global one.
+        self.random_state = random_state
+        self.generation = next(_generations)
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+    def replace(self, bomb: Bomb, random_state: object = None):
+        self.bomb = bomb
+        self.random_state = random_state
+        self.generation = next(_generations)
+
+
+class BombRegistry:
+    """
+    Live bombs of a game server, keyed by episode id.
+
+    Every episode gets its own bomb and lock, so concurrent episodes on one server do not
+    clobber each other. Bombs not used for `ttl` seconds are evicted, and when more than
+    `max_bombs` are alive the least recently used ones are evicted first.
+    """
+
+    def __init__(self, max_bombs: int = 10000, ttl: Optional[float] = 3600.0):
+        """
+        :param max_bombs: Maximum number of live bombs.
+        :param ttl: Seconds of inactivity after which a bomb is evicted (None to keep bombs forever).
+        """
+        self.max_bombs = max_bombs
+        self.ttl = ttl
+        self.evicted = 0
+        self._entries: "OrderedDict[str, BombEntry]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, episode_id: str) -> bool:
+        return episode_id in self._entries
+
+    def _evict(self, now: float):
+        # Entries are kept in least recently used order, so expired ones are at the front.
+        if self.ttl is not None:
+            while self._entries:
+                entry = next(iter(self._entries.values()))
+                if now - entry.last_used < self.ttl:
+                    break
+                self._entries.popitem(last=False)
+                self.evicted += 1
+        while len(self._entries) > self.max_bombs:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+
+    def _entry(self, episode_id: str, bomb: Optional[Bomb] = None, random_state: object = None) -> BombEntry:
+        # Only reset (passing the new bomb) starts episodes, except for the shared default one; an evicted
+        # episode must not silently continue on a fresh bomb.
+        now = time.monotonic()
+        entry = self._entries.get(episode_id)
+        if entry is None:
+            if bomb is None and episode_id != DEFAULT_EPISODE:
+                raise UnknownEpisode(episode_id)
+            entry = self._entries[episode_id] = BombEntry(bomb or Bomb(), random_state)
+        entry.last_used = now
+        self._entries.move_to_end(episode_id)
+        self._evict(now)
+        return entry
+
+    @asynccontextmanager
+    async def use(self, episode_id: str = DEFAULT_EPISODE):
+        """
+        Lock and yield the bomb of an episode. The default episode gets a bomb with all modules if it has
+        none; any other episode without a bomb raises UnknownEpisode.
+
+        A seeded bomb draws from its own state of `random` within the block, so the block must not await.
+        """
+        entry = self._entry(episode_id)
+        async with entry.lock:
+            if entry.random_state is None:
+                yield entry.bomb
+                return
+            saved = random.getstate()
+            random.setstate(entry.random_state)
+            try:
+                yield entry.bomb
+            finally:
+                entry.random_state = random.getstate()
+                random.setstate(saved)
+
+    async def reset(self, episode_id: str = DEFAULT_EPISODE, module: Optional[str] = None,
+                    seed: Optional[int] = None) -> Bomb:
+        """
+        Replace the bomb of an episode with a new one, starting the episode if it has none.
+
+        :param seed: Makes the bomb, and everything its modules draw while it is played, depend on nothing
+        but the seed, so that an episode replayed with the same seed and actions gets the same bomb.
+        A random bomb if None.
+        """
+        bomb, random_state = seeded_bomb(module, seed) if seed is not None else (Bomb(module), None)
+        created = episode_id not in self._entries
+        entry = self._entry(episode_id, bomb, random_state)
+        async with entry.lock:
+            if not created:
+                entry.replace(bomb, random_state)
+            return entry.bomb
+
+    def manual_version(self, episode_id: str = DEFAULT_EPISODE) -> str:
+        """
+        Version of the manual of an episode's current module: the server's boot id, its bomb generation
+        and module index, or the bomb's outcome once it is over. Changes exactly when get_manual's text does.
+        Raises UnknownEpisode like use().
+        """
+        entry = self._entry(episode_id)
+        bomb = entry.bomb
+        if bomb.exploded:
+            return f"{BOOT_ID}.{entry.generation}-exploded"
+        if bomb.disarmed:
+            return f"{BOOT_ID}.{entry.generation}-disarmed"
+        return f"{BOOT_ID}.{entry.generation}-{bomb.current_module}"
+
+    def discard(self, episode_id: str):
+        """Forget the bomb of an episode; later calls for it raise UnknownEpisode until it is reset."""
+        self._entries.pop(episode_id, None)
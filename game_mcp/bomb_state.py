@@ -0,0 +1,86 @@
+"""
+Typed bomb state exchanged by the game_state tool, as an alternative to the text replies.
+
+The server describes a bomb (and the result of the command it just ran) as a BombState and
+sends it as JSON; clients parse it back, so agent loops read fields such as `status`,
+`actions` or `result` instead of searching multi-line strings. The text reply of
+game_interaction is included only when asked for, for prompts that need it.
+"""
+import json
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+from game.bomb import Bomb
+from game.bomb_batch import MODULE_CLASSES, MODULE_NAMES
+from game.modules.module import ActionResult
+
+ACTIVE, EXPLODED, DISARMED = "active", "exploded", "disarmed"
+
+
+@dataclass
+class BombState:
+    """A bomb's status and current module, and the outcome of the command that produced it."""
+    status: str
+    module: Optional[str]
+    module_index: int
+    modules: int
+    fields: Dict[str, Any] = field(default_factory=dict)
+    actions: List[str] = field(default_factory=list)
+    result: Optional[ActionResult] = None
+    error: Optional[str] = None
+    manual_version: Optional[str] = None
+    text: Optional[str] = None
+
+    @property
+    def exploded(self) -> bool:
+        return self.status == EXPLODED
+
+    @property
+    def disarmed(self) -> bool:
+        return self.status == DISARMED
+
+    @property
+    def over(self) -> bool:
+        return self.status != ACTIVE
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        data['result'] = self.result.value if self.result is not None else None
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, text: str) -> "BombState":
+        data = json.loads(text)
+        if data.get('result') is not None:
+            data['result'] = ActionResult(data['result'])
+        return cls(**data)
+
+
+def module_name(bomb: Bomb) -> Optional[str]:
+    """Type of the bomb's current module ("wire", "button", "simon" or "memory"), None once the bomb is over."""
+    if bomb.exploded or bomb.disarmed:
+        return None
+    return MODULE_NAMES[MODULE_CLASSES.index(type(bomb.modules[bomb.current_module]))]
+
+
+def describe(bomb: Bomb, result: Optional[ActionResult] = None, error: Optional[str] = None,
+             manual_version: Optional[str] = None, text: Optional[str] = None) -> BombState:
+    """The BombState of a bomb, after a command that returned `result` (None for state queries)."""
+    if bomb.exploded or bomb.disarmed:
+        return BombState(EXPLODED if bomb.exploded else DISARMED, None, bomb.current_module, len(bomb.modules),
+                         result=result, error=error, manual_version=manual_version, text=text)
+
+    module = bomb.modules[bomb.current_module]
+    _, actions = module.state()
+    return BombState(
+        status=ACTIVE,
+        module=module_name(bomb),
+        module_index=bomb.current_module,
+        modules=len(bomb.modules),
+        fields=module.fields(),
+        actions=actions,
+        result=result,
+        error=error,
+        manual_version=manual_version,
+        text=text,
+    )
@@ -1,46 +1,302 @@
 import asyncio
 import argparse
+import weakref
+from contextlib import suppress
+from datetime import timedelta
 
-from mcp import ClientSession
+import anyio
+import httpx
+from mcp import ClientSession, types
 from mcp.client.sse import sse_client
-from typing import Optional
+from typing import Any, Optional, Union
+
+from game_mcp.bomb_registry import MANUAL_NOT_MODIFIED, MANUAL_VERSION
+from game_mcp.bomb_state import BombState
+
+# Errors that mean the underlying SSE connection is gone and should be re-opened. Errors the
+# server replies with, and read timeouts, are McpErrors: the connection is fine, so they are
+# raised to the caller as they are.
+RECONNECT_ERRORS = (
+    anyio.ClosedResourceError,
+    anyio.BrokenResourceError,
+    anyio.EndOfStream,
+    httpx.TransportError,
+    ConnectionError,
+)
+# Errors of writing a request to a closed stream, i.e. of requests that never left the client.
+UNSENT_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError)
+
+# Commands that only read the bomb, so sending them twice does no harm.
+QUERY_COMMANDS = ("state", "help")
+
+
+def is_idempotent(tool_name: str, tool_args: dict[str, Any]) -> bool:
+    """Whether a tool call leaves the bomb as it is, so that it can be sent again after a lost connection."""
+    if tool_name in ("get_manual", "end_episode"):
+        return True
+    if tool_name in ("game_interaction", "game_state"):
+        return tool_args.get('command', "state") in QUERY_COMMANDS
+    return False
+
+# Shared connections, one per (event loop, server url). Keyed weakly by loop so that
+# connections opened under a finished asyncio.run() are dropped with their loop.
+_POOL: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, PooledSession]]" = \
+    weakref.WeakKeyDictionary()
+
+
+class PooledSession:
+    """
+    A long-lived SSE stream and initialized MCP ClientSession for one server.
+
+    The streams are owned by a background task, so the session can be used (and closed)
+    from any task on the loop that opened it. Dropped connections are re-opened lazily on
+    the next call.
+    """
+
+    def __init__(self, server_url: str, read_timeout: Optional[float] = 60.0):
+        self.server_url = server_url
+        self.read_timeout = read_timeout
+        self.loop = asyncio.get_running_loop()
+        self.refcount = 0
+        self.connects = 0
+        self._session: Optional[ClientSession] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing: Optional[asyncio.Event] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def reconnects(self) -> int:
+        return max(self.connects - 1, 0)
+
+    @property
+    def alive(self) -> bool:
+        return self._session is not None and self._task is not None and not self._task.done()
+
+    async def _serve(self, ready: asyncio.Future):
+        """Hold the sse_client / ClientSession contexts open until close() or until the stream drops."""
+        read_timeout = None if self.read_timeout is None else timedelta(seconds=self.read_timeout)
+        try:
+            async with sse_client(self.server_url) as (read_stream, write_stream):
+                # Relay server messages so that the end of the SSE stream is noticed here,
+                # ClientSession itself does not fail pending requests when it happens.
+                relay_writer, relay_reader = anyio.create_memory_object_stream(0)
+
+                async def relay():
+                    async with relay_writer:
+                        async for message in read_stream:
+                            await relay_writer.send(message)
+                    self._closing.set()
+
+                async with anyio.create_task_group() as tg:
+                    tg.start_soon(relay)
+                    async with ClientSession(relay_reader, write_stream, read_timeout_seconds=read_timeout) as session:
+                        await session.initialize()
+                        self._session = session
+                        ready.set_result(None)
+                        await self._closing.wait()
+                    tg.cancel_scope.cancel()
+        except Exception as exc:
+            if not ready.done():
+                ready.set_exception(exc)
+        finally:
+            self._session = None
+
+    async def _open(self):
+        self.connects += 1
+        self._closing = asyncio.Event()
+        ready = self.loop.create_future()
+        self._task = asyncio.create_task(self._serve(ready))
+        await asyncio.wait({ready, self._task}, return_when=asyncio.FIRST_COMPLETED)
+        if not ready.done():
+            ready.cancel()
+            raise ConnectionError(f"Connection to {self.server_url} closed during initialization.")
+        ready.result()
+
+    async def _shutdown(self):
+        if self._task is None:
+            return
+        self._closing.set()
+        with suppress(Exception, asyncio.CancelledError):
+            await self._task
+        self._task = None
+        self._session = None
+
+    async def get(self) -> ClientSession:
+        """Return a live session, (re)connecting if needed."""
+        async with self._lock:
+            if not self.alive:
+                await self._shutdown()
+                await self._open()
+            return self._session
+
+    async def call_tool(self, tool_name: str, tool_args: dict[str, Any]) -> str:
+        """
+        Call a tool, re-opening the connection once if it turns out to be dead.
+
+        The call is only sent again if it did not reach the server or does not change the bomb;
+        a command that may already have been applied raises the connection error instead.
+        """
+        for attempt in range(2):
+            session = await self.get()
+            serving = self._task
+            call = asyncio.ensure_future(session.call_tool(tool_name, tool_args))
+            try:
+                await asyncio.wait({call, serving}, return_when=asyncio.FIRST_COMPLETED)
+                if not call.done():
+                    raise ConnectionError(f"Connection to {self.server_url} was lost.")
+                result = call.result()
+                return ''.join([c.text for c in result.content])
+            except RECONNECT_ERRORS as exc:
+                async with self._lock:
+                    if self._task is serving:
+                        await self._shutdown()
+                sent = not isinstance(exc, UNSENT_ERRORS)
+                if attempt or (sent and not is_idempotent(tool_name, tool_args)):
+                    raise
+            finally:
+                call.cancel()
+
+    async def close(self):
+        async with self._lock:
+            await self._shutdown()
+
+
+class InProcessSession:
+    """
+    Calls the tools of the game server module running in this process, without HTTP or SSE.
+
+    Requests go through the same MCP request handler the server uses for SSE clients, so the
+    results (including error messages) are the exact strings a PooledSession would return.
+    Bombs live in game_mcp.game_server.bombs of this process.
+    """
+
+    def __init__(self, server_url: str):
+        from game_mcp.game_server import mcp
+
+        self.server_url = server_url
+        self.loop = asyncio.get_running_loop()
+        self.refcount = 0
+        self._handler = mcp._mcp_server.request_handlers[types.CallToolRequest]  # noqa: SLF001
+
+    async def get(self) -> "InProcessSession":
+        return self
+
+    async def call_tool(self, tool_name: str, tool_args: dict[str, Any]) -> str:
+        """Call a tool of the in-process server."""
+        request = types.CallToolRequest(
+            method="tools/call",
+            params=types.CallToolRequestParams(name=tool_name, arguments=tool_args),
+        )
+        result = await self._handler(request)
+        return ''.join([c.text for c in result.root.content])
+
+    async def close(self):
+        pass
+
+
+Session = Union[PooledSession, InProcessSession]
+
+# Session classes by server url scheme, anything else is reached over SSE.
+TRANSPORTS = {
+    "inproc": InProcessSession,
+}
+
+
+def session_class(server_url: str) -> type:
+    """The session class that serves server_url."""
+    scheme = server_url.split("://", 1)[0] if "://" in server_url else ""
+    return TRANSPORTS.get(scheme, PooledSession)
+
+
+async def acquire_session(server_url: str) -> Session:
+    """Get the process-wide shared session for server_url on the running loop."""
+    loop = asyncio.get_running_loop()
+    sessions = _POOL.setdefault(loop, {})
+    session = sessions.get(server_url)
+    if session is None:
+        session = sessions[server_url] = session_class(server_url)(server_url)
+    session.refcount += 1
+    try:
+        await session.get()
+    except BaseException:
+        await release_session(session)
+        raise
+    return session
+
+
+async def open_session(server_url: str) -> Session:
+    """
+    A session for server_url of its own, outside the shared pool. Pass it to connect_to_server() of the
+    clients that should use it; it is closed when the last of them calls cleanup().
+    """
+    session = session_class(server_url)(server_url)
+    await session.get()
+    return session
+
+
+async def release_session(session: Session):
+    """Drop one reference to a shared session, closing it when nobody uses it anymore."""
+    session.refcount -= 1
+    if session.refcount > 0:
+        return
+    sessions = _POOL.get(session.loop, {})
+    if sessions.get(session.server_url) is session:
+        del sessions[session.server_url]
+    await session.close()
 
 
 class BombClient:
-    def __init__(self):
+    def __init__(self, episode_id: Optional[str] = None):
+        """
+        :param episode_id: Episode whose bomb this client plays with, the server's default bomb if None.
+        """
         # YOUR CODE STARTS HERE
         self.server_url: Optional[str] = None
-        self.session = None
+        self.session: Optional[Session] = None
+        self.episode_id = episode_id
         # YOUR CODE ENDS HERE
 
-    async def connect_to_server(self, server_url: str):
-        """Connect to an SSE MCP server"""
+    async def connect_to_server(self, server_url: str, session: Optional[Session] = None):
+        """
+        Connect to an SSE MCP server, sharing the connection with other clients of the same server.
+        An "inproc://" url plays against the game server module in this process instead.
+
+        :param session: A session from open_session() to use instead of the shared one.
+        """
         # YOUR CODE STARTS HERE
+        if self.session is not None:
+            await self.cleanup()
         self.server_url = server_url
+        if session is None:
+            self.session = await acquire_session(server_url)
+        else:
+            session.refcount += 1
+            self.session = session
         # YOUR CODE ENDS HERE
 
-    async def process_query(self, tool_name: str, tool_args: dict[str, str]) -> str:
+    async def process_query(self, tool_name: str, tool_args: dict[str, Any]) -> str:
         """Process a query using the given MCP tool"""
         # YOUR CODE STARTS HERE
         if not self.server_url:
             raise RuntimeError("Client not connected to server.")
 
-        async with sse_client(self.server_url) as streams:
-            async with ClientSession(streams[0], streams[1]) as session:
-                await session.initialize()
-                if not session:
-                    raise RuntimeError("Failed to create session.")
+        # Sessions are bound to the loop that opened them (e.g. a previous asyncio.run()).
+        if self.session is None or self.session.loop is not asyncio.get_running_loop():
+            self.session = None
+            await self.connect_to_server(self.server_url)
 
-                result = await session.call_tool(tool_name, tool_args)
-        text = ''.join([c.text for c in result.content])
-        return text
+        if self.episode_id is not None:
+            tool_args = {**tool_args, 'episode_id': self.episode_id}
+        return await self.session.call_tool(tool_name, tool_args)
         # YOUR CODE ENDS HERE
 
     async def cleanup(self):
         """Properly clean up the session and streams"""
         # YOUR CODE STARTS HERE
-        if self.server_url:
-            self.server_url = None
+        session, self.session = self.session, None
+        if session is not None and session.loop is asyncio.get_running_loop():
+            await release_session(session)
+        self.server_url = None
         # YOUR CODE ENDS HERE
 
 
@@ -51,22 +307,67 @@ class Defuser(BombClient):
         return await self.process_query("game_interaction", {'command': action})
         # YOUR CODE ENDS HERE
 
+    async def run_many(self, actions: list[str]) -> str:
+        """Run several defuser actions in one round trip, stopping once the bomb is disarmed or exploded"""
+        return await self.process_query("game_interaction_batch", {'commands': actions})
+
+    async def state(self, text: bool = False) -> BombState:
+        """The bomb's typed state, with the text of a "state" command if text"""
+        return await self.act("state", text)
+
+    async def act(self, command: str, text: bool = False) -> BombState:
+        """Run a command and get its typed result and the bomb's state, with the reply text if text"""
+        response = await self.process_query("game_state", {'command': command, 'include_text': text})
+        try:
+            return BombState.from_json(response)
+        except ValueError:
+            raise RuntimeError(f"Unexpected game_state reply: {response}") from None
+
 
 class Expert(BombClient):
+    def __init__(self, episode_id: Optional[str] = None):
+        super().__init__(episode_id)
+        self.manual: Optional[str] = None
+        self.manual_version: Optional[str] = None
+        self.downloads = 0
+        self.not_modified = 0
+
     async def run(self) -> str:
-        """Run an expert action"""
+        """Run an expert action: the manual, downloaded only when it changed since the last call"""
         # YOUR CODE STARTS HERE
-        return await self.process_query('get_manual', {})
+        response = await self.process_query('get_manual', {'if_none_match': self.manual_version or ""})
+        header, _, body = response.partition("\n")
+        if not header.startswith(MANUAL_VERSION):
+            # A server without manual versions, or an error.
+            self.manual = self.manual_version = None
+            return response
+
+        version = header[len(MANUAL_VERSION):]
+        if body == MANUAL_NOT_MODIFIED and version == self.manual_version:
+            self.not_modified += 1
+            return self.manual
+        self.manual, self.manual_version = body, version
+        self.downloads += 1
+        return body
         # YOUR CODE ENDS HERE
 
 
 class Resetter(BombClient):
-    async def run(self, module=None) -> str:
-        """Run an expert action"""
+    async def run(self, module=None, seed: Optional[int] = None) -> str:
+        """Start a new bomb with `module`, the same one for the same seed (a random one if seed is None)"""
         # YOUR CODE STARTS HERE
-        return await self.process_query('reset', {'module': module})
+        args = {'module': module} if seed is None else {'module': module, 'seed': seed}
+        return await self.process_query('reset', args)
         # YOUR CODE ENDS HERE
 
+    async def cleanup(self):
+        """End this client's episode on the server, if it has its own, and release the session"""
+        if self.episode_id is not None and self.server_url:
+            # Best effort: the server evicts the bomb on its own if this does not get through.
+            with suppress(Exception):
+                await self.process_query('end_episode', {})
+        await super().cleanup()
+
 
 async def main():
     """ Main function to connect to the server and run the clients """
@@ -74,8 +375,9 @@ async def main():
     # IMPORTANT THE TESTS WERE WRONG AND I FIXED THEM
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Run MCP game client")
-    parser.add_argument('--url', required=True, help='Server URL (e.g., http://localhost:8080)')
+    parser.add_argument('--url', required=True, help='Server URL (e.g., http://localhost:8080, or inproc:// for an in-process server)')
     parser.add_argument('--role', required=True, choices=['Defuser', 'Expert', 'Resetter'], help='Client role')
+    parser.add_argument('--episode', default=None, help='Episode id, the server\'s default bomb if omitted')
 
     args = parser.parse_args()
     role = args.role
@@ -83,11 +385,11 @@ async def main():
 
     # Instantiate the appropriate client
     if role == 'Defuser':
-        client = Defuser()
+        client = Defuser(args.episode)
     elif role == 'Expert':
-        client = Expert()
+        client = Expert(args.episode)
     else:
-        client = Resetter()
+        client = Resetter(args.episode)
 
     try:
         await client.connect_to_server(url)
@@ -1,4 +1,8 @@
 import argparse
+import functools
+import logging
+import time
+from typing import Optional, Tuple
 
 import uvicorn
 from mcp.server.fastmcp import FastMCP
@@ -6,14 +10,34 @@ from mcp.server import Server
 from starlette.applications import Starlette
 from mcp.server.sse import SseServerTransport
 from starlette.requests import Request
+from starlette.responses import Response
 from starlette.routing import Mount, Route
 
-from game.bomb import Bomb
 from game.modules.module import ActionResult
+from game_mcp.bomb_registry import BombRegistry, DEFAULT_EPISODE, MANUAL_NOT_MODIFIED, MANUAL_VERSION
+from game_mcp.bomb_state import describe, module_name
+from game_mcp.logs import configure_logging
+from game_mcp.metrics import CONTENT_TYPE, MetricsRegistry
 
 # Initialize FastMCP server
 mcp = FastMCP("Game")
-bomb = Bomb()
+bombs = BombRegistry()
+logger = logging.getLogger("game_server")
+
+metrics = MetricsRegistry()
+TOOL_CALLS = metrics.counter("game_tool_calls_total", "Tool calls.", ["tool"])
+TOOL_ERRORS = metrics.counter("game_tool_errors_total", "Tool calls that raised an exception.", ["tool"])
+TOOL_LATENCY = metrics.histogram("game_tool_latency_seconds", "Time spent in each tool call.", ["tool"])
+SSE_SESSIONS = metrics.gauge(
+    "game_sse_sessions", "SSE sessions being served (a client that left is noticed on the next write to it).")
+metrics.gauge("game_live_bombs", "Bombs held by the registry.", function=lambda: len(bombs))
+metrics.counter("game_bombs_evicted_total", "Bombs evicted for being idle or over max_bombs.",
+                function=lambda: bombs.evicted)
+RESETS = metrics.counter("game_resets_total", "Bomb resets, by requested module.", ["module"])
+ACTIONS = metrics.counter(
+    "game_actions_total",
+    "Commands run on a module, by module type and result (changed, disarmed, exploded, incorrect or unknown).",
+    ["module", "result"])
 
 BOMB_EXPLODED = f"=== BOOM! THE BOMB HAS EXPLODED. GAME OVER. === \n\n'"
 BOMB_DISARMED = f"=== BOMB SUCCESSFULLY DISARMED! CONGRATULATIONS! ===\n\n"
@@ -33,92 +57,266 @@ and the expert must provide clear instructions based on the manual.
 """
 
 
+def format_commands(actions: list[str]) -> str:
+    res = "\nAvailable commands:" + "\n"
+    for action in actions:
+        res += f"  {action}" + "\n"
+    return res
+
+
+def format_state(bomb) -> str:
+    res = f"=== BOMB STATE ===\n\n"
+
+    state, actions = bomb.state()
+    res += state + "\n"
+    if actions:
+        res += format_commands(actions)
+    res += "\n"
+
+    return res
+
+
+def format_result(bomb, result: ActionResult) -> str:
+    if result == ActionResult.CHANGED:
+        res = "The module state has changed." + "\n"
+        state, actions = bomb.state()
+        res += "\nCurrent state:" + "\n"
+        res += state
+        if actions:
+            res += format_commands(actions)
+        res += "\n"
+
+        return res
+
+    elif result == ActionResult.DISARMED:
+        return BOMB_DISARMED
+    elif result == ActionResult.EXPLODED:
+        return BOMB_EXPLODED
+
+    return UNKNOWN_COMMAND
+
+
+def is_action(command: str) -> bool:
+    return command.startswith(("cut", "press", "hold", "release"))
+
+
+def instrumented(tool):
+    """Count the calls, errors and latency of a tool."""
+    name = tool.__name__
+
+    @functools.wraps(tool)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await tool(*args, **kwargs)
+        except Exception:
+            TOOL_ERRORS.inc(tool=name)
+            raise
+        finally:
+            TOOL_CALLS.inc(tool=name)
+            TOOL_LATENCY.observe(time.perf_counter() - start, tool=name)
+
+    return wrapper
+
+
+def do_action(bomb, command: str) -> ActionResult:
+    """Run an action on a bomb, counting its outcome for the module it was run on."""
+    module, index = module_name(bomb), bomb.current_module
+    result = bomb.do_action(command)
+    if result == ActionResult.CHANGED and bomb.current_module != index:
+        outcome = "disarmed"
+    else:
+        outcome = result.value.lower()
+    ACTIONS.inc(module=module or "none", result=outcome)
+    return result
+
+
+def count_unknown(bomb):
+    """Count a command that is not an action for the bomb's current module."""
+    ACTIONS.inc(module=module_name(bomb) or "none", result="unknown")
+
+
+def run_command(bomb, command: str) -> Tuple[Optional[ActionResult], str]:
+    """Run a command on a bomb: the action result (None for anything but an action) and the reply text."""
+    if command == "help":
+        return None, HELP_TEXT
+    if command == "state":
+        return None, format_state(bomb)
+    if is_action(command):
+        result = do_action(bomb, command)
+        return result, format_result(bomb, result)
+    count_unknown(bomb)
+    return None, UNKNOWN_COMMAND
+
+
 @mcp.tool()
-async def game_interaction(command: str) -> str:
+@instrumented
+async def game_interaction(command: str, episode_id: str = DEFAULT_EPISODE) -> str:
     """Get the current status of the game.
 
     Args:
         command: str: The command to execute.
+        episode_id: str: The episode whose bomb the command is for.
     """
-    print(f"Received command: {command}")
+    logger.debug("Received command: %s", command)
     if command == "help":
         return HELP_TEXT
 
-    elif command == "state":
-        res = f"=== BOMB STATE ===\n\n"
+    async with bombs.use(episode_id) as bomb:
+        return run_command(bomb, command)[1]
 
-        state, actions = bomb.state()
-        res += state + "\n"
-        if actions:
-            res += "\nAvailable commands:" + "\n"
-            for action in actions:
-                res += f"  {action}" + "\n"
-        res += "\n"
 
-        return res
+@mcp.tool()
+@instrumented
+async def game_state(command: str = "state", episode_id: str = DEFAULT_EPISODE, include_text: bool = False) -> str:
+    """Run a command like game_interaction, but reply with the bomb's state as a JSON object.
 
-    elif command.startswith(("cut", "press", "hold", "release")):
-        result = bomb.do_action(command)
+    The object has the fields: status ("active", "exploded" or "disarmed"), module ("wire",
+    "button", "simon", "memory" or null once the bomb is over), module_index, modules (count),
+    fields (what the module shows, e.g. {"wire_colors": [...]}), actions (the available
+    commands), result (of the action: "Changed", "Disarmed", "Exploded", "Incorrect", or null),
+    error ("Unknown command" for commands that are neither state, help nor an action),
+    manual_version (see get_manual) and text (game_interaction's reply, if include_text).
 
-        if result == ActionResult.CHANGED:
-            res = "The module state has changed." + "\n"
-            state, actions = bomb.state()
-            res += "\nCurrent state:" + "\n"
-            res += state
-            if actions:
-                res += "\nAvailable commands:" + "\n"
-                for action in actions:
-                    res += f"  {action}" + "\n"
-            res += "\n"
+    Args:
+        command: str: The command to execute, "state" to only get the state.
+        episode_id: str: The episode whose bomb the command is for.
+        include_text: bool: Also include the text reply of game_interaction.
+    """
+    logger.debug("Received command: %s", command)
+    async with bombs.use(episode_id) as bomb:
+        result, text = run_command(bomb, command)
+        error = "Unknown command" if text == UNKNOWN_COMMAND and result is None else None
+        state = describe(bomb, result, error, bombs.manual_version(episode_id), text if include_text else None)
+        return state.to_json()
 
-            return res
 
-        elif result == ActionResult.DISARMED:
-            return BOMB_DISARMED
-        elif result == ActionResult.EXPLODED:
-            return BOMB_EXPLODED
+@mcp.tool()
+@instrumented
+async def game_interaction_batch(commands: list[str], episode_id: str = DEFAULT_EPISODE) -> str:
+    """Execute a list of bomb actions in order, in one call.
 
-    return UNKNOWN_COMMAND
+    The actions are applied without other calls on the same bomb in between, and execution stops
+    at the first one that disarms or explodes the bomb. Returns the result of every executed
+    action followed by the final state only.
 
+    Args:
+        commands: list[str]: The actions to execute, e.g. ["press red", "press blue"].
+        episode_id: str: The episode whose bomb the commands are for.
+    """
+    logger.debug("Received commands: %s", commands)
+    res = "=== BATCH RESULTS ===\n\n"
 
-@mcp.tool()
-async def get_manual() -> str:
-    """Get the manual for the game."""
+    async with bombs.use(episode_id) as bomb:
+        result = None
+        for i, command in enumerate(commands, 1):
+            if is_action(command):
+                result = do_action(bomb, command)
+                res += f"{i}. {command}: {result.value}\n"
+            else:
+                count_unknown(bomb)
+                result = None
+                res += f"{i}. {command}: Unknown command\n"
+
+            if result in (ActionResult.DISARMED, ActionResult.EXPLODED):
+                res += f"Stopped after command {i} of {len(commands)}.\n"
+                break
+        res += "\n"
+
+        if result == ActionResult.DISARMED:
+            return res + BOMB_DISARMED
+        elif result == ActionResult.EXPLODED:
+            return res + BOMB_EXPLODED
+        return res + format_state(bomb)
+
+
+def manual_text(bomb) -> str:
     if bomb.exploded:
         return BOMB_EXPLODED
     if bomb.disarmed:
         return BOMB_DISARMED
-
     return bomb.modules[bomb.current_module].instruction()
 
 
 @mcp.tool()
-async def reset(module: str):
-    global bomb
-    bomb = Bomb(module)
+@instrumented
+async def get_manual(episode_id: str = DEFAULT_EPISODE, if_none_match: Optional[str] = None) -> str:
+    """Get the manual for the game.
+
+    The manual only changes when the bomb moves to its next module, is reset, or is over. Pass
+    the version of the manual you hold as if_none_match to get it only if it changed.
+
+    Args:
+        episode_id: str: The episode whose bomb the manual is for.
+        if_none_match: str: Version of the manual the caller holds ("" for none). If given, the reply
+            starts with a "Manual version: <version>" line, followed by the manual, or by
+            "=== MANUAL NOT MODIFIED ===" if the version is unchanged.
+    """
+    async with bombs.use(episode_id) as bomb:
+        if if_none_match is None:
+            return manual_text(bomb)
+
+        version = bombs.manual_version(episode_id)
+        if version == if_none_match:
+            return f"{MANUAL_VERSION}{version}\n{MANUAL_NOT_MODIFIED}"
+        return f"{MANUAL_VERSION}{version}\n{manual_text(bomb)}"
+
+
+@mcp.tool()
+@instrumented
+async def reset(module: str, episode_id: str = DEFAULT_EPISODE, seed: Optional[int] = None):
+    """Start a new bomb for an episode.
+
+    Args:
+        module: str: Module of the new bomb, all modules for anything but wire/button/simon/memory.
+        episode_id: str: The episode to reset.
+        seed: int: Seed of the bomb, the same seed always gives the same bomb (a random one if omitted).
+    """
+    await bombs.reset(episode_id, module, seed)
+    RESETS.inc(module=module if module in ("wire", "button", "simon", "memory") else "all")
     return 'Game resetted'
 
 
+@mcp.tool()
+@instrumented
+async def end_episode(episode_id: str):
+    """Discard the bomb of a finished episode, freeing it before it would be evicted.
+
+    Args:
+        episode_id: str: The episode to end; calls for it fail until it is reset again.
+    """
+    bombs.discard(episode_id)
+    return 'Episode ended'
+
+
 def create_starlette_app(mcp_server: Server, *, debug: bool = False) -> Starlette:
     """Create a Starlette application that can server the provied mcp server with SSE."""
     sse = SseServerTransport("/session_id/")
 
     async def handle_sse(request: Request) -> None:
-        async with sse.connect_sse(
-            request.scope,
-            request.receive,
-            request._send,  # noqa: SLF001
-        ) as (read_stream, write_stream):
-            await mcp_server.run(
-                read_stream,
-                write_stream,
-                mcp_server.create_initialization_options(),
-            )
+        SSE_SESSIONS.inc()
+        try:
+            async with sse.connect_sse(
+                request.scope,
+                request.receive,
+                request._send,  # noqa: SLF001
+            ) as (read_stream, write_stream):
+                await mcp_server.run(
+                    read_stream,
+                    write_stream,
+                    mcp_server.create_initialization_options(),
+                )
+        finally:
+            SSE_SESSIONS.dec()
+
+    async def handle_metrics(request: Request) -> Response:
+        return Response(metrics.render(), media_type=CONTENT_TYPE)
 
     return Starlette(
         debug=debug,
         routes=[
             Route("/", endpoint=handle_sse),
+            Route("/metrics", endpoint=handle_metrics),
             Mount("/session_id/", app=sse.handle_post_message),
         ],
     )
@@ -130,8 +328,18 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Run MCP SSE-based server')
     parser.add_argument('--host', default='0.0.0.0', help='Host to bind to')
     parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--max-bombs', type=int, default=10000, help='Maximum number of live bombs')
+    parser.add_argument('--bomb-ttl', type=float, default=3600.0, help='Seconds before an idle bomb is evicted')
+    parser.add_argument('--log-level', default='INFO', help='Lowest level the server logs, DEBUG logs every command')
+    parser.add_argument('--log-rate', type=float, default=10.0, help='Log records per second per logger and level (0 for no limit)')
     args = parser.parse_args()
 
+    configure_logging(rate=args.log_rate)
+    logger.setLevel(args.log_level.upper())
+
+    bombs.max_bombs = args.max_bombs
+    bombs.ttl = args.bomb_ttl
+
     # Bind SSE request handling to MCP server
     starlette_app = create_starlette_app(mcp_server, debug=True)
 
@@ -0,0 +1,75 @@
+"""
+Leveled, rate-limited logging for the game server.
+
+Request handlers log through the standard `logging` module. configure_logging() sends the
+records through a queue to a listener thread, so handlers never block on writing to stderr,
+and a RateLimitFilter drops records beyond a sustained rate per logger and level, reporting
+how many were dropped on the next record let through.
+"""
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per (logger, level): lets `rate` records per second through, in bursts of up to `burst`."""
+
+    def __init__(self, rate: float = 10.0, burst: int = 20):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.dropped = 0
+        self._buckets: Dict[Tuple[str, int], Tuple[float, float, int]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.levelno)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, dropped = self._buckets.get(key, (float(self.burst), now, 0))
+            tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+            if tokens < 1.0:
+                self._buckets[key] = (tokens, now, dropped + 1)
+                self.dropped += 1
+                return False
+            self._buckets[key] = (tokens - 1.0, now, 0)
+        if dropped:
+            record.msg = f"{record.msg} ({dropped} similar messages suppressed)"
+        return True
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging(level: str = "INFO", rate: float = 10.0, burst: int = 20,
+                      handler: Optional[logging.Handler] = None) -> RateLimitFilter:
+    """
+    Route the root logger through a rate limit and a background writer.
+
+    :param level: Lowest level logged, e.g. "DEBUG" to log every command.
+    :param rate: Records per second let through per logger and level (0 for no limit).
+    :param burst: Records let through at once before the rate applies.
+    :param handler: Where records are written, stderr if None.
+    :return: The rate limit filter, whose `dropped` counts the records it dropped.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    handler = handler or logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    rate_limit = RateLimitFilter(rate, burst)
+    if rate > 0:
+        queue_handler.addFilter(rate_limit)
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level.upper())
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+    return rate_limit